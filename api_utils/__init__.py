@@ -19,6 +19,8 @@ from .routes import (
     chat_completions,
     cancel_request,
     get_queue_status,
+    get_stage_timings,
+    get_metrics,
     websocket_log_endpoint
 )
 
@@ -31,11 +33,23 @@ from .utils import (
     clear_stream_queue,
     use_helper_get_response,
     validate_chat_request,
+    get_requested_model_id,
     prepare_combined_prompt,
+    build_prompt_contents,
     estimate_tokens,
     calculate_usage_stats
 )
 
+# 辅助流通道
+from .stream_channel import (
+    StreamChannel
+)
+
+# 请求调度队列
+from .request_scheduler import (
+    RequestScheduler
+)
+
 # 请求处理器
 from .request_processor import (
     _process_request_refactored
@@ -59,6 +73,8 @@ __all__ = [
     'chat_completions',
     'cancel_request',
     'get_queue_status',
+    'get_stage_timings',
+    'get_metrics',
     'websocket_log_endpoint',
     # 工具函数
     'generate_sse_chunk',
@@ -68,9 +84,15 @@ __all__ = [
     'clear_stream_queue',
     'use_helper_get_response',
     'validate_chat_request',
+    'get_requested_model_id',
     'prepare_combined_prompt',
+    'build_prompt_contents',
     'estimate_tokens',
     'calculate_usage_stats',
+    # 辅助流通道
+    'StreamChannel',
+    # 请求调度队列
+    'RequestScheduler',
     # 请求处理器
     '_process_request_refactored',
     # 队列工作器
@@ -0,0 +1,107 @@
+"""
+准入控制模块
+按模型和流式模式记录请求处理耗时的 EWMA，据此估算新请求在目标队列中的等待时间：
+预计等待超过 ADMISSION_MAX_WAIT_S 或队列长度达到 ADMISSION_MAX_QUEUE_LENGTH 时直接以 429 拒绝，
+并按队列的消化速度计算 Retry-After，避免请求在队列中等到超时 (504)
+"""
+
+import math
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from config import ADMISSION_MAX_WAIT_S, ADMISSION_MAX_QUEUE_LENGTH
+from .backend_pool import LATENCY_EWMA_ALPHA, DEFAULT_LATENCY_SECONDS
+from .utils import get_requested_model_id
+
+# 未指定模型（沿用页面当前模型）的请求使用的键
+DEFAULT_MODEL_KEY = "default"
+
+# (模型ID, 是否流式) -> 处理耗时 EWMA（秒）
+_service_time_ewma: Dict[Tuple[str, bool], float] = {}
+
+
+def service_key(request: Any) -> Tuple[str, bool]:
+    return (get_requested_model_id(request) or DEFAULT_MODEL_KEY, bool(getattr(request, "stream", False)))
+
+
+def record_service_time(key: Tuple[str, bool], duration: float) -> None:
+    """记录一次正常完成请求的处理耗时"""
+    previous = _service_time_ewma.get(key)
+    if previous is None:
+        _service_time_ewma[key] = duration
+    else:
+        _service_time_ewma[key] = LATENCY_EWMA_ALPHA * duration + (1 - LATENCY_EWMA_ALPHA) * previous
+
+
+def estimate_service_time(key: Optional[Tuple[str, bool]]) -> float:
+    """预计处理耗时：同模型同模式 -> 同模型另一模式 -> 全部记录的平均值 -> 默认值"""
+    if key is not None:
+        if key in _service_time_ewma:
+            return _service_time_ewma[key]
+        other_mode = _service_time_ewma.get((key[0], not key[1]))
+        if other_mode is not None:
+            return other_mode
+    if _service_time_ewma:
+        return sum(_service_time_ewma.values()) / len(_service_time_ewma)
+    return DEFAULT_LATENCY_SECONDS
+
+
+def project_wait(queue, slots: Iterable[Any]) -> float:
+    """
+    新请求在 queue 中的预计等待时间（秒）：排队请求的预计耗时与处理中请求的剩余耗时之和，
+    除以服务该队列的可用页面数。没有可用页面时为 inf
+    """
+    serving = [slot for slot in slots if slot.request_queue is queue and slot.is_available]
+    if not serving:
+        return math.inf
+    now = time.time()
+    work = sum(estimate_service_time(service_key(item.get("request_data"))) for item in queue.pending_items())
+    for slot in serving:
+        if slot.is_busy:
+            work += max(0.0, estimate_service_time(slot.current_service_key) - (now - slot.last_used))
+    return work / len(serving)
+
+
+def evaluate_admission(queue, slots: Iterable[Any]) -> Tuple[float, Optional[int]]:
+    """
+    返回 (预计等待秒数, Retry-After 秒数)；Retry-After 为 None 表示接受请求。
+    没有可用页面时不做判断，交给原有的可用性检查处理
+    """
+    slots = list(slots)
+    projected_wait = project_wait(queue, slots)
+    if math.isinf(projected_wait):
+        return projected_wait, None
+
+    retry_after = 0.0
+    if ADMISSION_MAX_WAIT_S > 0 and projected_wait > ADMISSION_MAX_WAIT_S:
+        # 队列按实时速度消化，超出预算的部分即需要等待的时间
+        retry_after = projected_wait - ADMISSION_MAX_WAIT_S
+    queued = queue.qsize()
+    if ADMISSION_MAX_QUEUE_LENGTH > 0 and queued >= ADMISSION_MAX_QUEUE_LENGTH:
+        serving = sum(1 for slot in slots if slot.request_queue is queue and slot.is_available)
+        per_item = sum(estimate_service_time(service_key(item.get("request_data"))) for item in queue.pending_items()) / queued
+        retry_after = max(retry_after, (queued - ADMISSION_MAX_QUEUE_LENGTH + 1) * per_item / serving)
+    if retry_after <= 0:
+        return projected_wait, None
+    return projected_wait, max(1, math.ceil(retry_after))
+
+
+def describe_admission(queues: Iterable[Tuple[str, Any, Iterable[Any]]]) -> Dict[str, Any]:
+    """用于 /v1/queue 的准入控制状态；queues 为 (名称, 队列, 页面列表)"""
+    projections = []
+    for name, queue, slots in queues:
+        projected_wait = project_wait(queue, slots)
+        projections.append({
+            "queue": name,
+            "queue_length": queue.qsize(),
+            "projected_wait_seconds": None if math.isinf(projected_wait) else round(projected_wait, 2),
+        })
+    return {
+        "max_wait_seconds": ADMISSION_MAX_WAIT_S or None,
+        "max_queue_length": ADMISSION_MAX_QUEUE_LENGTH or None,
+        "service_time_ewma_seconds": {
+            f"{model_id}/{'stream' if streaming else 'non-stream'}": round(value, 3)
+            for (model_id, streaming), value in sorted(_service_time_ewma.items())
+        },
+        "queues": projections,
+    }
@@ -24,6 +24,7 @@ from models import WebSocketConnectionManager
 
 # --- logging_utils模块导入 ---
 from logging_utils import setup_server_logging, restore_original_streams
+from logging_utils.tracing import configure_tracing, shutdown_tracing
 
 # --- browser_utils模块导入 ---
 from browser_utils import (
@@ -31,12 +32,21 @@ from browser_utils import (
     _close_page_logic,
     load_excluded_models,
     _handle_initial_model_state_and_storage,
-    enable_temporary_chat_mode
+    enable_temporary_chat_mode,
+    record_generation_config_ack
 )
 
 import stream
-from asyncio import Queue, Lock
+from asyncio import Lock
 from . import auth_utils
+from .stream_channel import StreamChannel
+from .client_disconnect import ResponseCompletionMiddleware
+from .request_scheduler import RequestScheduler
+from .page_pool import build_page_pool, close_page_pool
+from .warm_pages import open_warm_pages
+from .backend_pool import (
+    create_primary_backend, create_extra_backends, start_backend_instance, close_backend_instance
+)
 
 # 全局状态变量（这些将在server.py中被引用）
 playwright_manager: Optional[AsyncPlaywright] = None
@@ -53,12 +63,17 @@ model_list_fetch_event = None
 
 current_ai_studio_model_id = None
 model_switching_lock = None
+model_switch_counts = {}
+affinity_promoted_requests = 0
 
 excluded_model_ids = set()
 
 request_queue = None
 processing_lock = None
 worker_task = None
+page_pool = []
+backend_pool = []
+worker_tasks = []
 
 page_params_cache = {}
 params_cache_lock = None
@@ -66,7 +81,11 @@ params_cache_lock = None
 log_ws_manager = None
 
 STREAM_QUEUE = None
+STREAM_CONTROL_QUEUE = None
 STREAM_PROCESS = None
+STREAM_CHANNEL = None
+
+direct_engine = None
 
 # --- Lifespan Context Manager ---
 def _setup_logging():
@@ -83,7 +102,7 @@ def _setup_logging():
 
 def _initialize_globals():
     import server
-    server.request_queue = Queue()
+    server.request_queue = RequestScheduler()
     server.processing_lock = Lock()
     server.model_switching_lock = Lock()
     server.params_cache_lock = Lock()
@@ -114,9 +133,19 @@ async def _start_stream_proxy():
         STREAM_PROXY_SERVER_ENV = os.environ.get('UNIFIED_PROXY_CONFIG') or os.environ.get('HTTPS_PROXY') or os.environ.get('HTTP_PROXY')
         server.logger.info(f"Starting STREAM proxy on port {port} with upstream proxy: {STREAM_PROXY_SERVER_ENV}")
         server.STREAM_QUEUE = multiprocessing.Queue()
-        server.STREAM_PROCESS = multiprocessing.Process(target=stream.start, args=(server.STREAM_QUEUE, port, STREAM_PROXY_SERVER_ENV))
+        server.STREAM_CONTROL_QUEUE = multiprocessing.Queue()
+        server.STREAM_PROCESS = multiprocessing.Process(
+            target=stream.start,
+            args=(server.STREAM_QUEUE, port, STREAM_PROXY_SERVER_ENV, server.STREAM_CONTROL_QUEUE, STREAM_RECORD_DIR or None)
+        )
         server.STREAM_PROCESS.start()
         server.logger.info("STREAM proxy process started.")
+        if STREAM_RECORD_DIR:
+            server.logger.info(f"STREAM proxy record mode enabled, captures are written to: {STREAM_RECORD_DIR}")
+        server.STREAM_CHANNEL = StreamChannel(
+            server.STREAM_QUEUE, server.logger, on_config_rewrite=record_generation_config_ack
+        )
+        server.STREAM_CHANNEL.start()
 
 async def _initialize_browser_and_page():
     import server
@@ -155,17 +184,32 @@ async def _shutdown_resources():
     logger = server.logger
     logger.info("Shutting down resources...")
     
+    if server.STREAM_CHANNEL:
+        server.STREAM_CHANNEL.stop()
+
+    if server.direct_engine:
+        await server.direct_engine.close()
+        server.direct_engine = None
+
     if server.STREAM_PROCESS:
         server.STREAM_PROCESS.terminate()
         logger.info("STREAM proxy terminated.")
 
-    if server.worker_task and not server.worker_task.done():
-        server.worker_task.cancel()
+    running_workers = [task for task in server.worker_tasks if not task.done()]
+    if running_workers:
+        for task in running_workers:
+            task.cancel()
         try:
-            await asyncio.wait_for(server.worker_task, timeout=5.0)
+            await asyncio.wait_for(asyncio.gather(*running_workers, return_exceptions=True), timeout=5.0)
         except (asyncio.TimeoutError, asyncio.CancelledError):
             pass
-        logger.info("Worker task stopped.")
+        logger.info(f"Worker tasks stopped ({len(running_workers)}).")
+
+    for instance in server.backend_pool[1:]:
+        await close_backend_instance(instance, logger)
+
+    if server.page_pool:
+        await close_page_pool(server.page_pool, logger)
 
     if server.page_instance:
         await _close_page_logic()
@@ -191,6 +235,8 @@ async def lifespan(app: FastAPI):
     _initialize_globals()
     _initialize_proxy_settings()
     load_excluded_models(EXCLUDED_MODELS_FILENAME)
+    if configure_tracing(TRACE_EXPORT_PATH):
+        logger.info(f"Request tracing enabled, spans exported to {TRACE_EXPORT_PATH}")
     
     server.is_initializing = True
     logger.info("Starting AI Studio Proxy Server...")
@@ -201,11 +247,32 @@ async def lifespan(app: FastAPI):
         
         launch_mode = os.environ.get('LAUNCH_MODE', 'unknown')
         if server.is_page_ready or launch_mode == "direct_debug_no_browser":
-            server.worker_task = asyncio.create_task(queue_worker())
-            logger.info("Request processing worker started.")
+            primary_backend = create_primary_backend()
+            server.page_pool = await build_page_pool(server.page_instance, PAGE_POOL_SIZE, logger, backend=primary_backend)
+            primary_backend.page_pool = server.page_pool
+            if launch_mode != "direct_debug_no_browser":
+                await open_warm_pages(primary_backend, logger)
+            server.backend_pool = [primary_backend]
+            if launch_mode != "direct_debug_no_browser":
+                for instance in create_extra_backends(primary_backend, logger):
+                    if await start_backend_instance(instance, logger):
+                        server.backend_pool.append(instance)
+
+            server.worker_tasks = []
+            for instance in server.backend_pool:
+                for slot in instance.page_pool:
+                    slot.worker_task = asyncio.create_task(queue_worker(slot))
+                    server.worker_tasks.append(slot.worker_task)
+            server.worker_task = server.worker_tasks[0]
+            logger.info(f"Request processing workers started ({len(server.worker_tasks)} across {len(server.backend_pool)} backend(s)).")
         else:
             raise RuntimeError("Failed to initialize browser/page, worker not started.")
 
+        if ENABLE_DIRECT_ENGINE:
+            from .direct_engine import DirectGenerateEngine
+            server.direct_engine = DirectGenerateEngine(logger, DIRECT_ENGINE_ENDPOINT, DIRECT_ENGINE_MAX_CONNECTIONS)
+            logger.info(f"Direct GenerateContent engine enabled (endpoint: {DIRECT_ENGINE_ENDPOINT or 'page template'}).")
+
         logger.info("Server startup complete.")
         server.is_initializing = False
         yield
@@ -218,6 +285,7 @@ async def lifespan(app: FastAPI):
         await _shutdown_resources()
         restore_original_streams(initial_stdout, initial_stderr)
         restore_original_streams(*original_streams)
+        shutdown_tracing()
         logger.info("Server shutdown complete.")
 
 
@@ -282,14 +350,15 @@ def create_app() -> FastAPI:
         lifespan=lifespan
     )
     
-    # 添加中间件
+    # 添加中间件（后添加的在外层；响应完成中间件须在最外层，见 client_disconnect 模块）
     app.add_middleware(APIKeyAuthMiddleware)
+    app.add_middleware(ResponseCompletionMiddleware)
 
     # 注册路由
     from .routes import (
         read_index, get_css, get_js, get_api_info,
         health_check, list_models, chat_completions,
-        cancel_request, get_queue_status, websocket_log_endpoint,
+        cancel_request, get_queue_status, get_stage_timings, get_metrics, websocket_log_endpoint,
         get_api_keys, add_api_key, test_api_key, delete_api_key
     )
     from fastapi.responses import FileResponse
@@ -303,6 +372,8 @@ def create_app() -> FastAPI:
     app.post("/v1/chat/completions")(chat_completions)
     app.post("/v1/cancel/{req_id}")(cancel_request)
     app.get("/v1/queue")(get_queue_status)
+    app.get("/api/stage-timings")(get_stage_timings)
+    app.get("/metrics")(get_metrics)
     app.websocket("/ws/logs")(websocket_log_endpoint)
 
     # API密钥管理端点
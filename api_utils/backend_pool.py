@@ -0,0 +1,334 @@
+"""
+后端实例池模块
+每个后端实例对应一个独立的 Camoufox 浏览器（独立的 Google 账号认证文件、页面池、
+请求队列和辅助流代理端口），新请求按负载分配给最空闲的健康实例
+"""
+
+import asyncio
+import glob
+import logging
+import math
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from config import (
+    ACTIVE_AUTH_DIR, NO_PROXY_ENV, PAGE_POOL_SIZE, STREAM_RECORD_DIR,
+    EXTRA_CAMOUFOX_WS_ENDPOINTS, EXTRA_AUTH_JSON_PATHS, BACKEND_MAX_CONSECUTIVE_FAILURES
+)
+from .request_scheduler import RequestScheduler
+
+# 处理耗时 EWMA 的平滑系数
+LATENCY_EWMA_ALPHA = 0.3
+# 尚无耗时数据时使用的估计值（秒）
+DEFAULT_LATENCY_SECONDS = 10.0
+# 连续失败达到阈值后暂停分配请求的时长（秒）
+FAILURE_COOLDOWN_SECONDS = 60.0
+
+
+class BackendInstance:
+    """单个后端实例（浏览器 + 账号）及其调度状态"""
+
+    def __init__(self, index: int, ws_endpoint: Optional[str], auth_path: Optional[str],
+                 stream_port: Optional[int], mirrors_globals: bool = False):
+        self.index = index
+        self.ws_endpoint = ws_endpoint
+        self.auth_path = auth_path
+        self.stream_port = stream_port
+        # 主实例与 server 模块中的全局状态保持一致
+        self.mirrors_globals = mirrors_globals
+        self.page_pool: List[Any] = []
+        # 常驻模型页面，按最近使用顺序排列（最久未用的在前）
+        self.warm_pages: "OrderedDict[str, Any]" = OrderedDict()
+        self.warm_pages_opening: Set[str] = set()
+        self._last_page_index = 0
+        self._browser = None
+        self.context = None
+        self.stream_process: Optional[multiprocessing.Process] = None
+        self._stream_control_queue: Optional[multiprocessing.Queue] = None
+        if mirrors_globals:
+            import server
+            self.request_queue: RequestScheduler = server.request_queue
+            self.model_switching_lock: asyncio.Lock = server.model_switching_lock
+        else:
+            self.request_queue = RequestScheduler()
+            # 模型偏好保存在各自浏览器上下文的 localStorage 中，实例之间互不影响
+            self.model_switching_lock = asyncio.Lock()
+        self.latency_ewma: Optional[float] = None
+        self.consecutive_failures = 0
+        self.last_failure_time = 0.0
+        self.last_error: Optional[str] = None
+        self.routed_requests = 0
+        self.failed_requests = 0
+
+    @property
+    def name(self) -> str:
+        return f"backend-{self.index}"
+
+    @property
+    def browser(self):
+        if self.mirrors_globals:
+            import server
+            return server.browser_instance
+        return self._browser
+
+    @browser.setter
+    def browser(self, browser) -> None:
+        self._browser = browser
+
+    @property
+    def stream_control_queue(self) -> Optional[multiprocessing.Queue]:
+        """发往该实例辅助流代理的控制队列"""
+        if self.mirrors_globals:
+            import server
+            return server.STREAM_CONTROL_QUEUE
+        return self._stream_control_queue
+
+    @property
+    def is_browser_connected(self) -> bool:
+        browser = self.browser
+        return bool(browser and browser.is_connected())
+
+    def next_page_index(self) -> int:
+        """为新打开的页面分配实例内唯一的序号"""
+        self._last_page_index = max([self._last_page_index] + [slot.index for slot in self.page_pool]) + 1
+        return self._last_page_index
+
+    @property
+    def queued_requests(self) -> int:
+        return sum(queue.qsize() for queue in self.all_queues())
+
+    def all_queues(self) -> List[RequestScheduler]:
+        """实例共享队列及各常驻模型页面的独立队列"""
+        return [self.request_queue] + [slot.own_queue for slot in self.page_pool if slot.own_queue is not None]
+
+    @property
+    def available_slots(self) -> int:
+        return sum(1 for slot in self.page_pool if slot.is_available)
+
+    @property
+    def busy_slots(self) -> int:
+        return sum(1 for slot in self.page_pool if slot.is_busy)
+
+    @property
+    def workers_running(self) -> bool:
+        return any(slot.worker_task and not slot.worker_task.done() for slot in self.page_pool)
+
+    @property
+    def in_failure_cooldown(self) -> bool:
+        return (self.consecutive_failures >= BACKEND_MAX_CONSECUTIVE_FAILURES
+                and time.time() - self.last_failure_time < FAILURE_COOLDOWN_SECONDS)
+
+    @property
+    def is_healthy(self) -> bool:
+        return (self.is_browser_connected and self.available_slots > 0
+                and self.workers_running and not self.in_failure_cooldown)
+
+    def load_score(self, fallback_latency: float = DEFAULT_LATENCY_SECONDS) -> float:
+        """预计新请求完成所需时间：(排队 + 处理中 + 1) / 可用页面数 × 近期平均耗时"""
+        slots = self.available_slots
+        if slots == 0:
+            return math.inf
+        outstanding = self.queued_requests + self.busy_slots + 1
+        latency = self.latency_ewma if self.latency_ewma is not None else fallback_latency
+        return outstanding / slots * latency
+
+    def record_request(self, duration: float, failed: bool, count_latency: bool = True) -> None:
+        """记录一次请求的处理结果，用于负载评分和健康判断"""
+        if failed:
+            self.failed_requests += 1
+            self.consecutive_failures += 1
+            self.last_failure_time = time.time()
+            return
+        self.consecutive_failures = 0
+        if count_latency:
+            if self.latency_ewma is None:
+                self.latency_ewma = duration
+            else:
+                self.latency_ewma = LATENCY_EWMA_ALPHA * duration + (1 - LATENCY_EWMA_ALPHA) * self.latency_ewma
+
+    def describe(self) -> Dict[str, Any]:
+        """用于 /health 和 /v1/queue 的状态描述"""
+        return {
+            "name": self.name,
+            "healthy": self.is_healthy,
+            "browser_connected": self.is_browser_connected,
+            "ws_endpoint": self.ws_endpoint,
+            "auth_file": os.path.basename(self.auth_path) if self.auth_path else None,
+            "stream_port": self.stream_port,
+            "queue_length": self.queued_requests,
+            "warm_pages": list(self.warm_pages.keys()),
+            "busy_pages": self.busy_slots,
+            "available_pages": self.available_slots,
+            "latency_ewma_seconds": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "load_score": round(self.load_score(), 3) if self.available_slots else None,
+            "routed_requests": self.routed_requests,
+            "failed_requests": self.failed_requests,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "pages": [slot.describe() for slot in self.page_pool],
+        }
+
+
+def classify_request_outcome(result_future: asyncio.Future) -> str:
+    """
+    根据结果 Future 判断请求结果：
+    'ok' 正常完成或 4xx，'cancelled' 客户端断开/取消，'failed' 后端错误 (5xx 或未知异常)
+    """
+    if not result_future.done() or result_future.cancelled():
+        return 'cancelled'
+    exc = result_future.exception()
+    if exc is None:
+        return 'ok'
+    status_code = getattr(exc, 'status_code', 500)
+    if status_code == 499:
+        return 'cancelled'
+    return 'failed' if status_code >= 500 else 'ok'
+
+
+def select_backend(backends: List[BackendInstance]) -> Optional[BackendInstance]:
+    """选择预计完成时间最短的健康实例；没有健康实例时返回主实例"""
+    if not backends:
+        return None
+    healthy = [b for b in backends if b.is_healthy]
+    if not healthy:
+        return backends[0]
+    known_latencies = [b.latency_ewma for b in healthy if b.latency_ewma is not None]
+    fallback_latency = sum(known_latencies) / len(known_latencies) if known_latencies else DEFAULT_LATENCY_SECONDS
+    return min(healthy, key=lambda b: (b.load_score(fallback_latency), b.routed_requests))
+
+
+def all_request_queues() -> List[RequestScheduler]:
+    """所有后端实例的请求队列（后端池未建立时只有全局队列）"""
+    import server
+    backends = getattr(server, 'backend_pool', None)
+    if backends:
+        return [queue for b in backends for queue in b.all_queues()]
+    return [server.request_queue] if server.request_queue is not None else []
+
+
+def create_primary_backend() -> BackendInstance:
+    """由现有全局浏览器和页面构成的主实例"""
+    stream_port_env = os.environ.get('STREAM_PORT')
+    stream_port = None if stream_port_env == '0' else int(stream_port_env or 3120)
+    return BackendInstance(
+        0, os.environ.get('CAMOUFOX_WS_ENDPOINT'), os.environ.get('ACTIVE_AUTH_JSON_PATH'),
+        stream_port, mirrors_globals=True
+    )
+
+
+def _resolve_extra_auth_paths(count: int, logger: logging.Logger) -> List[Optional[str]]:
+    """为额外实例确定认证文件：优先 EXTRA_AUTH_JSON_PATHS，其次 auth_profiles/active 中的其它文件"""
+    paths: List[Optional[str]] = []
+    for path in EXTRA_AUTH_JSON_PATHS:
+        if not os.path.isabs(path) and not os.path.exists(path):
+            path = os.path.join(ACTIVE_AUTH_DIR, path)
+        paths.append(path)
+
+    if len(paths) < count:
+        primary_auth = os.environ.get('ACTIVE_AUTH_JSON_PATH')
+        used = {os.path.abspath(p) for p in paths if p}
+        if primary_auth:
+            used.add(os.path.abspath(primary_auth))
+        for candidate in sorted(glob.glob(os.path.join(ACTIVE_AUTH_DIR, '*.json'))):
+            if len(paths) >= count:
+                break
+            if os.path.abspath(candidate) not in used:
+                paths.append(candidate)
+                used.add(os.path.abspath(candidate))
+
+    if len(paths) < count:
+        logger.warning(f"后端池: 仅找到 {len(paths)} 个额外认证文件，其余 {count - len(paths)} 个实例将使用浏览器当前状态。")
+        paths.extend([None] * (count - len(paths)))
+    return paths[:count]
+
+
+def create_extra_backends(primary: BackendInstance, logger: logging.Logger) -> List[BackendInstance]:
+    """根据 EXTRA_CAMOUFOX_WS_ENDPOINTS 创建额外实例（尚未连接）"""
+    if not EXTRA_CAMOUFOX_WS_ENDPOINTS:
+        return []
+    auth_paths = _resolve_extra_auth_paths(len(EXTRA_CAMOUFOX_WS_ENDPOINTS), logger)
+    backends = []
+    for offset, (ws_endpoint, auth_path) in enumerate(zip(EXTRA_CAMOUFOX_WS_ENDPOINTS, auth_paths), start=1):
+        stream_port = primary.stream_port + offset if primary.stream_port else None
+        backends.append(BackendInstance(offset, ws_endpoint, auth_path, stream_port))
+    return backends
+
+
+def _start_backend_stream_proxy(instance: BackendInstance, logger: logging.Logger) -> Optional[Dict[str, str]]:
+    """为实例启动独立端口的辅助流代理，数据帧写入共享的 STREAM_QUEUE；返回浏览器上下文代理设置"""
+    import server
+    import stream
+
+    if not instance.stream_port or server.STREAM_QUEUE is None:
+        return server.PLAYWRIGHT_PROXY_SETTINGS
+
+    upstream_proxy = os.environ.get('UNIFIED_PROXY_CONFIG') or os.environ.get('HTTPS_PROXY') or os.environ.get('HTTP_PROXY')
+    logger.info(f"后端池: 为 {instance.name} 启动辅助流代理，端口 {instance.stream_port}")
+    instance._stream_control_queue = multiprocessing.Queue()
+    instance.stream_process = multiprocessing.Process(
+        target=stream.start,
+        args=(server.STREAM_QUEUE, instance.stream_port, upstream_proxy, instance._stream_control_queue, STREAM_RECORD_DIR or None)
+    )
+    instance.stream_process.start()
+
+    proxy_settings = {'server': f"http://127.0.0.1:{instance.stream_port}/"}
+    if NO_PROXY_ENV:
+        proxy_settings['bypass'] = NO_PROXY_ENV.replace(',', ';')
+    return proxy_settings
+
+
+async def start_backend_instance(instance: BackendInstance, logger: logging.Logger) -> bool:
+    """连接额外实例的浏览器并建立其页面池，失败时清理已创建的资源"""
+    import server
+    from browser_utils import _initialize_page_logic, enable_temporary_chat_mode
+    from .page_pool import build_page_pool
+    from .warm_pages import open_warm_pages
+
+    try:
+        proxy_settings = _start_backend_stream_proxy(instance, logger)
+        logger.info(f"后端池: 正在连接 {instance.name} 的浏览器: {instance.ws_endpoint}")
+        instance.browser = await server.playwright_manager.firefox.connect(instance.ws_endpoint, timeout=30000)
+        page, is_ready = await _initialize_page_logic(
+            instance.browser, storage_state_path=instance.auth_path, proxy_settings=proxy_settings
+        )
+        if not is_ready:
+            raise RuntimeError("页面初始化失败")
+        instance.context = page.context
+        await enable_temporary_chat_mode(page)
+        instance.page_pool = await build_page_pool(page, PAGE_POOL_SIZE, logger, backend=instance)
+        await open_warm_pages(instance, logger)
+        logger.info(f"后端池: {instance.name} 已就绪（{len(instance.page_pool)} 个页面）。")
+        return True
+    except Exception as e:
+        instance.last_error = str(e)
+        logger.error(f"后端池: {instance.name} 启动失败，将不参与调度: {e}", exc_info=True)
+        await close_backend_instance(instance, logger)
+        return False
+
+
+async def close_backend_instance(instance: BackendInstance, logger: logging.Logger) -> None:
+    """关闭额外实例的页面、上下文、浏览器连接和辅助流代理（主实例由全局关闭流程负责）"""
+    if instance.mirrors_globals:
+        return
+    from .page_pool import close_page_pool
+
+    if instance.page_pool:
+        await close_page_pool(instance.page_pool, logger)
+    if instance.context:
+        try:
+            await instance.context.close()
+        except Exception as e:
+            logger.warning(f"后端池: 关闭 {instance.name} 的浏览器上下文时出错: {e}")
+        instance.context = None
+    if instance.browser and instance.browser.is_connected():
+        try:
+            await instance.browser.close()
+        except Exception as e:
+            logger.warning(f"后端池: 关闭 {instance.name} 的浏览器连接时出错: {e}")
+    if instance.stream_process:
+        instance.stream_process.terminate()
+        instance.stream_process = None
+        instance._stream_control_queue = None
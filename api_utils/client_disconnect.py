@@ -0,0 +1,130 @@
+"""
+客户端断开检测模块
+每个请求只有一个监视任务：请求体读取完毕后，ASGI receive 通道上只会再出现 http.disconnect，
+监视任务直接 await 该消息，收到后设置 asyncio.Event 并依次调用登记的回调。
+路由、队列 Worker 和请求处理共用同一个监视器，无需按固定间隔轮询连接状态。
+响应发送完毕后 receive 同样返回 http.disconnect（uvicorn 的 response_complete），
+ResponseCompletionMiddleware 在最终响应体发出前结束监视，此后的断开消息不计为客户端断开
+"""
+
+import asyncio
+import logging
+from typing import Callable, List, Optional
+
+from fastapi import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# 监视器保存在 ASGI scope 中，同一请求的任意 Request 对象都能取到同一个实例
+_SCOPE_KEY = "aistudio.disconnect_watcher"
+# 最终响应体已发出的标记
+_RESPONSE_SENT_KEY = "aistudio.response_sent"
+
+logger = logging.getLogger("AIStudioProxyServer")
+
+
+class ClientDisconnectWatcher:
+    """等待单个请求的 http.disconnect 消息并分发给 Event 和回调"""
+
+    def __init__(self, req_id: str, http_request: Request):
+        self.req_id = req_id
+        self.event = asyncio.Event()
+        self._receive = http_request.receive
+        self._callbacks: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        if not http_request.scope.get(_RESPONSE_SENT_KEY):
+            self._task = asyncio.create_task(self._watch())
+
+    @property
+    def disconnected(self) -> bool:
+        return self.event.is_set()
+
+    async def wait(self) -> None:
+        await self.event.wait()
+
+    def on_disconnect(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """登记断开时调用的回调（已断开则立即调用），返回取消登记的函数"""
+        if self.disconnected:
+            self._run_callback(callback)
+            return lambda: None
+        self._callbacks.append(callback)
+
+        def remove() -> None:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+        return remove
+
+    def close(self) -> None:
+        """请求处理结束后停止监视；之后的断开不再触发回调"""
+        self._callbacks.clear()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    def finish(self) -> None:
+        """响应已发送完毕：停止监视，之后 receive 返回的 http.disconnect 不再视为客户端断开"""
+        self.close()
+
+    async def _watch(self) -> None:
+        try:
+            while True:
+                message = await self._receive()
+                # 流式请求体的剩余分块直接丢弃，只关心断开消息
+                if message.get("type") == "http.disconnect":
+                    break
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            logger.warning(f"[{self.req_id}] 读取客户端连接状态出错，按断开处理: {e}")
+        if self._task is None:
+            # 已结束监视（响应发送完毕或请求处理结束），不是客户端断开
+            return
+        self._set_disconnected()
+
+    def _set_disconnected(self) -> None:
+        self.event.set()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def _run_callback(self, callback: Callable[[], None]) -> None:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"[{self.req_id}] 客户端断开回调出错: {e}", exc_info=True)
+
+
+def watch_client_disconnect(req_id: str, http_request: Request) -> ClientDisconnectWatcher:
+    """取得请求的断开监视器，首次调用时创建并开始监视（须在请求体读取完毕后调用）"""
+    watcher = http_request.scope.get(_SCOPE_KEY)
+    if watcher is None:
+        watcher = ClientDisconnectWatcher(req_id, http_request)
+        http_request.scope[_SCOPE_KEY] = watcher
+    return watcher
+
+
+def close_client_disconnect_watcher(http_request: Request) -> None:
+    watcher = http_request.scope.pop(_SCOPE_KEY, None)
+    if watcher is not None:
+        watcher.close()
+
+
+class ResponseCompletionMiddleware:
+    """在最终响应体交给服务器之前结束该请求的断开监视（需注册为最外层中间件）"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_and_finish(message: Message) -> None:
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                scope[_RESPONSE_SENT_KEY] = True
+                watcher = scope.get(_SCOPE_KEY)
+                if watcher is not None:
+                    watcher.finish()
+            await send(message)
+
+        await self.app(scope, receive, send_and_finish)
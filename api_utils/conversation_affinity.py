@@ -0,0 +1,105 @@
+"""
+对话亲和模块
+请求结束后不清空页面上的对话，而是记录页面当前对话（请求消息 + 助手回复）的哈希；
+下一个请求的消息去掉最后一条用户消息后与之相同时，说明它延续了页面上的对话，
+只需提交新的用户消息，省去清空对话和重新提交完整历史。
+仍保留对话的页面按哈希记录在一个小型 LRU 中，超出容量的页面在下次使用时再清空
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from config import ENABLE_CONVERSATION_AFFINITY, CONVERSATION_AFFINITY_CACHE_SIZE
+
+# 对话哈希 -> 保留该对话的页面
+_live_conversations: "OrderedDict[str, Any]" = OrderedDict()
+
+
+def _canonical_content(content: Any) -> Any:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content.strip()
+    parts = []
+    for item in content:
+        if hasattr(item, "model_dump"):
+            item = item.model_dump(exclude_none=True)
+        parts.append(item)
+    return parts
+
+
+def conversation_key(messages: List[Any], reply: Optional[str] = None) -> str:
+    """消息列表（可追加一条助手回复）的哈希；只比较角色和内容，忽略客户端附加的其它字段"""
+    canonical = [[message.role, _canonical_content(message.content)] for message in messages]
+    if reply is not None:
+        canonical.append(["assistant", reply.strip()])
+    payload = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_eligible(request: Any) -> bool:
+    """工具调用的请求不参与：页面上的工具调用轮次无法与客户端回传的消息对应"""
+    if not ENABLE_CONVERSATION_AFFINITY or getattr(request, "tools", None):
+        return False
+    return all(message.role != "tool" and not message.tool_calls for message in request.messages)
+
+
+def conversation_prefix_key(request: Any) -> Optional[str]:
+    """请求可能延续的对话的哈希：以用户消息结尾且前一条为助手回复时，为去掉最后一条消息后的哈希"""
+    messages = request.messages
+    if not is_eligible(request) or len(messages) < 2:
+        return None
+    if messages[-1].role != "user" or messages[-2].role != "assistant":
+        return None
+    return conversation_key(messages[:-1])
+
+
+def find_conversation_slot(prefix_key: Optional[str]):
+    """保留该对话的页面（不存在时为 None）"""
+    if prefix_key is None:
+        return None
+    slot = _live_conversations.get(prefix_key)
+    if slot is None or slot.conversation_key != prefix_key:
+        return None
+    return slot
+
+
+def continues_conversation(slot, prefix_key: Optional[str]) -> bool:
+    return slot is not None and find_conversation_slot(prefix_key) is slot
+
+
+def remember_conversation(slot, req_id: str, request: Any, reply: str) -> None:
+    """请求正常完成后记录页面上的对话，Worker 据此跳过清空"""
+    if slot is None or not is_eligible(request):
+        return
+    forget_conversation(slot)
+    key = conversation_key(request.messages, reply)
+    slot.conversation_key = key
+    slot.conversation_req_id = req_id
+    _live_conversations[key] = slot
+    while len(_live_conversations) > CONVERSATION_AFFINITY_CACHE_SIZE:
+        _live_conversations.popitem(last=False)
+
+
+def forget_conversation(slot) -> None:
+    """页面对话已清空或状态未知（导航、切换模型、请求失败）"""
+    if slot is None:
+        return
+    key = getattr(slot, "conversation_key", None)
+    if key is not None and _live_conversations.get(key) is slot:
+        del _live_conversations[key]
+    slot.conversation_key = None
+    slot.conversation_req_id = None
+
+
+def touch_conversation(prefix_key: str) -> None:
+    if prefix_key in _live_conversations:
+        _live_conversations.move_to_end(prefix_key)
+
+
+def retains_conversation(slot, req_id: str) -> bool:
+    """该请求结束后页面是否保留对话（即 Worker 可跳过清空）"""
+    return (slot is not None and slot.conversation_req_id == req_id
+            and _live_conversations.get(slot.conversation_key) is slot)
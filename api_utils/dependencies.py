@@ -2,11 +2,13 @@
 FastAPI 依赖项模块
 """
 import logging
-from asyncio import Queue, Lock, Event
+from asyncio import Lock, Event
 from typing import Dict, Any, List, Set
 
 from fastapi import Request
 
+from .request_scheduler import RequestScheduler
+
 def get_logger() -> logging.Logger:
     from server import logger
     return logger
@@ -15,7 +17,7 @@ def get_log_ws_manager():
     from server import log_ws_manager
     return log_ws_manager
 
-def get_request_queue() -> Queue:
+def get_request_queue() -> RequestScheduler:
     from server import request_queue
     return request_queue
 
@@ -27,6 +29,22 @@ def get_worker_task():
     from server import worker_task
     return worker_task
 
+def get_page_pool() -> List[Any]:
+    from server import page_pool
+    return page_pool
+
+def get_backend_pool() -> List[Any]:
+    from server import backend_pool
+    return backend_pool
+
+def get_model_switch_stats() -> Dict[str, Any]:
+    from server import model_switch_counts, affinity_promoted_requests
+    return {
+        "switch_counts": dict(model_switch_counts),
+        "total_switches": sum(model_switch_counts.values()),
+        "affinity_promoted_requests": affinity_promoted_requests,
+    }
+
 def get_server_state() -> Dict[str, Any]:
     from server import is_initializing, is_playwright_ready, is_browser_connected, is_page_ready
     return {
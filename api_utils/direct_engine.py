@@ -0,0 +1,297 @@
+"""
+直连引擎模块
+复用浏览器会话的 Cookie 以及页面最近一次 GenerateContent 请求的请求头/请求体模板，
+通过连接池直接调用 GenerateContent，响应交给流式代理同一套 HttpInterceptor 解析，
+输出与辅助流相同格式的数据帧；认证失败或响应无法解析时返回 False，由调用方回退到页面流程
+"""
+
+import asyncio
+import copy
+import hashlib
+import itertools
+import json
+import os
+import time
+from asyncio import Future
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple
+
+import aiohttp
+from fastapi import HTTPException, Request
+
+from config import *
+from models import ChatCompletionRequest
+from browser_utils import get_generate_content_template
+from browser_utils.batch_parameters import desired_parameter_state, build_generation_config
+from stream.interceptors import HttpInterceptor
+from logging_utils.stage_timing import mark, finish_request, MARK_SUBMITTED
+from .utils import build_prompt_contents, get_requested_model_id
+from .client_disconnect import close_client_disconnect_watcher
+
+AI_STUDIO_ORIGIN = "https://aistudio.google.com"
+# 计算 Authorization 头所用的 Cookie 名称 -> 签名前缀
+_AUTH_HASH_COOKIES = (
+    ("SAPISID", "SAPISIDHASH"),
+    ("__Secure-1PAPISID", "SAPISID1PHASH"),
+    ("__Secure-3PAPISID", "SAPISID3PHASH"),
+)
+# 重放模板请求头时丢弃的字段（由连接池重新生成，或为代理内部使用）
+_DROPPED_TEMPLATE_HEADERS = {"host", "content-length", "cookie", "authorization", "accept-encoding", "connection"}
+_PROXY_HEADER_PREFIX = "x-aistudio-proxy-"
+# 必须改写成功才能保证与请求一致的生成参数
+_REQUIRED_CONFIG_FIELDS = {"temperature", "max_output_tokens", "top_p", "stop_sequences"}
+# 没有页面模板（仅配置 DIRECT_ENGINE_ENDPOINT）时使用的最小请求体：
+# [模型, 对话内容, 安全设置, 生成配置]，生成配置各下标与 HttpInterceptor.rewrite_generation_config 一致
+_MINIMAL_GENERATION_CONFIG_SIZE = 22
+
+COOKIE_REFRESH_INTERVAL_S = 60.0
+AUTH_FAILURE_COOLDOWN_S = 60.0
+READ_CHUNK_SIZE = 16 * 1024
+
+# 流式响应结束后释放资源的后台任务（保留引用，避免任务在运行中被回收）
+_cleanup_tasks = set()
+
+
+class DirectEngineError(Exception):
+    """直连请求无法完成，调用方应回退到页面流程"""
+
+
+class DirectGenerateEngine:
+    """直连 GenerateContent 引擎（进程内单例，由 lifespan 创建和关闭）"""
+
+    def __init__(self, logger, endpoint: str = '', max_connections: int = 8):
+        self.logger = logger
+        self.endpoint = endpoint
+        self.max_connections = max_connections
+        self.interceptor = HttpInterceptor()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._cookies: Dict[str, str] = {}
+        self._cookies_fetched_at = 0.0
+        self._disabled_until = 0.0
+        self._stream_ids = itertools.count(1)
+        self._upstream_proxy = None if endpoint else (
+            os.environ.get('UNIFIED_PROXY_CONFIG') or os.environ.get('HTTPS_PROXY') or os.environ.get('HTTP_PROXY')
+        )
+        self.completed_requests = 0
+        self.fallback_requests = 0
+
+    @property
+    def is_ready(self) -> bool:
+        if time.monotonic() < self._disabled_until:
+            return False
+        return bool(self.endpoint) or get_generate_content_template() is not None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=RESPONSE_COMPLETION_TIMEOUT / 1000),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _refresh_cookies(self) -> None:
+        import server
+
+        if self._cookies and time.monotonic() - self._cookies_fetched_at < COOKIE_REFRESH_INTERVAL_S:
+            return
+        page = server.page_instance
+        if page is None or page.is_closed():
+            if self.endpoint:
+                return
+            raise DirectEngineError("浏览器页面不可用，无法获取会话 Cookie")
+        cookies = await page.context.cookies([AI_STUDIO_ORIGIN, "https://alkalimakersuite-pa.clients6.google.com"])
+        self._cookies = {cookie["name"]: cookie["value"] for cookie in cookies}
+        self._cookies_fetched_at = time.monotonic()
+
+    def _mark_auth_failure(self, status: int) -> None:
+        self._cookies = {}
+        self._disabled_until = time.monotonic() + AUTH_FAILURE_COOLDOWN_S
+        self.logger.warning(f"直连引擎认证失败 (HTTP {status})，{AUTH_FAILURE_COOLDOWN_S:.0f} 秒内回退到页面流程。")
+
+    def _authorization_header(self) -> Optional[str]:
+        timestamp = int(time.time())
+        parts = []
+        for cookie_name, prefix in _AUTH_HASH_COOKIES:
+            value = self._cookies.get(cookie_name)
+            if value:
+                digest = hashlib.sha1(f"{timestamp} {value} {AI_STUDIO_ORIGIN}".encode()).hexdigest()
+                parts.append(f"{prefix} {timestamp}_{digest}")
+        return " ".join(parts) or None
+
+    def _build_headers(self, template: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        headers = {
+            key: value for key, value in ((template or {}).get("headers") or {}).items()
+            if key.lower() not in _DROPPED_TEMPLATE_HEADERS and not key.lower().startswith(_PROXY_HEADER_PREFIX)
+        }
+        headers.setdefault("content-type", "application/json+protobuf")
+        headers.setdefault("origin", AI_STUDIO_ORIGIN)
+        if self._cookies:
+            headers["cookie"] = "; ".join(f"{name}={value}" for name, value in self._cookies.items())
+        authorization = self._authorization_header()
+        if authorization:
+            headers["authorization"] = authorization
+        return headers
+
+    def _build_payload(self, req_id: str, request: ChatCompletionRequest, template: Optional[Dict[str, Any]]) -> list:
+        from server import parsed_model_list
+
+        if template is not None:
+            payload = copy.deepcopy(template["payload"])
+        else:
+            payload = [None, None, None, [None] * _MINIMAL_GENERATION_CONFIG_SIZE]
+            payload[3][21] = [1, None]
+
+        model_id = get_requested_model_id(request)
+        if model_id:
+            payload[0] = f"models/{model_id}"
+        elif not (isinstance(payload[0], str) and payload[0].startswith("models/")):
+            raise DirectEngineError("请求未指定模型且没有可用的页面请求模板")
+        payload[1] = build_prompt_contents(request.messages, req_id)
+
+        request_params = request.model_dump(exclude_none=True)
+        desired = desired_parameter_state(request_params, payload[0].split('/')[-1], parsed_model_list, self.logger, req_id)
+        generation_config = build_generation_config(desired, request_params)
+        _, failed = HttpInterceptor.rewrite_generation_config(payload, generation_config)
+        if set(failed) & _REQUIRED_CONFIG_FIELDS:
+            raise DirectEngineError(f"请求模板格式不符，无法写入生成参数 {failed}")
+        return payload
+
+    async def open_stream(self, req_id: str, request: ChatCompletionRequest) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        发送直连请求并读取到第一段内容后返回数据帧生成器；
+        在此之前的任何失败都抛出 DirectEngineError，此时尚未向客户端输出，可安全回退
+        """
+        template = get_generate_content_template()
+        url = self.endpoint or (template or {}).get("url")
+        if not url:
+            raise DirectEngineError("没有可用的 GenerateContent 请求模板")
+
+        await self._refresh_cookies()
+        payload = self._build_payload(req_id, request, template)
+        headers = self._build_headers(template)
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+        try:
+            response = await self._get_session().post(url, data=body, headers=headers, proxy=self._upstream_proxy)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DirectEngineError(f"连接 GenerateContent 失败: {e}") from e
+
+        try:
+            if response.status in (401, 403):
+                self._mark_auth_failure(response.status)
+                raise DirectEngineError(f"认证失败 (HTTP {response.status})")
+            if response.status != 200:
+                raise DirectEngineError(f"GenerateContent 返回 HTTP {response.status}")
+
+            # aiohttp 已完成分块和压缩解码，解析器按无长度的原始响应体处理
+            decoder = self.interceptor.create_response_decoder({}, req_id, stream_id=f"direct-{next(self._stream_ids)}")
+            parsed, eof = await self._read_until_content(response, decoder)
+            if not parsed:
+                raise DirectEngineError("响应中没有可解析的内容")
+        except BaseException:
+            response.release()
+            raise
+
+        self.logger.info(f"[{req_id}] 直连引擎已收到首段响应内容。")
+        return self._frames(req_id, response, decoder, eof)
+
+    @staticmethod
+    async def _read_until_content(response: aiohttp.ClientResponse, decoder) -> Tuple[bool, bool]:
+        """读取响应直到解析出内容或响应结束，返回 (是否解析出内容, 是否已读到结尾)"""
+        while True:
+            chunk = await response.content.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return decoder.finish(), True
+            if decoder.feed(chunk):
+                return True, False
+
+    async def _frames(self, req_id: str, response: aiohttp.ClientResponse, decoder, eof: bool) -> AsyncGenerator[Dict[str, Any], None]:
+        try:
+            yield decoder.take_delta()
+            while not eof:
+                _, eof = await self._read_until_content(response, decoder)
+                yield decoder.take_delta()
+            self.completed_requests += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error(f"[{req_id}] 直连响应读取中断: {e}")
+            raise
+        finally:
+            response.release()
+
+
+def _is_eligible(request: ChatCompletionRequest) -> bool:
+    """含图片或工具定义的请求依赖页面交互，始终走页面流程"""
+    if request.tools:
+        return False
+    for msg in request.messages:
+        if isinstance(msg.content, list):
+            for item in msg.content:
+                item_type = item.get('type') if isinstance(item, dict) else getattr(item, 'type', None)
+                if item_type == 'image_url':
+                    return False
+    return True
+
+
+async def handle_direct_request(req_id: str, request: ChatCompletionRequest, http_request: Request,
+                                result_future: Future, logger) -> bool:
+    """
+    尝试通过直连引擎处理请求。返回 True 表示已由直连引擎设置 result_future，
+    返回 False 表示应继续交给页面队列处理
+    """
+    import server
+    from .request_processor import _setup_disconnect_monitoring, _handle_auxiliary_stream_response
+
+    engine: Optional[DirectGenerateEngine] = getattr(server, 'direct_engine', None)
+    if engine is None or not engine.is_ready or not _is_eligible(request):
+        return False
+
+    mark(req_id, MARK_SUBMITTED)
+    try:
+        frames = await engine.open_stream(req_id, request)
+    except DirectEngineError as e:
+        engine.fallback_requests += 1
+        logger.info(f"[{req_id}] 直连引擎不可用，回退到页面流程: {e}")
+        return False
+    except Exception as e:
+        engine.fallback_requests += 1
+        logger.warning(f"[{req_id}] 直连引擎意外错误，回退到页面流程: {e}", exc_info=True)
+        return False
+
+    logger.info(f"[{req_id}] 由直连引擎处理请求 (Stream={request.stream})。")
+    _, stop_disconnect_monitoring, check_client_disconnected = _setup_disconnect_monitoring(req_id, http_request, result_future)
+    context = {'current_ai_studio_model_id': get_requested_model_id(request)}
+
+    async def cleanup(completion_event=None):
+        if completion_event is not None:
+            await completion_event.wait()
+        stop_disconnect_monitoring()
+        close_client_disconnect_watcher(http_request)
+        await frames.aclose()
+        finish_request(req_id)
+
+    try:
+        response_result = await _handle_auxiliary_stream_response(
+            req_id, request, context, result_future, None, check_client_disconnected, frame_source=frames
+        )
+    except HTTPException as http_err:
+        if not result_future.done():
+            result_future.set_exception(http_err)
+        response_result = None
+    except Exception as e:
+        logger.exception(f"[{req_id}] 直连引擎处理响应时出错")
+        if not result_future.done():
+            result_future.set_exception(HTTPException(status_code=502, detail=f"[{req_id}] 直连请求失败: {e}"))
+        response_result = None
+
+    if response_result:
+        # 流式响应在客户端读取完毕后才结束，后台等待完成再释放资源
+        cleanup_task = asyncio.create_task(cleanup(response_result[0]))
+        _cleanup_tasks.add(cleanup_task)
+        cleanup_task.add_done_callback(_cleanup_tasks.discard)
+    else:
+        await cleanup()
+    return True
@@ -0,0 +1,293 @@
+"""
+页面池模块
+在同一浏览器上下文中维护多个 AI Studio 页面，每个页面由独立的 Worker 驱动，
+并拥有自己的参数缓存和当前模型状态。
+启用备用页面时每个槽位另有一个已清空的页面：请求结束后直接换用备用页面，
+换下的页面在后台清空，验证通过后才能再次换入
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from playwright.async_api import Page as AsyncPage, expect as expect_async
+
+from config import AI_STUDIO_URL_PATTERN, INPUT_SELECTOR, RESPONSE_CONTAINER_SELECTOR, ENABLE_STANDBY_PAGE
+from .request_scheduler import RequestScheduler
+from logging_utils.metrics import PAGE_LOAD_SECONDS
+
+
+class StandbyPage:
+    """槽位的备用页面及其页面状态；后台重置（清空并验证）完成前不可换入"""
+
+    def __init__(self, page: AsyncPage, current_model_id: Optional[str]):
+        self.page = page
+        self.current_model_id = current_model_id
+        self.params_cache: Dict[str, Any] = {}
+        self.reset_task: Optional[asyncio.Task] = None
+        self.reset_ok = True
+
+    @property
+    def is_ready(self) -> bool:
+        return (self.reset_ok and (self.reset_task is None or self.reset_task.done())
+                and bool(self.page) and not self.page.is_closed())
+
+    def start_reset(self, slot_name: str, logger: logging.Logger) -> None:
+        self.reset_ok = False
+        self.reset_task = asyncio.create_task(self._reset(slot_name, logger))
+
+    async def _reset(self, slot_name: str, logger: logging.Logger) -> None:
+        from browser_utils.page_controller import PageController
+        from browser_utils.model_management import _get_displayed_model_id
+
+        started_at = time.time()
+        try:
+            # 后台清空与任何客户端无关，不做断开检查
+            await PageController(self.page, logger, f"standby-{slot_name}").clear_chat_history(lambda stage: False)
+            remaining = await self.page.locator(RESPONSE_CONTAINER_SELECTOR).count()
+            if remaining:
+                raise RuntimeError(f"清空后仍有 {remaining} 个回复")
+            # 模型偏好保存在共享的 localStorage 中，清空后重新读取页面实际显示的模型
+            displayed_model_id = await _get_displayed_model_id(self.page)
+            if displayed_model_id:
+                self.current_model_id = displayed_model_id
+            self.reset_ok = True
+            logger.info(f"页面池: {slot_name} 的备用页面已在后台清空并验证 ({time.time() - started_at:.2f}s)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"页面池: {slot_name} 的备用页面后台清空失败，下次换页前重试: {e}")
+
+
+class PageSlot:
+    """页面池中的单个页面及其独立状态"""
+
+    def __init__(self, index: int, page: AsyncPage, is_ready: bool = True,
+                 current_model_id: Optional[str] = None, mirrors_globals: bool = False, backend=None):
+        self.index = index
+        self.page = page
+        # 所属后端实例（未建立后端池时为 None，使用全局队列和切换锁）
+        self.backend = backend
+        self.is_ready = is_ready
+        # 主页面与 server 模块中的全局状态保持一致（兼容旧代码和 /api/info 等端点）
+        self.mirrors_globals = mirrors_globals
+        self._current_model_id = current_model_id
+        if mirrors_globals:
+            import server
+            self.params_cache: Dict[str, Any] = server.page_params_cache
+            self.params_cache_lock: asyncio.Lock = server.params_cache_lock
+            self.processing_lock: asyncio.Lock = server.processing_lock
+        else:
+            self.params_cache = {}
+            self.params_cache_lock = asyncio.Lock()
+            self.processing_lock = asyncio.Lock()
+        # 常驻模型页面：固定服务的模型及其独立队列（通用页面为 None，使用实例共享队列）
+        self.pinned_model_id: Optional[str] = None
+        self.own_queue: Optional[RequestScheduler] = None
+        self.current_req_id: Optional[str] = None
+        # 处理中请求的 (模型ID, 是否流式)，供准入控制估算剩余耗时
+        self.current_service_key: Optional[Tuple[str, bool]] = None
+        # 对话亲和：页面上保留的对话的哈希及产生该对话的请求（对话已清空时为 None）
+        self.conversation_key: Optional[str] = None
+        self.conversation_req_id: Optional[str] = None
+        # 已清空的备用页面（未启用时为 None）
+        self.standby: Optional[StandbyPage] = None
+        self.worker_task: Optional[asyncio.Task] = None
+        self.last_used = 0.0
+        self.completed_requests = 0
+
+    @property
+    def name(self) -> str:
+        if self.backend is not None and not self.backend.mirrors_globals:
+            return f"{self.backend.name}/page-{self.index}"
+        return f"page-{self.index}"
+
+    @property
+    def request_queue(self) -> RequestScheduler:
+        if self.own_queue is not None:
+            return self.own_queue
+        if self.backend is not None:
+            return self.backend.request_queue
+        import server
+        return server.request_queue
+
+    @property
+    def model_switching_lock(self) -> asyncio.Lock:
+        if self.backend is not None:
+            return self.backend.model_switching_lock
+        import server
+        return server.model_switching_lock
+
+    @property
+    def current_model_id(self) -> Optional[str]:
+        if self.mirrors_globals:
+            import server
+            return server.current_ai_studio_model_id
+        return self._current_model_id
+
+    @current_model_id.setter
+    def current_model_id(self, model_id: Optional[str]) -> None:
+        self._current_model_id = model_id
+        if self.mirrors_globals:
+            import server
+            server.current_ai_studio_model_id = model_id
+
+    @property
+    def is_busy(self) -> bool:
+        return self.current_req_id is not None
+
+    @property
+    def is_available(self) -> bool:
+        if self.mirrors_globals:
+            import server
+            if not server.is_page_ready:
+                return False
+        return bool(self.is_ready and self.page and not self.page.is_closed())
+
+    def mark_busy(self, req_id: str, service_key: Optional[Tuple[str, bool]] = None) -> None:
+        self.current_req_id = req_id
+        self.current_service_key = service_key
+        self.last_used = time.time()
+
+    def mark_idle(self) -> None:
+        self.current_req_id = None
+        self.current_service_key = None
+        self.last_used = time.time()
+        self.completed_requests += 1
+
+    def swap_in_standby(self, logger: logging.Logger) -> bool:
+        """
+        换用已清空的备用页面，换下的页面（连同其模型和参数缓存状态）在后台清空。
+        备用页面尚未就绪时返回 False，由调用方按原流程清空当前页面；上次后台清空失败则重新开始
+        """
+        standby = self.standby
+        if standby is None:
+            return False
+        if not standby.is_ready:
+            if not standby.reset_ok and standby.reset_task is not None and standby.reset_task.done() \
+                    and standby.page and not standby.page.is_closed():
+                standby.start_reset(self.name, logger)
+            return False
+
+        previous_page, previous_model_id = self.page, self.current_model_id
+        previous_params = dict(self.params_cache)
+        self.page = standby.page
+        self.current_model_id = standby.current_model_id
+        # 主页面的参数缓存与 server 模块共享同一个字典，只替换内容
+        self.params_cache.clear()
+        self.params_cache.update(standby.params_cache)
+        standby.page, standby.current_model_id, standby.params_cache = previous_page, previous_model_id, previous_params
+        if self.mirrors_globals:
+            import server
+            server.page_instance = self.page
+        standby.start_reset(self.name, logger)
+        return True
+
+    def describe(self) -> Dict[str, Any]:
+        """用于 /health 和 /v1/queue 的状态描述"""
+        return {
+            "name": self.name,
+            "ready": self.is_available,
+            "busy": self.is_busy,
+            "current_req_id": self.current_req_id,
+            "current_model_id": self.current_model_id,
+            "pinned_model_id": self.pinned_model_id,
+            "own_queue_length": self.own_queue.qsize() if self.own_queue is not None else None,
+            "completed_requests": self.completed_requests,
+            "standby_ready": self.standby.is_ready if self.standby is not None else None,
+            "worker_running": bool(self.worker_task and not self.worker_task.done()),
+        }
+
+
+async def _open_new_chat_page(context) -> AsyncPage:
+    """在已有上下文中打开一个新的 AI Studio 对话页面"""
+    from browser_utils import enable_temporary_chat_mode, _handle_model_list_response
+
+    target_full_url = f"https://{AI_STUDIO_URL_PATTERN}prompts/new_chat"
+    page = await context.new_page()
+    page.on("response", _handle_model_list_response)
+    nav_started_at = time.perf_counter()
+    await page.goto(target_full_url, wait_until="domcontentloaded", timeout=90000)
+    PAGE_LOAD_SECONDS.observe(time.perf_counter() - nav_started_at)
+    await expect_async(page.locator('ms-prompt-input-wrapper')).to_be_visible(timeout=35000)
+    await expect_async(page.locator(INPUT_SELECTOR)).to_be_visible(timeout=10000)
+    await enable_temporary_chat_mode(page)
+    return page
+
+
+async def _open_pool_page(context, index: int, logger: logging.Logger, backend=None) -> PageSlot:
+    """在已有上下文中打开一个新的 AI Studio 页面"""
+    from browser_utils.model_management import _get_displayed_model_id
+
+    page = await _open_new_chat_page(context)
+    slot = PageSlot(index, page, is_ready=True, current_model_id=await _get_displayed_model_id(page), backend=backend)
+    logger.info(f"页面池: {slot.name} 已就绪，当前模型: {slot.current_model_id}")
+    return slot
+
+
+async def build_page_pool(primary_page: AsyncPage, size: int, logger: logging.Logger, backend=None) -> List[PageSlot]:
+    """以主页面为第一个槽位构建页面池，额外页面打开失败时以较小的池继续运行"""
+    import server
+
+    if backend is None or backend.mirrors_globals:
+        slots = [PageSlot(0, primary_page, is_ready=server.is_page_ready, mirrors_globals=True, backend=backend)]
+    else:
+        from browser_utils.model_management import _get_displayed_model_id
+        slots = [PageSlot(0, primary_page, is_ready=True,
+                          current_model_id=await _get_displayed_model_id(primary_page), backend=backend)]
+    if primary_page is None:
+        return slots
+
+    context = primary_page.context
+    if size > 1:
+        for index in range(1, size):
+            try:
+                slots.append(await _open_pool_page(context, index, logger, backend))
+            except Exception as e:
+                logger.error(f"页面池: 打开 page-{index} 失败，将以 {len(slots)} 个页面运行: {e}", exc_info=True)
+                break
+        logger.info(f"页面池已就绪（{backend.name if backend else 'default'}），共 {len(slots)} 个页面。")
+    if ENABLE_STANDBY_PAGE:
+        await _attach_standby_pages(slots, context, logger)
+    return slots
+
+
+async def _attach_standby_pages(slots: List[PageSlot], context, logger: logging.Logger) -> None:
+    """为每个槽位打开一个备用页面，打开失败的槽位按原流程在请求之间清空"""
+    from browser_utils.model_management import _get_displayed_model_id
+
+    for slot in slots:
+        try:
+            page = await _open_new_chat_page(context)
+            slot.standby = StandbyPage(page, await _get_displayed_model_id(page))
+            logger.info(f"页面池: {slot.name} 的备用页面已就绪，当前模型: {slot.standby.current_model_id}")
+        except Exception as e:
+            logger.error(f"页面池: 为 {slot.name} 打开备用页面失败，该页面将在请求之间清空: {e}", exc_info=True)
+
+
+async def close_page_pool(slots: List[PageSlot], logger: logging.Logger) -> None:
+    """关闭除主页面外的池页面和所有备用页面（主页面由 _close_page_logic 负责）"""
+    for slot in slots:
+        standby = slot.standby
+        if standby is not None:
+            if standby.reset_task is not None and not standby.reset_task.done():
+                standby.reset_task.cancel()
+            try:
+                if standby.page and not standby.page.is_closed():
+                    await standby.page.close()
+            except Exception as e:
+                logger.warning(f"页面池: 关闭 {slot.name} 的备用页面时出错: {e}")
+        if slot.mirrors_globals or not slot.page or slot.page.is_closed():
+            continue
+        try:
+            await slot.page.close()
+        except Exception as e:
+            logger.warning(f"页面池: 关闭 {slot.name} 时出错: {e}")
+        slot.is_ready = False
+
+
+def get_primary_slot() -> Optional[PageSlot]:
+    import server
+    pool = getattr(server, 'page_pool', None)
+    return pool[0] if pool else None
@@ -7,28 +7,42 @@ import asyncio
 import time
 from fastapi import HTTPException
 
+from config import MODEL_AFFINITY_MAX_WAIT_S
+from logging_utils.stage_timing import record_stage, stage_timer, finish_request, STAGE_QUEUE_WAIT, STAGE_CLEAR
+from logging_utils.tracing import begin_span
+from .client_disconnect import watch_client_disconnect, close_client_disconnect_watcher
+from .admission import service_key, record_service_time
+from .conversation_affinity import retains_conversation, forget_conversation
 
 
-async def queue_worker():
-    """队列工作器，处理请求队列中的任务"""
+
+async def queue_worker(slot=None):
+    """队列工作器，处理请求队列中的任务（每个页面池槽位运行一个）"""
     # 导入全局变量
     from server import (
-        logger, request_queue, processing_lock, model_switching_lock, 
+        logger, request_queue, model_switching_lock, 
         params_cache_lock
     )
+    from api_utils.page_pool import get_primary_slot
+    from api_utils.backend_pool import classify_request_outcome
+
+    if slot is None:
+        slot = get_primary_slot()
+    if slot is None:
+        logger.error("页面池未初始化，队列 Worker 无法启动。")
+        return
     
-    logger.info("--- 队列 Worker 已启动 ---")
+    logger.info(f"--- 队列 Worker 已启动 ({slot.name}) ---")
     
     # 检查并初始化全局变量
     if request_queue is None:
         logger.info("初始化 request_queue...")
-        from asyncio import Queue
-        request_queue = Queue()
+        from api_utils.request_scheduler import RequestScheduler
+        request_queue = RequestScheduler()
     
-    if processing_lock is None:
-        logger.info("初始化 processing_lock...")
-        from asyncio import Lock
-        processing_lock = Lock()
+    processing_lock = slot.processing_lock
+    if slot.request_queue is not None:
+        request_queue = slot.request_queue
     
     if model_switching_lock is None:
         logger.info("初始化 model_switching_lock...")
@@ -48,47 +62,12 @@ async def queue_worker():
         result_future = None
         req_id = "UNKNOWN"
         completion_event = None
+        worker_span = None
         
         try:
-            # 检查队列中的项目，清理已断开连接的请求
-            queue_size = request_queue.qsize()
-            if queue_size > 0:
-                checked_count = 0
-                items_to_requeue = []
-                processed_ids = set()
-                
-                while checked_count < queue_size and checked_count < 10:
-                    try:
-                        item = request_queue.get_nowait()
-                        item_req_id = item.get("req_id", "unknown")
-                        
-                        if item_req_id in processed_ids:
-                            items_to_requeue.append(item)
-                            continue
-                            
-                        processed_ids.add(item_req_id)
-                        
-                        if not item.get("cancelled", False):
-                            item_http_request = item.get("http_request")
-                            if item_http_request:
-                                try:
-                                    if await item_http_request.is_disconnected():
-                                        logger.info(f"[{item_req_id}] (Worker Queue Check) 检测到客户端已断开，标记为取消。")
-                                        item["cancelled"] = True
-                                        item_future = item.get("result_future")
-                                        if item_future and not item_future.done():
-                                            item_future.set_exception(HTTPException(status_code=499, detail=f"[{item_req_id}] Client disconnected while queued."))
-                                except Exception as check_err:
-                                    logger.error(f"[{item_req_id}] (Worker Queue Check) Error checking disconnect: {check_err}")
-                        
-                        items_to_requeue.append(item)
-                        checked_count += 1
-                    except asyncio.QueueEmpty:
-                        break
-                
-                for item in items_to_requeue:
-                    await request_queue.put(item)
-            
+            # 模型亲和：把与当前模型相同的请求提前，减少模型切换
+            _promote_same_model_request(request_queue, slot, logger)
+
             # 获取下一个请求
             try:
                 request_item = await asyncio.wait_for(request_queue.get(), timeout=5.0)
@@ -100,6 +79,9 @@ async def queue_worker():
             request_data = request_item["request_data"]
             http_request = request_item["http_request"]
             result_future = request_item["result_future"]
+            # 追踪上下文来自路由任务，本任务内的页面操作 span 都挂在该 span 下
+            worker_span = begin_span("queue_worker.process", parent=request_item.get("trace_context"),
+                                     req_id=req_id, slot=slot.name)
 
             if request_item.get("cancelled", False):
                 logger.info(f"[{req_id}] (Worker) 请求已取消，跳过。")
@@ -110,12 +92,12 @@ async def queue_worker():
 
             is_streaming_request = request_data.stream
             logger.info(f"[{req_id}] (Worker) 取出请求。模式: {'流式' if is_streaming_request else '非流式'}")
+            record_stage(req_id, STAGE_QUEUE_WAIT, time.time() - request_item.get("enqueue_time", time.time()))
 
-            # 优化：在开始处理前主动检测客户端连接状态，避免不必要的处理
-            from api_utils.request_processor import _test_client_connection
-            is_connected = await _test_client_connection(req_id, http_request)
-            if not is_connected:
-                logger.info(f"[{req_id}] (Worker) ✅ 主动检测到客户端已断开，跳过处理节省资源")
+            # 优化：在开始处理前检查客户端连接状态，避免不必要的处理
+            disconnect_watcher = watch_client_disconnect(req_id, http_request)
+            if disconnect_watcher.disconnected:
+                logger.info(f"[{req_id}] (Worker) ✅ 检测到客户端已断开，跳过处理节省资源")
                 if not result_future.done():
                     result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端在处理前已断开连接"))
                 request_queue.task_done()
@@ -128,22 +110,23 @@ async def queue_worker():
                 logger.info(f"[{req_id}] (Worker) 连续流式请求，添加 {delay_time:.2f}s 延迟...")
                 await asyncio.sleep(delay_time)
             
-            # 等待锁前再次主动检测客户端连接
-            is_connected = await _test_client_connection(req_id, http_request)
-            if not is_connected:
+            # 等待锁前再次检查客户端连接
+            if disconnect_watcher.disconnected:
                 logger.info(f"[{req_id}] (Worker) ✅ 等待锁时检测到客户端断开，取消处理")
                 if not result_future.done():
                     result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端关闭了请求"))
                 request_queue.task_done()
                 continue
             
-            logger.info(f"[{req_id}] (Worker) 等待处理锁...")
+            logger.info(f"[{req_id}] (Worker) 等待处理锁 ({slot.name})...")
             async with processing_lock:
-                logger.info(f"[{req_id}] (Worker) 已获取处理锁。开始核心处理...")
+                logger.info(f"[{req_id}] (Worker) 已获取处理锁 ({slot.name})。开始核心处理...")
+                slot.mark_busy(req_id, service_key(request_data))
+                processing_started_at = time.time()
+                client_disconnected_early = False
                 
-                # 获取锁后最终主动检测客户端连接
-                is_connected = await _test_client_connection(req_id, http_request)
-                if not is_connected:
+                # 获取锁后最终检查客户端连接
+                if disconnect_watcher.disconnected:
                     logger.info(f"[{req_id}] (Worker) ✅ 获取锁后检测到客户端断开，取消处理")
                     if not result_future.done():
                         result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端关闭了请求"))
@@ -154,7 +137,7 @@ async def queue_worker():
                     try:
                         from api_utils import _process_request_refactored
                         returned_value = await _process_request_refactored(
-                            req_id, request_data, http_request, result_future
+                            req_id, request_data, http_request, result_future, slot
                         )
                         
                         completion_event, submit_btn_loc, client_disco_checker = None, None, None
@@ -175,60 +158,35 @@ async def queue_worker():
                             current_request_was_streaming = False
                             logger.warning(f"[{req_id}] (Worker) _process_request_refactored returned unexpected type: {type(returned_value)}")
 
-                        # 统一的客户端断开检测和响应处理
+                        # 统一的客户端断开检测和响应处理：断开时由监视器回调提前结束等待
                         if completion_event:
                             # 流式模式：等待流式生成器完成信号
                             logger.info(f"[{req_id}] (Worker) 等待流式生成器完成信号...")
 
-                            # 创建一个增强的客户端断开检测器，支持提前done信号触发
                             client_disconnected_early = False
 
-                            async def enhanced_disconnect_monitor():
+                            def on_client_disconnect():
                                 nonlocal client_disconnected_early
-                                while not completion_event.is_set():
-                                    try:
-                                        # 主动检查客户端是否断开连接
-                                        is_connected = await _test_client_connection(req_id, http_request)
-                                        if not is_connected:
-                                            logger.info(f"[{req_id}] (Worker) ✅ 流式处理中检测到客户端断开，提前触发done信号")
-                                            client_disconnected_early = True
-                                            # 立即设置completion_event以提前结束等待
-                                            if not completion_event.is_set():
-                                                completion_event.set()
-                                            break
-                                        await asyncio.sleep(0.3)  # 更频繁的检查间隔
-                                    except Exception as e:
-                                        logger.error(f"[{req_id}] (Worker) 增强断开检测器错误: {e}")
-                                        break
-
-                            # 启动增强的断开连接监控
-                            disconnect_monitor_task = asyncio.create_task(enhanced_disconnect_monitor())
+                                if completion_event.is_set():
+                                    return
+                                logger.info(f"[{req_id}] (Worker) ✅ 流式处理中检测到客户端断开，提前触发done信号")
+                                client_disconnected_early = True
+                                completion_event.set()
                         else:
                             # 非流式模式：等待处理完成并检测客户端断开
                             logger.info(f"[{req_id}] (Worker) 非流式模式，等待处理完成...")
 
                             client_disconnected_early = False
 
-                            async def non_streaming_disconnect_monitor():
+                            def on_client_disconnect():
                                 nonlocal client_disconnected_early
-                                while not result_future.done():
-                                    try:
-                                        # 主动检查客户端是否断开连接
-                                        is_connected = await _test_client_connection(req_id, http_request)
-                                        if not is_connected:
-                                            logger.info(f"[{req_id}] (Worker) ✅ 非流式处理中检测到客户端断开，取消处理")
-                                            client_disconnected_early = True
-                                            # 取消result_future
-                                            if not result_future.done():
-                                                result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端在非流式处理中断开连接"))
-                                            break
-                                        await asyncio.sleep(0.3)  # 更频繁的检查间隔
-                                    except Exception as e:
-                                        logger.error(f"[{req_id}] (Worker) 非流式断开检测器错误: {e}")
-                                        break
-
-                            # 启动非流式断开连接监控
-                            disconnect_monitor_task = asyncio.create_task(non_streaming_disconnect_monitor())
+                                if result_future.done():
+                                    return
+                                logger.info(f"[{req_id}] (Worker) ✅ 非流式处理中检测到客户端断开，取消处理")
+                                client_disconnected_early = True
+                                result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端在非流式处理中断开连接"))
+
+                        stop_disconnect_monitoring = disconnect_watcher.on_disconnect(on_client_disconnect)
 
                         # 等待处理完成（流式或非流式）
                         try:
@@ -279,12 +237,12 @@ async def queue_worker():
                                         await expect_async(submit_btn_loc).to_be_disabled(timeout=wait_timeout_ms)
                                         logger.info(f"[{req_id}] ✅ 发送按钮已禁用。")
 
+                                    except ClientDisconnectedError:
+                                        logger.info(f"[{req_id}] 客户端在流式响应后按钮状态处理时断开连接。")
                                     except Exception as e_pw_disabled:
                                         logger.warning(f"[{req_id}] ⚠️ 流式响应后按钮状态处理超时或错误: {e_pw_disabled}")
                                         from api_utils.request_processor import save_error_snapshot
                                         await save_error_snapshot(f"stream_post_submit_button_handling_timeout_{req_id}")
-                                    except ClientDisconnectedError:
-                                        logger.info(f"[{req_id}] 客户端在流式响应后按钮状态处理时断开连接。")
                             elif completion_event and current_request_was_streaming:
                                 logger.warning(f"[{req_id}] (Worker) 流式请求但 submit_btn_loc 或 client_disco_checker 未提供。跳过按钮禁用等待。")
 
@@ -297,13 +255,7 @@ async def queue_worker():
                             if not result_future.done():
                                 result_future.set_exception(HTTPException(status_code=500, detail=f"[{req_id}] Error waiting for completion: {ev_wait_err}"))
                         finally:
-                            # 清理断开连接监控任务
-                            if 'disconnect_monitor_task' in locals() and not disconnect_monitor_task.done():
-                                disconnect_monitor_task.cancel()
-                                try:
-                                    await disconnect_monitor_task
-                                except asyncio.CancelledError:
-                                    pass
+                            stop_disconnect_monitoring()
 
                     except Exception as process_err:
                         logger.error(f"[{req_id}] (Worker) _process_request_refactored execution error: {process_err}")
@@ -311,23 +263,41 @@ async def queue_worker():
                             result_future.set_exception(HTTPException(status_code=500, detail=f"[{req_id}] Request processing error: {process_err}"))
             
             logger.info(f"[{req_id}] (Worker) 释放处理锁。")
+            outcome = classify_request_outcome(result_future)
+            processing_duration = time.time() - processing_started_at
+            if slot.backend is not None:
+                slot.backend.record_request(
+                    processing_duration,
+                    failed=outcome == 'failed',
+                    count_latency=outcome == 'ok' and not client_disconnected_early
+                )
+            if outcome == 'ok' and not client_disconnected_early and result_future.exception() is None:
+                record_service_time(service_key(request_data), processing_duration)
 
             # 在释放处理锁后立即执行清空操作
             try:
-                # 清空流式队列缓存
+                # 释放该请求的辅助流订阅（残留帧由分发器丢弃，无需清空队列）
                 from api_utils import clear_stream_queue
-                await clear_stream_queue()
+                await clear_stream_queue(req_id)
 
                 # 清空聊天历史（对于所有模式：流式和非流式）
-                if submit_btn_loc and client_disco_checker:
-                    from server import page_instance, is_page_ready
-                    if page_instance and is_page_ready:
+                if outcome == 'ok' and retains_conversation(slot, req_id):
+                    # 对话亲和：保留页面上的对话，下一个请求不延续它时再清空
+                    logger.info(f"[{req_id}] (Worker) 对话亲和：保留 {slot.name} 上的对话，跳过聊天历史清空。")
+                elif submit_btn_loc and client_disco_checker:
+                    forget_conversation(slot)
+                    if slot.is_available and slot.swap_in_standby(logger):
+                        logger.info(f"[{req_id}] (Worker) 已换用清空好的备用页面 ({slot.name})，原页面在后台清空。")
+                    elif slot.is_available:
                         from browser_utils.page_controller import PageController
-                        page_controller = PageController(page_instance, logger, req_id)
-                        logger.info(f"[{req_id}] (Worker) 执行聊天历史清空（{'流式' if completion_event else '非流式'}模式）...")
-                        await page_controller.clear_chat_history(client_disco_checker)
+                        page_controller = PageController(slot.page, logger, req_id)
+                        logger.info(f"[{req_id}] (Worker) 执行聊天历史清空（{'流式' if completion_event else '非流式'}模式, {slot.name}）...")
+                        with stage_timer(req_id, STAGE_CLEAR):
+                            await page_controller.clear_chat_history(_ignore_client_disconnect)
                         logger.info(f"[{req_id}] (Worker) ✅ 聊天历史清空完成。")
+                        await _resync_slot_model(slot, req_id)
                 else:
+                    forget_conversation(slot)
                     logger.info(f"[{req_id}] (Worker) 跳过聊天历史清空：缺少必要参数（submit_btn_loc: {bool(submit_btn_loc)}, client_disco_checker: {bool(client_disco_checker)}）")
             except Exception as clear_err:
                 logger.error(f"[{req_id}] (Worker) 清空操作时发生错误: {clear_err}", exc_info=True)
@@ -345,7 +315,61 @@ async def queue_worker():
             if result_future and not result_future.done():
                 result_future.set_exception(HTTPException(status_code=500, detail=f"[{req_id}] 服务器内部错误: {e}"))
         finally:
+            if worker_span is not None:
+                worker_span.end()
+            if request_item:
+                close_client_disconnect_watcher(request_item["http_request"])
+            if slot.current_req_id is not None:
+                slot.mark_idle()
             if request_item:
+                finish_request(req_id)
                 request_queue.task_done()
     
-    logger.info("--- 队列 Worker 已停止 ---") 
\ No newline at end of file
+    logger.info(f"--- 队列 Worker 已停止 ({slot.name}) ---")
+
+
+def _ignore_client_disconnect(stage: str = "") -> bool:
+    """请求结束后的页面维护（清空聊天历史）使用的检查函数：无论客户端是否仍连接都要完成"""
+    return False
+
+
+def _promote_same_model_request(request_queue, slot, logger) -> None:
+    """
+    若队首请求需要切换模型，而队列中有无需切换的请求，则将其提前到队首。
+    被跳过的请求中只要有一个等待超过 MODEL_AFFINITY_MAX_WAIT_S 即保持先进先出。
+    """
+    import server
+    from api_utils.utils import get_requested_model_id
+
+    if MODEL_AFFINITY_MAX_WAIT_S <= 0:
+        return
+    current_model_id = slot.current_model_id
+    if not current_model_id or request_queue.qsize() < 2:
+        return
+
+    now = time.time()
+    for position, item in enumerate(request_queue.pending_items()):
+        model_id = get_requested_model_id(item.get("request_data"))
+        if model_id is None or model_id == current_model_id:
+            break
+        if now - item.get("enqueue_time", now) > MODEL_AFFINITY_MAX_WAIT_S:
+            return
+    else:
+        return
+    if position > 0:
+        request_queue.move_to_front(item["req_id"])
+        server.affinity_promoted_requests += 1
+        logger.info(f"[{item.get('req_id', 'unknown')}] (Worker) 模型亲和调度: 提前处理使用当前模型 {current_model_id} 的请求 ({slot.name}，跳过 {position} 个请求)")
+
+
+async def _resync_slot_model(slot, req_id: str) -> None:
+    """多页面时 localStorage 中的模型偏好在页面间共享，清空聊天后重新读取本页面实际显示的模型"""
+    import server
+    from browser_utils.model_management import _get_displayed_model_id
+
+    if len(getattr(server, 'page_pool', None) or []) <= 1:
+        return
+    displayed_model_id = await _get_displayed_model_id(slot.page)
+    if displayed_model_id and displayed_model_id != slot.current_model_id:
+        server.logger.info(f"[{req_id}] (Worker) {slot.name} 当前模型已变为 {displayed_model_id}（原 {slot.current_model_id}），同步页面状态。")
+        slot.current_model_id = displayed_model_id 
\ No newline at end of file
@@ -8,7 +8,7 @@ import json
 import os
 import random
 import time
-from typing import Optional, Tuple, Callable, AsyncGenerator
+from typing import Any, Dict, Optional, Tuple, Callable, AsyncGenerator
 from asyncio import Event, Future
 
 from fastapi import HTTPException, Request
@@ -24,41 +24,62 @@ from models import ChatCompletionRequest, ClientDisconnectedError
 # --- browser_utils模块导入 ---
 from browser_utils import (
     switch_ai_studio_model,
-    save_error_snapshot
+    save_error_snapshot,
+    set_page_request_id,
+    set_page_prompt_placeholder,
+    LiveResponseStream
 )
 
 # --- api_utils模块导入 ---
 from .utils import (
     validate_chat_request,
     prepare_combined_prompt,
+    build_prompt_contents,
     generate_sse_chunk,
     generate_sse_stop_chunk,
     use_stream_response,
     calculate_usage_stats
 )
 from browser_utils.page_controller import PageController
+from .client_disconnect import watch_client_disconnect
+from .conversation_affinity import (
+    conversation_prefix_key,
+    continues_conversation,
+    touch_conversation,
+    remember_conversation,
+    forget_conversation
+)
+from logging_utils.stage_timing import (
+    stage_timer, record_since_mark, MARK_SUBMITTED, STAGE_MODEL_SWITCH, STAGE_PARAM_ADJUST,
+    STAGE_CLEAR, STAGE_FIRST_TOKEN, STAGE_COMPLETION
+)
+from logging_utils.tracing import traced, get_trace_context, trace_async_iterable
+
+# 提交占位提示后等待代理回报注入结果的最长时间（秒）
+PROMPT_INJECTION_ACK_TIMEOUT_S = 15.0
 
 
-async def _initialize_request_context(req_id: str, request: ChatCompletionRequest) -> dict:
+async def _initialize_request_context(req_id: str, request: ChatCompletionRequest, slot=None) -> dict:
     """初始化请求上下文"""
-    from server import (
-        logger, page_instance, is_page_ready, parsed_model_list,
-        current_ai_studio_model_id, model_switching_lock, page_params_cache,
-        params_cache_lock
-    )
+    from server import logger, parsed_model_list, model_switching_lock
+    from api_utils.page_pool import get_primary_slot
+
+    if slot is None:
+        slot = get_primary_slot()
     
-    logger.info(f"[{req_id}] 开始处理请求...")
+    logger.info(f"[{req_id}] 开始处理请求... ({slot.name if slot else 'no-page'})")
     logger.info(f"[{req_id}]   请求参数 - Model: {request.model}, Stream: {request.stream}")
     
     context = {
         'logger': logger,
-        'page': page_instance,
-        'is_page_ready': is_page_ready,
+        'slot': slot,
+        'page': slot.page if slot else None,
+        'is_page_ready': slot.is_available if slot else False,
         'parsed_model_list': parsed_model_list,
-        'current_ai_studio_model_id': current_ai_studio_model_id,
-        'model_switching_lock': model_switching_lock,
-        'page_params_cache': page_params_cache,
-        'params_cache_lock': params_cache_lock,
+        'current_ai_studio_model_id': slot.current_model_id if slot else None,
+        'model_switching_lock': slot.model_switching_lock if slot else model_switching_lock,
+        'page_params_cache': slot.params_cache if slot else {},
+        'params_cache_lock': slot.params_cache_lock if slot else asyncio.Lock(),
         'is_streaming': request.stream,
         'model_actually_switched': False,
         'requested_model': request.model,
@@ -96,89 +117,29 @@ async def _analyze_model_requirements(req_id: str, context: dict, request: ChatC
     return context
 
 
-async def _test_client_connection(req_id: str, http_request: Request) -> bool:
-    """通过发送测试数据包来主动检测客户端连接状态"""
-    try:
-        # 尝试发送一个小的测试数据包
-        test_chunk = "data: {\"type\":\"ping\"}\n\n"
-
-        # 获取底层的响应对象
-        if hasattr(http_request, '_receive'):
-            # 检查接收通道是否还活跃
-            try:
-                # 尝试非阻塞地检查是否有断开消息
-                import asyncio
-                receive_task = asyncio.create_task(http_request._receive())
-                done, pending = await asyncio.wait([receive_task], timeout=0.01)
-
-                if done:
-                    message = receive_task.result()
-                    if message.get("type") == "http.disconnect":
-                        return False
-                else:
-                    # 取消未完成的任务
-                    receive_task.cancel()
-                    try:
-                        await receive_task
-                    except asyncio.CancelledError:
-                        pass
-
-            except Exception:
-                # 如果检查过程中出现异常，可能表示连接有问题
-                return False
-
-        # 如果上述检查都通过，认为连接正常
-        return True
-
-    except Exception as e:
-        # 任何异常都认为连接已断开
-        return False
-
-async def _setup_disconnect_monitoring(req_id: str, http_request: Request, result_future: Future) -> Tuple[Event, asyncio.Task, Callable]:
-    """设置客户端断开连接监控"""
+def _setup_disconnect_monitoring(req_id: str, http_request: Request, result_future: Future) -> Tuple[Event, Callable[[], None], Callable]:
+    """
+    设置客户端断开连接监控：断开时以 499 结束 result_future。
+    返回 (断开事件, 取消监控的函数, 检查函数)
+    """
     from server import logger
 
-    client_disconnected_event = Event()
+    watcher = watch_client_disconnect(req_id, http_request)
 
-    async def check_disconnect_periodically():
-        while not client_disconnected_event.is_set():
-            try:
-                # 使用主动检测方法
-                is_connected = await _test_client_connection(req_id, http_request)
-                if not is_connected:
-                    logger.info(f"[{req_id}] 主动检测到客户端断开连接。")
-                    client_disconnected_event.set()
-                    if not result_future.done():
-                        result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端关闭了请求"))
-                    break
-
-                # 备用检查：使用原有的is_disconnected方法
-                if await http_request.is_disconnected():
-                    logger.info(f"[{req_id}] 备用检测到客户端断开连接。")
-                    client_disconnected_event.set()
-                    if not result_future.done():
-                        result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端关闭了请求"))
-                    break
-
-                await asyncio.sleep(0.3)  # 更频繁的检查间隔，从0.5秒改为0.3秒
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error(f"[{req_id}] (Disco Check Task) 错误: {e}")
-                client_disconnected_event.set()
-                if not result_future.done():
-                    result_future.set_exception(HTTPException(status_code=500, detail=f"[{req_id}] Internal disconnect checker error: {e}"))
-                break
+    def on_disconnect():
+        logger.info(f"[{req_id}] 检测到客户端断开连接。")
+        if not result_future.done():
+            result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端关闭了请求"))
 
-    disconnect_check_task = asyncio.create_task(check_disconnect_periodically())
+    stop_monitoring = watcher.on_disconnect(on_disconnect)
 
     def check_client_disconnected(stage: str = ""):
-        if client_disconnected_event.is_set():
+        if watcher.disconnected:
             logger.info(f"[{req_id}] 在 '{stage}' 检测到客户端断开连接。")
             raise ClientDisconnectedError(f"[{req_id}] Client disconnected at stage: {stage}")
         return False
 
-    return client_disconnected_event, disconnect_check_task, check_client_disconnected
+    return watcher.event, stop_monitoring, check_client_disconnected
 
 
 async def _validate_page_status(req_id: str, context: dict, check_client_disconnected: Callable) -> None:
@@ -199,33 +160,36 @@ async def _handle_model_switching(req_id: str, context: dict, check_client_disco
     
     logger = context['logger']
     page = context['page']
+    slot = context['slot']
     model_switching_lock = context['model_switching_lock']
     model_id_to_use = context['model_id_to_use']
     
-    import server
-    
+    # 切换会写入上下文共享的 localStorage，因此同一后端实例的所有页面共用同一把切换锁
     async with model_switching_lock:
-        if server.current_ai_studio_model_id != model_id_to_use:
-            logger.info(f"[{req_id}] 准备切换模型: {server.current_ai_studio_model_id} -> {model_id_to_use}")
-            switch_success = await switch_ai_studio_model(page, model_id_to_use, req_id)
+        if slot.current_model_id != model_id_to_use:
+            logger.info(f"[{req_id}] 准备切换模型 ({slot.name}): {slot.current_model_id} -> {model_id_to_use}")
+            with stage_timer(req_id, STAGE_MODEL_SWITCH):
+                switch_success = await switch_ai_studio_model(page, model_id_to_use, req_id)
             if switch_success:
-                server.current_ai_studio_model_id = model_id_to_use
+                import server
+                server.model_switch_counts[model_id_to_use] = server.model_switch_counts.get(model_id_to_use, 0) + 1
+                slot.current_model_id = model_id_to_use
+                # 切换模型会重新加载页面，之前保留的对话已不存在
+                forget_conversation(slot)
                 context['model_actually_switched'] = True
                 context['current_ai_studio_model_id'] = model_id_to_use
-                logger.info(f"[{req_id}] ✅ 模型切换成功: {server.current_ai_studio_model_id}")
+                logger.info(f"[{req_id}] ✅ 模型切换成功: {slot.current_model_id}")
             else:
-                await _handle_model_switch_failure(req_id, page, model_id_to_use, server.current_ai_studio_model_id, logger)
+                await _handle_model_switch_failure(req_id, slot, model_id_to_use, slot.current_model_id, logger)
     
     return context
 
 
-async def _handle_model_switch_failure(req_id: str, page: AsyncPage, model_id_to_use: str, model_before_switch: str, logger) -> None:
+async def _handle_model_switch_failure(req_id: str, slot, model_id_to_use: str, model_before_switch: str, logger) -> None:
     """处理模型切换失败的情况"""
-    import server
-    
     logger.warning(f"[{req_id}] ❌ 模型切换至 {model_id_to_use} 失败。")
-    # 尝试恢复全局状态
-    server.current_ai_studio_model_id = model_before_switch
+    # 尝试恢复页面模型状态
+    slot.current_model_id = model_before_switch
     
     raise HTTPException(
         status_code=422,
@@ -262,6 +226,38 @@ async def _prepare_and_validate_request(req_id: str, request: ChatCompletionRequ
     
     return prepared_prompt
 
+
+def _should_continue_conversation(req_id: str, request: ChatCompletionRequest, context: dict) -> bool:
+    """请求是否延续页面上保留的对话（未切换模型且去掉最后一条用户消息后与页面对话一致）"""
+    slot = context['slot']
+    if context['model_actually_switched'] or slot is None or slot.conversation_key is None:
+        return False
+    prefix_key = conversation_prefix_key(request)
+    if not continues_conversation(slot, prefix_key):
+        return False
+    touch_conversation(prefix_key)
+    context['logger'].info(f"[{req_id}] 请求延续 {slot.name} 上保留的对话，跳过清空，仅提交最后一条用户消息。")
+    return True
+
+
+async def _clear_retained_conversation(req_id: str, context: dict, page_controller: PageController,
+                                       check_client_disconnected: Callable) -> None:
+    """页面保留着上一请求的对话而本请求不延续它时，提交前先清空"""
+    slot = context['slot']
+    if slot is None or slot.conversation_key is None:
+        return
+    context['logger'].info(f"[{req_id}] 请求不延续 {slot.name} 上保留的对话，提交前清空聊天历史。")
+    forget_conversation(slot)
+    with stage_timer(req_id, STAGE_CLEAR):
+        await page_controller.clear_chat_history(check_client_disconnected)
+
+
+def _remember_page_conversation(req_id: str, request: ChatCompletionRequest, context: dict, reply: str) -> None:
+    """记录请求完成后页面上的对话；提示由代理注入时页面上只有占位提示，不能延续"""
+    if context.get('prompt_injected'):
+        return
+    remember_conversation(context.get('slot'), req_id, request, reply)
+
 async def _handle_response_processing(req_id: str, request: ChatCompletionRequest, page: AsyncPage,
                                     context: dict, result_future: Future,
                                     submit_button_locator: Locator, check_client_disconnected: Callable) -> Optional[Tuple[Event, Locator, Callable]]:
@@ -281,13 +277,73 @@ async def _handle_response_processing(req_id: str, request: ChatCompletionReques
         return await _handle_playwright_response(req_id, request, page, context, result_future, submit_button_locator, check_client_disconnected)
 
 
+class _StreamSeqState:
+    """
+    辅助流增量帧的序号状态，按 (req_id, stream_id) 记录期望序号。
+    一个请求只接受一个生成（stream_id）的帧：第一个从 seq=0 开始的生成成为当前生成，
+    其它 stream_id 的帧（如注入失败后放弃的占位提示生成的迟到帧）一律丢弃
+    """
+
+    def __init__(self, req_id: str, discarded_stream_ids=()):
+        self.req_id = req_id
+        self.stream_id = None
+        self.discarded_stream_ids = set(discarded_stream_ids)
+        self.expected_seq: Dict[Tuple[str, Any], int] = {}
+
+
+def _check_stream_seq(data: dict, state: _StreamSeqState) -> bool:
+    """校验辅助流增量帧的 stream_id 和序号，返回是否接受该帧"""
+    from server import logger
+
+    req_id = state.req_id
+    seq = data.get("seq")
+    if seq is None:  # 内部生成的信号帧（如超时）不带序号
+        return True
+    stream_id = data.get("stream_id")
+    if stream_id in state.discarded_stream_ids:
+        logger.warning(f"[{req_id}] 丢弃已放弃生成的辅助流帧 (stream_id={stream_id}, seq={seq})")
+        return False
+    if state.stream_id is None:
+        if seq > 0:
+            logger.warning(f"[{req_id}] 丢弃上一响应残留的辅助流帧 (stream_id={stream_id}, seq={seq})")
+            return False
+        state.stream_id = stream_id
+    elif stream_id != state.stream_id:
+        logger.warning(f"[{req_id}] 丢弃非当前生成的辅助流帧 (stream_id={stream_id}, 当前 {state.stream_id})")
+        return False
+
+    key = (req_id, stream_id)
+    expected_seq = state.expected_seq.get(key, 0)
+    if seq < expected_seq:
+        logger.warning(f"[{req_id}] 丢弃重复的辅助流帧 (seq={seq}, 期望 {expected_seq})")
+        return False
+    if seq > expected_seq:
+        logger.warning(f"[{req_id}] 辅助流帧序号不连续 (seq={seq}, 期望 {expected_seq})，部分增量可能丢失")
+    state.expected_seq[key] = seq + 1
+    return True
+
+
+def _record_frame_timing(req_id: str, data: dict) -> None:
+    """按辅助流数据帧记录首个 token 和完成阶段耗时"""
+    if data.get("body") or data.get("reason") or data.get("function"):
+        record_since_mark(req_id, MARK_SUBMITTED, STAGE_FIRST_TOKEN)
+    if data.get("done"):
+        record_since_mark(req_id, MARK_SUBMITTED, STAGE_COMPLETION)
+
+
 async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletionRequest, context: dict, 
                                           result_future: Future, submit_button_locator: Locator, 
-                                          check_client_disconnected: Callable) -> Optional[Tuple[Event, Locator, Callable]]:
-    """使用辅助流处理响应"""
+                                          check_client_disconnected: Callable,
+                                          frame_source: Optional[AsyncGenerator[Any, None]] = None) -> Optional[Tuple[Event, Locator, Callable]]:
+    """使用辅助流处理响应（frame_source 为直连引擎等其它来源的数据帧，默认读取辅助流队列）"""
     from server import logger
     
     is_streaming = request.stream
+    if frame_source is None:
+        frame_source = use_stream_response(req_id)
+    # 流式响应在 StreamingResponse 的任务中消费，显式传递追踪上下文
+    frame_source = trace_async_iterable(frame_source, "aux_stream.consume", parent=get_trace_context(),
+                                        req_id=req_id, streaming=is_streaming)
     current_ai_studio_model_id = context.get('current_ai_studio_model_id')
     
     def generate_random_string(length):
@@ -299,8 +355,7 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
             completion_event = Event()
             
             async def create_stream_generator_from_helper(event_to_set: Event) -> AsyncGenerator[str, None]:
-                last_reason_pos = 0
-                last_body_pos = 0
+                seq_state = _StreamSeqState(req_id, context.get('discarded_stream_ids', ()))
                 model_name_for_stream = current_ai_studio_model_id or MODEL_NAME
                 chat_completion_id = f"{CHAT_COMPLETION_ID_PREFIX}{req_id}-{int(time.time())}-{random.randint(100, 999)}"
                 created_timestamp = int(time.time())
@@ -308,12 +363,14 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                 # 用于收集完整内容以计算usage
                 full_reasoning_content = ""
                 full_body_content = ""
+                function = []
 
                 # 数据接收状态标记
                 data_receiving = False
+                stream_completed = False
 
                 try:
-                    async for raw_data in use_stream_response(req_id):
+                    async for raw_data in frame_source:
                         # 标记数据接收状态
                         data_receiving = True
 
@@ -346,19 +403,27 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                             logger.warning(f"[{req_id}] 数据不是字典类型: {data}")
                             continue
                         
+                        # 辅助流只发送增量片段，按序号校验并丢弃残留帧
+                        accepted = _check_stream_seq(data, seq_state)
+                        if not accepted:
+                            continue
+                        _record_frame_timing(req_id, data)
+
                         reason = data.get("reason", "")
                         body = data.get("body", "")
                         done = data.get("done", False)
-                        function = data.get("function", [])
+                        function.extend(data.get("function") or [])
+                        if done and not data.get("internal_timeout"):
+                            stream_completed = True
                         
                         # 更新完整内容记录
                         if reason:
-                            full_reasoning_content = reason
+                            full_reasoning_content += reason
                         if body:
-                            full_body_content = body
+                            full_body_content += body
                         
                         # 处理推理内容
-                        if len(reason) > last_reason_pos:
+                        if reason:
                             output = {
                                 "id": chat_completion_id,
                                 "object": "chat.completion.chunk",
@@ -369,22 +434,21 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                                     "delta":{
                                         "role": "assistant",
                                         "content": None,
-                                        "reasoning_content": reason[last_reason_pos:],
+                                        "reasoning_content": reason,
                                     },
                                     "finish_reason": None,
                                     "native_finish_reason": None,
                                 }]
                             }
-                            last_reason_pos = len(reason)
                             yield f"data: {json.dumps(output, ensure_ascii=False, separators=(',', ':'))}\n\n"
                         
                         # 处理主体内容
-                        if len(body) > last_body_pos:
+                        if body:
                             finish_reason_val = None
                             if done:
                                 finish_reason_val = "stop"
                             
-                            delta_content = {"role": "assistant", "content": body[last_body_pos:]}
+                            delta_content = {"role": "assistant", "content": body}
                             choice_item = {
                                 "index": 0,
                                 "delta": delta_content,
@@ -416,7 +480,6 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                                 "created": created_timestamp,
                                 "choices": [choice_item]
                             }
-                            last_body_pos = len(body)
                             yield f"data: {json.dumps(output, ensure_ascii=False, separators=(',', ':'))}\n\n"
                         
                         # 处理只有done=True但没有新内容的情况（仅有函数调用或纯结束）
@@ -486,6 +549,9 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                     except Exception:
                         pass  # 如果无法发送错误信息，继续处理结束逻辑
                 finally:
+                    if stream_completed and not function:
+                        _remember_page_conversation(req_id, request, context, full_body_content)
+
                     # 计算usage统计
                     try:
                         usage_stats = calculate_usage_stats(
@@ -547,8 +613,12 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
         reasoning_content = None
         functions = None
         final_data_from_aux_stream = None
+        seq_state = _StreamSeqState(req_id, context.get('discarded_stream_ids', ()))
+        body_parts = []
+        reason_parts = []
+        function_parts = []
 
-        async for raw_data in use_stream_response(req_id):
+        async for raw_data in frame_source:
             check_client_disconnected(f"非流式辅助流 - 循环中 ({req_id}): ")
             
             # 确保 data 是字典类型
@@ -568,15 +638,23 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
             if not isinstance(data, dict):
                 logger.warning(f"[{req_id}] 非流式数据不是字典类型: {data}")
                 continue
-                
+
+            accepted = _check_stream_seq(data, seq_state)
+            if not accepted:
+                continue
+            _record_frame_timing(req_id, data)
+
             final_data_from_aux_stream = data
+            body_parts.append(data.get("body") or "")
+            reason_parts.append(data.get("reason") or "")
+            function_parts.extend(data.get("function") or [])
             if data.get("done"):
-                content = data.get("body")
-                reasoning_content = data.get("reason")
-                functions = data.get("function")
+                content = "".join(body_parts)
+                reasoning_content = "".join(reason_parts)
+                functions = function_parts
                 break
         
-        if final_data_from_aux_stream and final_data_from_aux_stream.get("reason") == "internal_timeout":
+        if final_data_from_aux_stream and final_data_from_aux_stream.get("internal_timeout"):
             logger.error(f"[{req_id}] 非流式请求通过辅助流失败: 内部超时")
             raise HTTPException(status_code=502, detail=f"[{req_id}] 辅助流处理错误 (内部超时)")
 
@@ -607,6 +685,9 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
         if reasoning_content:
             message_payload["reasoning_content"] = reasoning_content
 
+        if not functions:
+            _remember_page_conversation(req_id, request, context, content or "")
+
         # 计算token使用统计
         usage_stats = calculate_usage_stats(
             [msg.model_dump() for msg in request.messages],
@@ -643,7 +724,10 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
     current_ai_studio_model_id = context.get('current_ai_studio_model_id')
     
     logger.info(f"[{req_id}] 定位响应元素...")
-    response_container = page.locator(RESPONSE_CONTAINER_SELECTOR).last
+    # 延续对话时页面上已有之前轮次的回复，等待本轮新增的回复出现
+    response_baseline = context.get('response_baseline', 0)
+    response_containers = page.locator(RESPONSE_CONTAINER_SELECTOR)
+    response_container = response_containers.nth(response_baseline) if response_baseline else response_containers.last
     response_element = response_container.locator(RESPONSE_TEXT_SELECTOR)
     
     try:
@@ -651,6 +735,7 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
         check_client_disconnected("After Response Container Attached: ")
         await expect_async(response_element).to_be_attached(timeout=90000)
         logger.info(f"[{req_id}] 响应元素已定位。")
+        record_since_mark(req_id, MARK_SUBMITTED, STAGE_FIRST_TOKEN)
     except (PlaywrightAsyncError, asyncio.TimeoutError, ClientDisconnectedError) as locate_err:
         if isinstance(locate_err, ClientDisconnectedError):
             raise
@@ -671,17 +756,31 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
             # 数据接收状态标记
             data_receiving = False
 
+            live_stream = LiveResponseStream(page, req_id, response_baseline)
+            completion_task = None
             try:
-                # 使用PageController获取响应
+                # 使用PageController获取响应（等待生成完成并读取最终 Markdown）
                 page_controller = PageController(page, logger, req_id)
-                final_content = await page_controller.get_response(check_client_disconnected)
+                live_enabled = PLAYWRIGHT_LIVE_STREAMING and await live_stream.start()
+                completion_task = asyncio.create_task(page_controller.get_response(check_client_disconnected))
+
+                if live_enabled:
+                    # 实时输出：页面每次更新回复内容即推送增量
+                    async for delta in live_stream.deltas(completion_task):
+                        data_receiving = True
+                        check_client_disconnected(f"Playwright实时流式生成器循环 ({req_id}): ")
+                        yield generate_sse_chunk(delta, req_id, current_ai_studio_model_id or MODEL_NAME)
+
+                final_content = await completion_task
+                await live_stream.stop()
+                _remember_page_conversation(req_id, request, context, final_content)
 
                 # 标记数据接收状态
                 data_receiving = True
 
-                # 生成流式响应 - 保持Markdown格式
-                # 按行分割以保持换行符和Markdown结构
-                lines = final_content.split('\n')
+                # 补发尚未输出的内容（实时输出不可用时即为全部内容），按行分块以保持Markdown结构
+                remaining_content = live_stream.remaining_text(final_content) if live_enabled else final_content
+                lines = remaining_content.split('\n') if remaining_content else []
                 for line_idx, line in enumerate(lines):
                     # 检查客户端是否断开连接
                     try:
@@ -694,18 +793,9 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
                             completion_event.set()
                         break
 
-                    # 输出当前行的内容（包括空行，以保持Markdown格式）
-                    if line:  # 非空行按字符分块输出
-                        chunk_size = 5  # 每次输出5个字符，平衡速度和体验
-                        for i in range(0, len(line), chunk_size):
-                            chunk = line[i:i+chunk_size]
-                            yield generate_sse_chunk(chunk, req_id, current_ai_studio_model_id or MODEL_NAME)
-                            await asyncio.sleep(0.03)  # 适中的输出速度
-
-                    # 添加换行符（除了最后一行）
-                    if line_idx < len(lines) - 1:
-                        yield generate_sse_chunk('\n', req_id, current_ai_studio_model_id or MODEL_NAME)
-                        await asyncio.sleep(0.01)
+                    chunk = line + ('\n' if line_idx < len(lines) - 1 else '')
+                    if chunk:
+                        yield generate_sse_chunk(chunk, req_id, current_ai_studio_model_id or MODEL_NAME)
                 
                 # 计算并发送带usage的完成块
                 usage_stats = calculate_usage_stats(
@@ -733,6 +823,9 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
                 except Exception:
                     pass  # 如果无法发送错误信息，继续处理结束逻辑
             finally:
+                if completion_task is not None and not completion_task.done():
+                    completion_task.cancel()
+                await live_stream.stop()
                 # 确保事件被设置
                 if not completion_event.is_set():
                     completion_event.set()
@@ -746,13 +839,35 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
     else:
         # 使用PageController获取响应
         page_controller = PageController(page, logger, req_id)
-        final_content = await page_controller.get_response(check_client_disconnected)
+        response_details = await page_controller.get_response_details(check_client_disconnected)
+        final_content = response_details["text"]
+        reasoning_content = response_details.get("reasoning") or ""
+        functions = response_details.get("tool_calls") or []
+
+        message_payload = {"role": "assistant", "content": final_content}
+        finish_reason_val = "stop"
+        if functions:
+            message_payload["tool_calls"] = [{
+                "id": f"call_{''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=24))}",
+                "index": func_idx,
+                "type": "function",
+                "function": {
+                    "name": function_call_data["name"],
+                    "arguments": json.dumps(function_call_data["params"]),
+                },
+            } for func_idx, function_call_data in enumerate(functions)]
+            message_payload["content"] = None
+            finish_reason_val = "tool_calls"
+        else:
+            _remember_page_conversation(req_id, request, context, final_content)
+        if reasoning_content:
+            message_payload["reasoning_content"] = reasoning_content
         
         # 计算token使用统计
         usage_stats = calculate_usage_stats(
             [msg.model_dump() for msg in request.messages],
             final_content,
-            ""  # Playwright模式没有reasoning content
+            reasoning_content
         )
         logger.info(f"[{req_id}] Playwright非流式计算的token使用统计: {usage_stats}")
         
@@ -763,8 +878,8 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
             "model": current_ai_studio_model_id or MODEL_NAME,
             "choices": [{
                 "index": 0,
-                "message": {"role": "assistant", "content": final_content},
-                "finish_reason": "stop"
+                "message": message_payload,
+                "finish_reason": finish_reason_val
             }],
             "usage": usage_stats
         }
@@ -775,20 +890,76 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
         return None
 
 
-async def _cleanup_request_resources(req_id: str, disconnect_check_task: Optional[asyncio.Task], 
+def _register_stream_correlation(req_id: str, page: AsyncPage) -> None:
+    """提交前登记辅助流订阅，并让页面发出的 GenerateContent 请求携带该请求ID"""
+    from server import STREAM_CHANNEL
+
+    if STREAM_CHANNEL is None:
+        return
+    STREAM_CHANNEL.subscribe(req_id)
+    set_page_request_id(page, req_id, get_trace_context())
+
+
+async def _submit_prompt(req_id: str, request: ChatCompletionRequest, context: dict, page_controller: PageController,
+                         prepared_prompt: str, image_list: list, check_client_disconnected: Callable) -> None:
+    """
+    提交提示。提示足够长（且无图片）时只提交占位提示，由辅助流代理把请求体中的对话内容
+    替换为完整的多轮内容；代理未能替换时停止生成、清空对话并回退为提交完整提示。
+    """
+    from server import STREAM_CHANNEL, STREAM_CONTROL_QUEUE
+
+    logger = context['logger']
+    slot = context['slot']
+    page = context['page']
+    control_queue = slot.backend.stream_control_queue if slot is not None and slot.backend is not None else STREAM_CONTROL_QUEUE
+
+    use_injection = (PROMPT_INJECTION_MIN_CHARS > 0 and STREAM_CHANNEL is not None and control_queue is not None
+                     and not image_list and len(prepared_prompt) >= PROMPT_INJECTION_MIN_CHARS)
+    if not use_injection:
+        await page_controller.submit_prompt(prepared_prompt, image_list, check_client_disconnected)
+        return
+
+    placeholder = f"__AISTUDIO_PROXY_PROMPT_{req_id}__"
+    contents = build_prompt_contents(request.messages, req_id)
+    logger.info(f"[{req_id}] 提示长度 {len(prepared_prompt)} 达到注入阈值，提交占位提示，由辅助流代理注入 {len(contents)} 个对话轮次。")
+    control_queue.put(json.dumps({"req_id": req_id, "placeholder": placeholder, "contents": contents}, ensure_ascii=False))
+    set_page_prompt_placeholder(page, placeholder)
+    injection_ack = STREAM_CHANNEL.expect_prompt_injection(req_id)
+
+    try:
+        await page_controller.submit_prompt(placeholder, [], check_client_disconnected)
+        try:
+            result = await asyncio.wait_for(injection_ack, timeout=PROMPT_INJECTION_ACK_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            result = {"ok": False, "reason": "ack_timeout"}
+    finally:
+        set_page_prompt_placeholder(page, None)
+        STREAM_CHANNEL.cancel_prompt_injection(req_id)
+
+    if result.get("ok"):
+        logger.info(f"[{req_id}] ✅ 辅助流代理已将完整对话内容注入请求体。")
+        context['prompt_injected'] = True
+        return
+
+    logger.warning(f"[{req_id}] 提示注入失败 ({result.get('reason')})，停止生成并清空对话后改为提交完整提示。")
+    # 占位提示产生的数据帧在重新订阅前全部丢弃；重新订阅后迟到的帧按 stream_id 丢弃
+    discarded_stream_ids = set(STREAM_CHANNEL.unsubscribe(req_id))
+    if result.get("stream_id") is not None:
+        discarded_stream_ids.add(result["stream_id"])
+    context['discarded_stream_ids'] = discarded_stream_ids
+    await page_controller.clear_chat_history(check_client_disconnected)
+    STREAM_CHANNEL.subscribe(req_id)
+    await page_controller.submit_prompt(prepared_prompt, image_list, check_client_disconnected)
+
+
+async def _cleanup_request_resources(req_id: str, stop_disconnect_monitoring: Optional[Callable[[], None]], 
                                    completion_event: Optional[Event], result_future: Future, 
                                    is_streaming: bool) -> None:
     """清理请求资源"""
     from server import logger
     
-    if disconnect_check_task and not disconnect_check_task.done():
-        disconnect_check_task.cancel()
-        try: 
-            await disconnect_check_task
-        except asyncio.CancelledError: 
-            pass
-        except Exception as task_clean_err: 
-            logger.error(f"[{req_id}] 清理任务时出错: {task_clean_err}")
+    if stop_disconnect_monitoring is not None:
+        stop_disconnect_monitoring()
     
     logger.info(f"[{req_id}] 处理完成。")
     
@@ -797,27 +968,28 @@ async def _cleanup_request_resources(req_id: str, disconnect_check_task: Optiona
          completion_event.set()
 
 
+@traced("process_request")
 async def _process_request_refactored(
     req_id: str,
     request: ChatCompletionRequest,
     http_request: Request,
-    result_future: Future
+    result_future: Future,
+    slot=None
 ) -> Optional[Tuple[Event, Locator, Callable[[str], bool]]]:
     """核心请求处理函数 - 重构版本"""
 
-    # 优化：在开始任何处理前主动检测客户端连接状态
-    is_connected = await _test_client_connection(req_id, http_request)
-    if not is_connected:
+    # 优化：在开始任何处理前检查客户端连接状态
+    if watch_client_disconnect(req_id, http_request).disconnected:
         from server import logger
         logger.info(f"[{req_id}] ✅ 核心处理前检测到客户端断开，提前退出节省资源")
         if not result_future.done():
             result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端在处理开始前已断开连接"))
         return None
 
-    context = await _initialize_request_context(req_id, request)
+    context = await _initialize_request_context(req_id, request, slot)
     context = await _analyze_model_requirements(req_id, context, request)
     
-    client_disconnected_event, disconnect_check_task, check_client_disconnected = await _setup_disconnect_monitoring(
+    client_disconnected_event, stop_disconnect_monitoring, check_client_disconnected = _setup_disconnect_monitoring(
         req_id, http_request, result_future
     )
     
@@ -833,24 +1005,39 @@ async def _process_request_refactored(
         await _handle_model_switching(req_id, context, check_client_disconnected)
         await _handle_parameter_cache(req_id, context)
         
-        prepared_prompt,image_list = await _prepare_and_validate_request(req_id, request, check_client_disconnected)
+        continue_conversation = _should_continue_conversation(req_id, request, context)
+        if continue_conversation:
+            # 页面上已有之前的对话，只需提交新的用户消息
+            prepared_prompt, image_list = prepare_combined_prompt(request.messages[-1:], req_id)
+        else:
+            await _clear_retained_conversation(req_id, context, page_controller, check_client_disconnected)
+            prepared_prompt,image_list = await _prepare_and_validate_request(req_id, request, check_client_disconnected)
 
         # 使用PageController处理页面交互
-        # 注意：聊天历史清空已移至队列处理锁释放后执行
-
-        await page_controller.adjust_parameters(
-            request.model_dump(exclude_none=True), # 使用 exclude_none=True 避免传递None值
-            context['page_params_cache'],
-            context['params_cache_lock'],
-            context['model_id_to_use'],
-            context['parsed_model_list'],
-            check_client_disconnected
-        )
+        # 注意：聊天历史清空已移至队列处理锁释放后执行（对话亲和模式下保留的对话在下一请求开始时按需清空）
+        from server import STREAM_CHANNEL
+
+        with stage_timer(req_id, STAGE_PARAM_ADJUST):
+            await page_controller.adjust_parameters(
+                request.model_dump(exclude_none=True), # 使用 exclude_none=True 避免传递None值
+                context['page_params_cache'],
+                context['params_cache_lock'],
+                context['model_id_to_use'],
+                context['parsed_model_list'],
+                check_client_disconnected,
+                network_rewrite=ENABLE_GENERATION_CONFIG_REWRITE and STREAM_CHANNEL is not None
+            )
 
         # 优化：在提交提示前再次检查客户端连接，避免不必要的后台请求
         check_client_disconnected("提交提示前最终检查")
 
-        await page_controller.submit_prompt(prepared_prompt,image_list, check_client_disconnected)
+        _register_stream_correlation(req_id, page)
+
+        if continue_conversation:
+            context['response_baseline'] = await page.locator(RESPONSE_CONTAINER_SELECTOR).count()
+            await page_controller.submit_prompt(prepared_prompt, image_list, check_client_disconnected)
+        else:
+            await _submit_prompt(req_id, request, context, page_controller, prepared_prompt, image_list, check_client_disconnected)
         
         # 响应处理仍然需要在这里，因为它决定了是流式还是非流式，并设置future
         response_result = await _handle_response_processing(
@@ -881,4 +1068,4 @@ async def _process_request_refactored(
         if not result_future.done():
             result_future.set_exception(HTTPException(status_code=500, detail=f"[{req_id}] Unexpected server error: {e}"))
     finally:
-        await _cleanup_request_resources(req_id, disconnect_check_task, completion_event, result_future, request.stream)
+        await _cleanup_request_resources(req_id, stop_disconnect_monitoring, completion_event, result_future, request.stream)
@@ -0,0 +1,134 @@
+"""
+请求调度队列模块
+按 req_id 索引的请求记录加有序就绪队列（惰性删除）：取消、状态查询和断开标记只需一次字典操作，
+被取消或提前的请求不从就绪队列中间删除，出队时跳过失效条目。
+接口与 asyncio.Queue 兼容（put / get / get_nowait / qsize / empty / task_done / join），
+可直接替换原先的请求队列
+"""
+
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, Optional
+
+# 失效条目超过有效条目的该倍数时重建就绪队列
+_COMPACT_RATIO = 2
+_COMPACT_MIN_STALE = 32
+
+
+class RequestScheduler:
+    """请求队列：records 保存排队中的请求，_ready 保存出队顺序"""
+
+    def __init__(self):
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._ready: Deque[Dict[str, Any]] = deque()
+        self._getters: Deque[asyncio.Future] = deque()
+        self._unfinished_tasks = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    # --- asyncio.Queue 兼容接口 ---
+    def qsize(self) -> int:
+        return len(self._records)
+
+    def empty(self) -> bool:
+        return not self._records
+
+    def put_nowait(self, item: Dict[str, Any]) -> None:
+        req_id = item["req_id"]
+        if req_id in self._records:
+            raise ValueError(f"请求 {req_id} 已在队列中")
+        self._records[req_id] = item
+        self._ready.append(item)
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._wakeup_next()
+
+    async def put(self, item: Dict[str, Any]) -> None:
+        self.put_nowait(item)
+
+    def get_nowait(self) -> Dict[str, Any]:
+        while self._ready:
+            item = self._ready.popleft()
+            if self._records.get(item["req_id"]) is item:
+                del self._records[item["req_id"]]
+                return item
+        raise asyncio.QueueEmpty
+
+    async def get(self) -> Dict[str, Any]:
+        while self.empty():
+            getter = asyncio.get_running_loop().create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except BaseException:
+                getter.cancel()
+                try:
+                    self._getters.remove(getter)
+                except ValueError:
+                    pass
+                if not self.empty() and not getter.cancelled():
+                    self._wakeup_next()
+                raise
+        return self.get_nowait()
+
+    def task_done(self) -> None:
+        if self._unfinished_tasks <= 0:
+            raise ValueError("task_done() called too many times")
+        self._unfinished_tasks -= 1
+        if self._unfinished_tasks == 0:
+            self._finished.set()
+
+    async def join(self) -> None:
+        await self._finished.wait()
+
+    # --- 按请求ID的操作 ---
+    def lookup(self, req_id: str) -> Optional[Dict[str, Any]]:
+        """排队中的请求记录（已出队或不存在时为 None）"""
+        return self._records.get(req_id)
+
+    def cancel(self, req_id: str, error: Optional[BaseException] = None) -> bool:
+        """
+        从队列中移除排队中的请求，并以 error 结束其 result_future。
+        返回 False 表示请求不在队列中（已出队或不存在）
+        """
+        item = self._records.pop(req_id, None)
+        if item is None:
+            return False
+        item["cancelled"] = True
+        future = item.get("result_future")
+        if error is not None and future is not None and not future.done():
+            future.set_exception(error)
+        self.task_done()
+        self._maybe_compact()
+        return True
+
+    def move_to_front(self, req_id: str) -> bool:
+        """把排队中的请求提前到队首（原位置的条目变为失效条目）"""
+        item = self._records.get(req_id)
+        if item is None:
+            return False
+        self._ready.appendleft(item)
+        self._maybe_compact()
+        return True
+
+    def pending_items(self) -> Iterator[Dict[str, Any]]:
+        """按出队顺序遍历排队中的请求"""
+        seen = set()
+        for item in self._ready:
+            req_id = item["req_id"]
+            if req_id in seen or self._records.get(req_id) is not item:
+                continue
+            seen.add(req_id)
+            yield item
+
+    def _wakeup_next(self) -> None:
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                break
+
+    def _maybe_compact(self) -> None:
+        stale = len(self._ready) - len(self._records)
+        if stale > _COMPACT_MIN_STALE and stale > _COMPACT_RATIO * len(self._records):
+            self._ready = deque(self.pending_items())
@@ -9,11 +9,11 @@ import random
 import time
 import uuid
 from typing import Dict, List, Any, Set
-from asyncio import Queue, Future, Lock, Event
+from asyncio import Future, Lock, Event
 import logging
 
 from fastapi import HTTPException, Request, WebSocket, WebSocketDisconnect, Depends
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
 from pydantic import BaseModel
 from playwright.async_api import Page as AsyncPage
 
@@ -29,6 +29,17 @@ from browser_utils import _handle_model_list_response
 # --- 依赖项导入 ---
 from .dependencies import *
 
+# --- 工具函数导入 ---
+from .utils import get_requested_model_id
+from .client_disconnect import watch_client_disconnect, close_client_disconnect_watcher
+from .request_scheduler import RequestScheduler
+from .admission import evaluate_admission, describe_admission
+from .conversation_affinity import conversation_prefix_key, find_conversation_slot, forget_conversation
+
+# --- 指标导入 ---
+from logging_utils.metrics import REQUEST_OUTCOMES_TOTAL, QUEUE_DEPTH, CONTENT_TYPE_LATEST, render_metrics
+from logging_utils.tracing import traced, current_span, get_trace_context
+
 
 # --- 静态文件端点 ---
 async def read_index(logger: logging.Logger = Depends(get_logger)):
@@ -95,10 +106,13 @@ async def get_api_info(request: Request, current_ai_studio_model_id: str = Depen
 async def health_check(
     server_state: Dict[str, Any] = Depends(get_server_state),
     worker_task = Depends(get_worker_task),
-    request_queue: Queue = Depends(get_request_queue)
+    request_queue: RequestScheduler = Depends(get_request_queue),
+    page_pool: List[Any] = Depends(get_page_pool),
+    backend_pool: List[Any] = Depends(get_backend_pool)
 ):
     """健康检查"""
-    is_worker_running = bool(worker_task and not worker_task.done())
+    is_worker_running = any(slot.worker_task and not slot.worker_task.done() for slot in page_pool) \
+        if page_pool else bool(worker_task and not worker_task.done())
     launch_mode = os.environ.get('LAUNCH_MODE', 'unknown')
     browser_page_critical = launch_mode != "direct_debug_no_browser"
     
@@ -108,7 +122,10 @@ async def health_check(
     
     is_core_ready = all(core_ready_conditions)
     status_val = "OK" if is_core_ready and is_worker_running else "Error"
-    q_size = request_queue.qsize() if request_queue else -1
+    if backend_pool:
+        q_size = sum(backend.queued_requests for backend in backend_pool)
+    else:
+        q_size = request_queue.qsize() if request_queue else -1
     
     status_message_parts = []
     if server_state["is_initializing"]: status_message_parts.append("初始化进行中")
@@ -117,15 +134,20 @@ async def health_check(
         if not server_state["is_browser_connected"]: status_message_parts.append("浏览器未连接")
         if not server_state["is_page_ready"]: status_message_parts.append("页面未就绪")
     if not is_worker_running: status_message_parts.append("Worker 未运行")
+    unhealthy_backends = [backend.name for backend in backend_pool if not backend.is_healthy]
+    
     
     status = {
         "status": status_val,
         "message": "",
-        "details": {**server_state, "workerRunning": is_worker_running, "queueLength": q_size, "launchMode": launch_mode, "browserAndPageCritical": browser_page_critical}
+        "details": {**server_state, "workerRunning": is_worker_running, "queueLength": q_size, "launchMode": launch_mode, "browserAndPageCritical": browser_page_critical,
+                    "backends": [backend.describe() for backend in backend_pool]}
     }
     
     if status_val == "OK":
         status["message"] = f"服务运行中;队列长度: {q_size}。"
+        if unhealthy_backends:
+            status["message"] += f" 不健康的后端实例: {', '.join(unhealthy_backends)}。"
         return JSONResponse(content=status, status_code=200)
     else:
         status["message"] = f"服务不可用;问题: {(', '.join(status_message_parts) or '未知原因')}. 队列长度: {q_size}."
@@ -147,6 +169,9 @@ async def list_models(
         logger.info("/v1/models: 模型列表事件未设置，尝试刷新页面...")
         try:
             await page_instance.reload(wait_until="domcontentloaded", timeout=20000)
+            # 刷新后主页面上保留的对话已不存在
+            from api_utils.page_pool import get_primary_slot
+            forget_conversation(get_primary_slot())
             await asyncio.wait_for(model_list_fetch_event.wait(), timeout=10.0)
         except Exception as e:
             logger.error(f"/v1/models: 刷新或等待模型列表时出错: {e}")
@@ -166,17 +191,21 @@ async def list_models(
 
 
 # --- 聊天完成端点 ---
+@traced("chat_completions")
 async def chat_completions(
     request: ChatCompletionRequest,
     http_request: Request,
     logger: logging.Logger = Depends(get_logger),
-    request_queue: Queue = Depends(get_request_queue),
+    request_queue: RequestScheduler = Depends(get_request_queue),
     server_state: Dict[str, Any] = Depends(get_server_state),
-    worker_task = Depends(get_worker_task)
+    worker_task = Depends(get_worker_task),
+    page_pool: List[Any] = Depends(get_page_pool),
+    backend_pool: List[Any] = Depends(get_backend_pool)
 ):
     """处理聊天完成请求"""
     req_id = ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=7))
     logger.info(f"[{req_id}] 收到 /v1/chat/completions 请求 (Stream={request.stream})")
+    current_span().set_attribute("req_id", req_id)
     
     launch_mode = os.environ.get('LAUNCH_MODE', 'unknown')
     browser_page_critical = launch_mode != "direct_debug_no_browser"
@@ -186,23 +215,79 @@ async def chat_completions(
                           (browser_page_critical and (not server_state["is_page_ready"] or not server_state["is_browser_connected"])) or \
                           not worker_task or worker_task.done()
     
+    # 按负载选择后端实例；主实例不可用时仍可由其它健康实例接收请求
+    from api_utils.backend_pool import select_backend
+    backend = select_backend(backend_pool)
+    if backend is not None and backend.index > 0 and backend.is_healthy:
+        service_unavailable = False
+
     if service_unavailable:
+        REQUEST_OUTCOMES_TOTAL.inc(status="503")
         raise HTTPException(status_code=503, detail=f"[{req_id}] 服务当前不可用。请稍后重试。", headers={"Retry-After": "30"})
     
     result_future = Future()
-    await request_queue.put({
-        "req_id": req_id, "request_data": request, "http_request": http_request,
-        "result_future": result_future, "enqueue_time": time.time(), "cancelled": False
-    })
+    # 请求的唯一断开监视器，之后的排队、处理和直连流程都使用它
+    disconnect_watcher = watch_client_disconnect(req_id, http_request)
+    # 直连引擎可用时不经过页面队列直接调用 GenerateContent；返回 False 时交给页面流程
+    from api_utils.direct_engine import handle_direct_request
+    if not await handle_direct_request(req_id, request, http_request, result_future, logger):
+        target_queue = request_queue
+        admission_slots = backend.page_pool if backend else page_pool
+        # 对话亲和：延续某个页面上保留的对话时交给该页面所在的队列
+        affinity_slot = find_conversation_slot(conversation_prefix_key(request))
+        if affinity_slot is not None and affinity_slot.is_available and \
+                affinity_slot.pinned_model_id in (None, get_requested_model_id(request)):
+            target_queue = affinity_slot.request_queue
+            if affinity_slot.backend is not None:
+                affinity_slot.backend.routed_requests += 1
+                admission_slots = affinity_slot.backend.page_pool
+            logger.info(f"[{req_id}] 请求延续 {affinity_slot.name} 上保留的对话，分配到该页面的队列 (队列: {target_queue.qsize()})")
+        elif backend is not None:
+            target_queue = backend.request_queue
+            backend.routed_requests += 1
+            # 已有常驻该模型的页面时直接交给该页面，省去模型切换
+            from api_utils.warm_pages import route_to_warm_page
+            warm_slot = route_to_warm_page(backend, get_requested_model_id(request), logger)
+            if warm_slot is not None:
+                target_queue = warm_slot.request_queue
+            logger.info(f"[{req_id}] 分配到后端实例 {backend.name}{f' ({warm_slot.name})' if warm_slot else ''} (队列: {target_queue.qsize()}, 处理中: {backend.busy_slots})")
+
+        projected_wait, retry_after = evaluate_admission(target_queue, admission_slots)
+        if retry_after is not None:
+            REQUEST_OUTCOMES_TOTAL.inc(status="429")
+            close_client_disconnect_watcher(http_request)
+            logger.warning(f"[{req_id}] 预计排队等待 {projected_wait:.1f}s (队列: {target_queue.qsize()})，超出准入限制，拒绝请求 (Retry-After: {retry_after}s)。")
+            raise HTTPException(status_code=429, detail=f"[{req_id}] 服务繁忙，预计等待 {projected_wait:.0f} 秒。请稍后重试。",
+                                headers={"Retry-After": str(retry_after)})
+
+        await target_queue.put({
+            "req_id": req_id, "request_data": request, "http_request": http_request,
+            "result_future": result_future, "enqueue_time": time.time(), "cancelled": False,
+            "trace_context": get_trace_context(),
+            "backend": backend.name if backend else None
+        })
+
+        def remove_if_queued():
+            # 排队期间客户端断开时直接从队列移除；已出队的请求由处理流程负责
+            if target_queue.cancel(req_id, HTTPException(status_code=499, detail=f"[{req_id}] Client disconnected while queued.")):
+                logger.info(f"[{req_id}] 客户端在排队期间断开，已从队列移除。")
+                close_client_disconnect_watcher(http_request)
+
+        disconnect_watcher.on_disconnect(remove_if_queued)
     
     try:
         timeout_seconds = RESPONSE_COMPLETION_TIMEOUT / 1000 + 120
-        return await asyncio.wait_for(result_future, timeout=timeout_seconds)
+        response = await asyncio.wait_for(result_future, timeout=timeout_seconds)
+        REQUEST_OUTCOMES_TOTAL.inc(status="200")
+        return response
     except asyncio.TimeoutError:
+        REQUEST_OUTCOMES_TOTAL.inc(status="504")
         raise HTTPException(status_code=504, detail=f"[{req_id}] 请求处理超时。")
     except asyncio.CancelledError:
+        REQUEST_OUTCOMES_TOTAL.inc(status="499")
         raise HTTPException(status_code=499, detail=f"[{req_id}] 请求被客户端取消。")
     except HTTPException as http_exc:
+        REQUEST_OUTCOMES_TOTAL.inc(status=str(http_exc.status_code))
         # 对于客户端断开连接的情况，使用更友好的日志级别
         if http_exc.status_code == 499:
             logger.info(f"[{req_id}] 客户端断开连接: {http_exc.detail}")
@@ -210,57 +295,65 @@ async def chat_completions(
             logger.warning(f"[{req_id}] HTTP异常: {http_exc.detail}")
         raise http_exc
     except Exception as e:
+        REQUEST_OUTCOMES_TOTAL.inc(status="500")
         logger.exception(f"[{req_id}] 等待Worker响应时出错")
         raise HTTPException(status_code=500, detail=f"[{req_id}] 服务器内部错误: {e}")
 
 
 # --- 取消请求相关 ---
-async def cancel_queued_request(req_id: str, request_queue: Queue, logger: logging.Logger) -> bool:
+async def cancel_queued_request(req_id: str, request_queue: RequestScheduler, logger: logging.Logger) -> bool:
     """取消队列中的请求"""
-    items_to_requeue = []
-    found = False
-    try:
-        while not request_queue.empty():
-            item = request_queue.get_nowait()
-            if item.get("req_id") == req_id:
-                logger.info(f"[{req_id}] 在队列中找到请求，标记为已取消。")
-                item["cancelled"] = True
-                if (future := item.get("result_future")) and not future.done():
-                    future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] Request cancelled."))
-                found = True
-            items_to_requeue.append(item)
-    finally:
-        for item in items_to_requeue:
-            await request_queue.put(item)
-    return found
+    item = request_queue.lookup(req_id)
+    if not request_queue.cancel(req_id, HTTPException(status_code=499, detail=f"[{req_id}] Request cancelled.")):
+        return False
+    logger.info(f"[{req_id}] 在队列中找到请求，已取消。")
+    close_client_disconnect_watcher(item["http_request"])
+    return True
 
 
 async def cancel_request(
     req_id: str,
     logger: logging.Logger = Depends(get_logger),
-    request_queue: Queue = Depends(get_request_queue)
+    request_queue: RequestScheduler = Depends(get_request_queue)
 ):
     """取消请求端点"""
+    from api_utils.backend_pool import all_request_queues
     logger.info(f"[{req_id}] 收到取消请求。")
-    if await cancel_queued_request(req_id, request_queue, logger):
-        return JSONResponse(content={"success": True, "message": f"Request {req_id} marked as cancelled."})
-    else:
-        return JSONResponse(status_code=404, content={"success": False, "message": f"Request {req_id} not found in queue."})
+    for queue in all_request_queues() or [request_queue]:
+        if await cancel_queued_request(req_id, queue, logger):
+            return JSONResponse(content={"success": True, "message": f"Request {req_id} marked as cancelled."})
+    return JSONResponse(status_code=404, content={"success": False, "message": f"Request {req_id} not found in queue."})
 
 
 # --- 队列状态端点 ---
 async def get_queue_status(
-    request_queue: Queue = Depends(get_request_queue),
-    processing_lock: Lock = Depends(get_processing_lock)
+    request_queue: RequestScheduler = Depends(get_request_queue),
+    processing_lock: Lock = Depends(get_processing_lock),
+    page_pool: List[Any] = Depends(get_page_pool),
+    backend_pool: List[Any] = Depends(get_backend_pool),
+    model_switch_stats: Dict[str, Any] = Depends(get_model_switch_stats)
 ):
     """获取队列状态"""
-    queue_items = list(request_queue._queue)
+    if backend_pool:
+        queue_items = [item for backend in backend_pool for queue in backend.all_queues() for item in queue.pending_items()]
+        all_slots = [slot for backend in backend_pool for slot in backend.page_pool]
+        admission_queues = [(backend.name, backend.request_queue, backend.page_pool) for backend in backend_pool] + [
+            (slot.name, slot.own_queue, [slot]) for slot in all_slots if slot.own_queue is not None
+        ]
+    else:
+        queue_items = list(request_queue.pending_items())
+        all_slots = page_pool
+        admission_queues = [("default", request_queue, page_pool)] if request_queue is not None else []
     return JSONResponse(content={
         "queue_length": len(queue_items),
-        "is_processing_locked": processing_lock.locked(),
+        "is_processing_locked": any(slot.processing_lock.locked() for slot in all_slots) if all_slots else processing_lock.locked(),
+        "backends": [backend.describe() for backend in backend_pool],
+        "model_switching": model_switch_stats,
+        "admission": describe_admission(admission_queues),
         "items": sorted([
             {
                 "req_id": item.get("req_id", "unknown"),
+                "backend": item.get("backend"),
                 "enqueue_time": item.get("enqueue_time", 0),
                 "wait_time_seconds": round(time.time() - item.get("enqueue_time", 0), 2),
                 "is_streaming": item.get("request_data").stream,
@@ -270,6 +363,26 @@ async def get_queue_status(
     })
 
 
+# --- 阶段耗时端点 ---
+async def get_stage_timings(limit: int = 50):
+    """最近完成请求的各阶段耗时（秒）"""
+    from logging_utils.stage_timing import get_recent_timings, STAGES
+    return JSONResponse(content={"stages": list(STAGES), "requests": get_recent_timings(max(1, limit))})
+
+
+# --- 指标端点 ---
+async def get_metrics(
+    request_queue: RequestScheduler = Depends(get_request_queue),
+    backend_pool: List[Any] = Depends(get_backend_pool)
+):
+    """Prometheus 文本格式的指标"""
+    if backend_pool:
+        QUEUE_DEPTH.set(sum(queue.qsize() for backend in backend_pool for queue in backend.all_queues()))
+    else:
+        QUEUE_DEPTH.set(request_queue.qsize() if request_queue else 0)
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
 # --- WebSocket日志端点 ---
 async def websocket_log_endpoint(
     websocket: WebSocket,
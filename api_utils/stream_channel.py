@@ -0,0 +1,157 @@
+"""
+辅助流通道模块
+把辅助流进程写入的 multiprocessing.Queue 桥接为事件循环可直接 await 的 asyncio 队列，
+并按请求ID把数据帧分发给对应的消费者
+"""
+
+import asyncio
+import json
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from logging_utils.metrics import STREAM_PROXY_BYTES_TOTAL
+from logging_utils.tracing import export_remote_spans
+
+
+class StreamChannel:
+    """
+    辅助流数据通道
+
+    后台线程阻塞读取跨进程队列，收到数据后通过 call_soon_threadsafe 立即投递到
+    事件循环，消费者 await 即可，无需轮询和固定间隔的 sleep。
+
+    每个请求在提交前通过 subscribe() 登记，数据帧按 req_id 路由到该请求自己的队列；
+    未带 req_id 的帧按代理分配的 stream_id 绑定到最早登记且尚未绑定的请求。
+    无人认领的帧（已结束请求的残留）直接丢弃，因此请求之间无需再清空队列。
+    代理回报生成参数改写结果的控制帧（含 config_rewrite）交给 on_config_rewrite 处理，
+    大提示注入结果的控制帧（含 prompt_injection）交给 expect_prompt_injection() 返回的 Future，
+    代理回报的追踪 span（含 trace_spans）直接写入追踪导出文件，均不进入请求队列。
+    """
+
+    def __init__(self, source_queue, logger: logging.Logger,
+                 on_config_rewrite: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self._source = source_queue
+        self._logger = logger
+        self._on_config_rewrite = on_config_rewrite
+        self._prompt_injection_waiters: Dict[str, asyncio.Future] = {}
+        self._subscribers: "OrderedDict[str, asyncio.Queue]" = OrderedDict()
+        self._stream_bindings: Dict[Any, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self.dropped_frames = 0
+
+    def start(self) -> None:
+        """在当前事件循环上启动读取线程"""
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._pump, name="StreamChannelReader", daemon=True)
+        self._thread.start()
+        self._logger.info("辅助流通道读取线程已启动。")
+
+    def stop(self) -> None:
+        """停止读取线程（线程为 daemon，最多在一个读取超时周期内退出）"""
+        self._stopped.set()
+
+    def _pump(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                item = self._source.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError, ValueError):
+                # 队列已关闭（辅助流进程退出或正在关闭）
+                break
+
+            if isinstance(item, (str, bytes)):
+                STREAM_PROXY_BYTES_TOTAL.inc(len(item))
+                try:
+                    item = json.loads(item)
+                except json.JSONDecodeError:
+                    pass
+
+            try:
+                self._loop.call_soon_threadsafe(self._deliver, item)
+            except RuntimeError:
+                # 事件循环已关闭
+                break
+
+    def _resolve_target(self, item: Any) -> Optional[str]:
+        if not isinstance(item, dict):
+            return None
+
+        req_id = item.get("req_id")
+        stream_id = item.get("stream_id")
+        if req_id:
+            if req_id not in self._subscribers:
+                return None
+            self._stream_bindings.setdefault(stream_id, req_id)
+            return req_id
+
+        bound = self._stream_bindings.get(stream_id)
+        if bound is not None:
+            return bound if bound in self._subscribers else None
+
+        bound_req_ids = set(self._stream_bindings.values())
+        for candidate in self._subscribers:
+            if candidate not in bound_req_ids:
+                self._stream_bindings[stream_id] = candidate
+                return candidate
+        return None
+
+    def _deliver(self, item: Any) -> None:
+        if isinstance(item, dict) and "config_rewrite" in item:
+            if self._on_config_rewrite is not None:
+                self._on_config_rewrite(item)
+            return
+        if isinstance(item, dict) and "prompt_injection" in item:
+            waiter = self._prompt_injection_waiters.pop(item.get("req_id"), None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(dict(item["prompt_injection"], stream_id=item.get("stream_id")))
+            return
+        if isinstance(item, dict) and "trace_spans" in item:
+            export_remote_spans(item["trace_spans"])
+            return
+        target = self._resolve_target(item)
+        if target is None:
+            self.dropped_frames += 1
+            self._logger.debug(f"辅助流通道丢弃无人认领的数据帧: {str(item)[:200]}")
+            return
+        self._subscribers[target].put_nowait(item)
+
+    def subscribe(self, req_id: str) -> None:
+        """登记请求，之后到达的该请求数据帧会被保留（应在提交提示前调用）"""
+        if req_id not in self._subscribers:
+            self._subscribers[req_id] = asyncio.Queue()
+
+    def unsubscribe(self, req_id: str) -> List[Any]:
+        """注销请求并丢弃其未消费的数据帧，返回已绑定到该请求的 stream_id"""
+        self._subscribers.pop(req_id, None)
+        stream_ids = [sid for sid, rid in self._stream_bindings.items() if rid == req_id]
+        for stream_id in stream_ids:
+            del self._stream_bindings[stream_id]
+        return stream_ids
+
+    def expect_prompt_injection(self, req_id: str) -> asyncio.Future:
+        """登记等待代理回报该请求的提示注入结果（应在提交占位提示前调用）"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._prompt_injection_waiters[req_id] = waiter
+        return waiter
+
+    def cancel_prompt_injection(self, req_id: str) -> None:
+        waiter = self._prompt_injection_waiters.pop(req_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.cancel()
+
+    def is_subscribed(self, req_id: str) -> bool:
+        return req_id in self._subscribers
+
+    async def get(self, req_id: str, timeout: Optional[float] = None) -> Any:
+        """等待该请求的下一帧数据，超时抛出 asyncio.TimeoutError"""
+        self.subscribe(req_id)
+        subscriber_queue = self._subscribers[req_id]
+        if timeout is None:
+            return await subscriber_queue.get()
+        return await asyncio.wait_for(subscriber_queue.get(), timeout=timeout)
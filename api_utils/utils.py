@@ -10,6 +10,7 @@ import datetime
 from typing import Any, Dict, List, Optional, AsyncGenerator
 from asyncio import Queue
 from models import Message
+from logging_utils.metrics import TOKENS_TOTAL
 import re
 import base64
 import requests
@@ -55,74 +56,55 @@ def generate_sse_error_chunk(message: str, req_id: str, error_type: str = "serve
 
 # --- 流处理工具函数 ---
 async def use_stream_response(req_id: str) -> AsyncGenerator[Any, None]:
-    """使用流响应（从服务器的全局队列获取数据）"""
-    from server import STREAM_QUEUE, logger
-    import queue
+    """使用流响应（等待辅助流通道推送的数据，到达即返回）"""
+    from server import STREAM_CHANNEL, logger
     
-    if STREAM_QUEUE is None:
-        logger.warning(f"[{req_id}] STREAM_QUEUE is None, 无法使用流响应")
+    if STREAM_CHANNEL is None:
+        logger.warning(f"[{req_id}] STREAM_CHANNEL is None, 无法使用流响应")
         return
     
     logger.info(f"[{req_id}] 开始使用流响应")
     
-    empty_count = 0
-    max_empty_retries = 300  # 30秒超时
+    wait_interval = 5.0  # 每5秒记录一次等待状态
+    max_idle_seconds = 30.0  # 30秒无数据视为超时
+    idle_seconds = 0.0
     data_received = False
     
     try:
         while True:
             try:
-                # 从队列中获取数据
-                data = STREAM_QUEUE.get_nowait()
-                if data is None:  # 结束标志
-                    logger.info(f"[{req_id}] 接收到流结束标志")
-                    break
-                
-                # 重置空计数器
-                empty_count = 0
-                data_received = True
-                logger.debug(f"[{req_id}] 接收到流数据: {type(data)} - {str(data)[:200]}...")
-                
-                # 检查是否是JSON字符串形式的结束标志
-                if isinstance(data, str):
-                    try:
-                        parsed_data = json.loads(data)
-                        if parsed_data.get("done") is True:
-                            logger.info(f"[{req_id}] 接收到JSON格式的完成标志")
-                            yield parsed_data
-                            break
-                        else:
-                            yield parsed_data
-                    except json.JSONDecodeError:
-                        # 如果不是JSON，直接返回字符串
-                        logger.debug(f"[{req_id}] 返回非JSON字符串数据")
-                        yield data
-                else:
-                    # 直接返回数据
-                    yield data
-                    
-                    # 检查字典类型的结束标志
-                    if isinstance(data, dict) and data.get("done") is True:
-                        logger.info(f"[{req_id}] 接收到字典格式的完成标志")
-                        break
-                
-            except (queue.Empty, asyncio.QueueEmpty):
-                empty_count += 1
-                if empty_count % 50 == 0:  # 每5秒记录一次等待状态
-                    logger.info(f"[{req_id}] 等待流数据... ({empty_count}/{max_empty_retries})")
-                
-                if empty_count >= max_empty_retries:
+                # 等待通道推送数据
+                data = await STREAM_CHANNEL.get(req_id, timeout=wait_interval)
+            except asyncio.TimeoutError:
+                idle_seconds += wait_interval
+                logger.info(f"[{req_id}] 等待流数据... ({idle_seconds:.0f}s/{max_idle_seconds:.0f}s)")
+
+                if idle_seconds >= max_idle_seconds:
                     if not data_received:
-                        logger.error(f"[{req_id}] 流响应队列空读取次数达到上限且未收到任何数据，可能是辅助流未启动或出错")
+                        logger.error(f"[{req_id}] 流响应等待超时且未收到任何数据，可能是辅助流未启动或出错")
                     else:
-                        logger.warning(f"[{req_id}] 流响应队列空读取次数达到上限 ({max_empty_retries})，结束读取")
+                        logger.warning(f"[{req_id}] 流响应等待超时 ({max_idle_seconds:.0f}s 无数据)，结束读取")
                     
                     # 返回超时完成信号，而不是简单退出
-                    yield {"done": True, "reason": "internal_timeout", "body": "", "function": []}
+                    yield {"done": True, "reason": "", "body": "", "function": [], "internal_timeout": True}
                     return
-                    
-                await asyncio.sleep(0.1)  # 100ms等待
                 continue
+
+            if data is None:  # 结束标志
+                logger.info(f"[{req_id}] 接收到流结束标志")
+                break
+            
+            # 重置空闲计时
+            idle_seconds = 0.0
+            data_received = True
+            logger.debug(f"[{req_id}] 接收到流数据: {type(data)} - {str(data)[:200]}...")
+            
+            yield data
+
+            # 检查字典类型的结束标志
+            if isinstance(data, dict) and data.get("done") is True:
+                logger.info(f"[{req_id}] 接收到完成标志")
+                break
                 
     except Exception as e:
         logger.error(f"[{req_id}] 使用流响应时出错: {e}")
@@ -131,26 +113,17 @@ async def use_stream_response(req_id: str) -> AsyncGenerator[Any, None]:
         logger.info(f"[{req_id}] 流响应使用完成，数据接收状态: {data_received}")
 
 
-async def clear_stream_queue():
-    """清空流队列（与原始参考文件保持一致）"""
-    from server import STREAM_QUEUE, logger
-    import queue
+async def clear_stream_queue(req_id: Optional[str] = None):
+    """释放请求的流订阅；辅助流数据按请求ID分发，无人认领的残留帧会被直接丢弃，无需再清空队列"""
+    from server import STREAM_CHANNEL, logger
 
-    if STREAM_QUEUE is None:
+    if STREAM_CHANNEL is None:
         logger.info("流队列未初始化或已被禁用，跳过清空操作。")
         return
 
-    while True:
-        try:
-            data_chunk = await asyncio.to_thread(STREAM_QUEUE.get_nowait)
-            # logger.info(f"清空流式队列缓存，丢弃数据: {data_chunk}")
-        except queue.Empty:
-            logger.info("流式队列已清空 (捕获到 queue.Empty)。")
-            break
-        except Exception as e:
-            logger.error(f"清空流式队列时发生意外错误: {e}", exc_info=True)
-            break
-    logger.info("流式队列缓存清空完毕。")
+    if req_id is not None:
+        STREAM_CHANNEL.unsubscribe(req_id)
+        logger.info(f"[{req_id}] 已释放辅助流订阅。")
 
 
 # --- Helper response generator ---
@@ -198,6 +171,16 @@ def validate_chat_request(messages: List[Message], req_id: str) -> Dict[str, Opt
     }
 
 
+def get_requested_model_id(request: Any) -> Optional[str]:
+    """请求指定的 AI Studio 模型 ID；未指定或为代理默认模型名时返回 None（沿用页面当前模型）"""
+    from config import MODEL_NAME
+
+    requested_model = getattr(request, "model", None)
+    if not requested_model or requested_model == MODEL_NAME:
+        return None
+    return requested_model.split('/')[-1]
+
+
 def extract_base64_to_local(base64_data: str) -> str:
     output_dir = os.path.join(os.path.dirname(__file__), '..', 'upload_images')
     match = re.match(r"data:image/(\w+);base64,(.*)", base64_data)
@@ -241,6 +224,78 @@ def extract_base64_to_local(base64_data: str) -> str:
 
 
 # --- 提示准备函数 ---
+def _format_tool_calls(tool_calls) -> List[str]:
+    """将助手消息中的工具调用格式化为文本"""
+    tool_call_visualizations = []
+    for tool_call in tool_calls:
+        if hasattr(tool_call, 'type') and tool_call.type == 'function':
+            function_call = tool_call.function
+            func_name = function_call.name if function_call else None
+            func_args_str = function_call.arguments if function_call else None
+
+            try:
+                parsed_args = json.loads(func_args_str if func_args_str else '{}')
+                formatted_args = json.dumps(parsed_args, indent=2, ensure_ascii=False)
+            except (json.JSONDecodeError, TypeError):
+                formatted_args = func_args_str if func_args_str is not None else "{}"
+
+            tool_call_visualizations.append(
+                f"请求调用函数: {func_name}\n参数:\n{formatted_args}"
+            )
+    return tool_call_visualizations
+
+
+def build_prompt_contents(messages: List[Message], req_id: str) -> List[list]:
+    """
+    将 OpenAI 消息构建为 GenerateContent 请求体中的多轮对话内容（JSPB 格式：[[[null, text], ...], role]），
+    供辅助流代理替换占位提示。系统消息与组合提示一样以"系统指令:"前缀并入首个用户轮次，
+    工具结果作为用户轮次，相邻同角色轮次合并。
+    """
+    from server import logger
+
+    turns: List[list] = []
+
+    def add_turn(role: str, text: str) -> None:
+        if not text:
+            return
+        if turns and turns[-1][1] == role:
+            turns[-1][0].append([None, text])
+        else:
+            turns.append([[[None, text]], role])
+
+    system_added = False
+    for msg in messages:
+        content = msg.content or ''
+        if isinstance(content, list):
+            text_parts = []
+            for item in content:
+                if hasattr(item, 'type') and item.type == 'text':
+                    text_parts.append(item.text or '')
+                elif isinstance(item, dict) and item.get('type') == 'text':
+                    text_parts.append(item.get('text', ''))
+            content_str = "\n".join(text_parts).strip()
+        else:
+            content_str = str(content).strip()
+
+        if msg.role == 'system':
+            if not system_added and content_str:
+                add_turn("user", f"系统指令:\n{content_str}")
+                system_added = True
+            continue
+
+        if msg.role == 'assistant':
+            if msg.tool_calls:
+                content_str = "\n".join([content_str] + _format_tool_calls(msg.tool_calls)).strip()
+            add_turn("model", content_str)
+        elif msg.role == 'tool':
+            add_turn("user", f"工具:\n{content_str}" if content_str else "")
+        else:
+            add_turn("user", content_str)
+
+    logger.info(f"[{req_id}] (准备提示) 已构建 {len(turns)} 个对话轮次用于请求体注入。")
+    return turns
+
+
 def prepare_combined_prompt(messages: List[Message], req_id: str) -> str:
     """准备组合提示"""
     from server import logger
@@ -324,22 +379,7 @@ def prepare_combined_prompt(messages: List[Message], req_id: str) -> str:
             if content_str:
                 current_turn_parts.append("\n")
             
-            tool_call_visualizations = []
-            for tool_call in tool_calls:
-                if hasattr(tool_call, 'type') and tool_call.type == 'function':
-                    function_call = tool_call.function
-                    func_name = function_call.name if function_call else None
-                    func_args_str = function_call.arguments if function_call else None
-                    
-                    try:
-                        parsed_args = json.loads(func_args_str if func_args_str else '{}')
-                        formatted_args = json.dumps(parsed_args, indent=2, ensure_ascii=False)
-                    except (json.JSONDecodeError, TypeError):
-                        formatted_args = func_args_str if func_args_str is not None else "{}"
-                    
-                    tool_call_visualizations.append(
-                        f"请求调用函数: {func_name}\n参数:\n{formatted_args}"
-                    )
+            tool_call_visualizations = _format_tool_calls(tool_calls)
             
             if tool_call_visualizations:
                 current_turn_parts.append("\n".join(tool_call_visualizations))
@@ -415,6 +455,8 @@ def calculate_usage_stats(messages: List[dict], response_content: str, reasoning
     
     # 总token数
     total_tokens = prompt_tokens + completion_tokens
+    TOKENS_TOTAL.inc(prompt_tokens, type="prompt")
+    TOKENS_TOTAL.inc(completion_tokens, type="completion")
     
     return {
         "prompt_tokens": prompt_tokens,
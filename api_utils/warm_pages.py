@@ -0,0 +1,103 @@
+"""
+常驻模型页面模块
+为常用模型各保留一个已切换到该模型的页面，请求按模型直接路由到对应页面，
+模型切换由一次字典查找代替页面导航；页面数量超过上限时按 LRU 改派
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from config import WARM_MODEL_PAGES, WARM_PAGE_MAX
+from .request_scheduler import RequestScheduler
+from .conversation_affinity import forget_conversation
+
+
+async def _pin_slot_to_model(slot, model_id: str, logger: logging.Logger) -> None:
+    """将页面切换到指定模型并应用 UI 状态"""
+    from browser_utils.model_management import switch_ai_studio_model, _verify_and_apply_ui_state
+
+    if slot.current_model_id != model_id:
+        if not await switch_ai_studio_model(slot.page, model_id, f"warm-{slot.index}"):
+            raise RuntimeError(f"{slot.name} 切换到模型 {model_id} 失败")
+        slot.current_model_id = model_id
+        forget_conversation(slot)
+    else:
+        await _verify_and_apply_ui_state(slot.page, f"warm-{slot.index}")
+    slot.pinned_model_id = model_id
+    logger.info(f"常驻模型页面: {slot.name} 已固定为模型 {model_id}")
+
+
+async def _open_warm_page(backend, model_id: str, logger: logging.Logger):
+    """在实例的浏览器上下文中为模型打开一个常驻页面（不启动 Worker）"""
+    from .page_pool import _open_pool_page
+
+    context = backend.page_pool[0].page.context
+    slot = await _open_pool_page(context, backend.next_page_index(), logger, backend)
+    slot.own_queue = RequestScheduler()
+    try:
+        await _pin_slot_to_model(slot, model_id, logger)
+    except Exception:
+        await slot.page.close()
+        raise
+    backend.page_pool.append(slot)
+    backend.warm_pages[model_id] = slot
+    return slot
+
+
+async def open_warm_pages(backend, logger: logging.Logger) -> None:
+    """启动时为 WARM_MODEL_PAGES 中的模型打开常驻页面，单个页面失败不影响其它页面"""
+    if not WARM_MODEL_PAGES or not backend.page_pool or backend.page_pool[0].page is None:
+        return
+    for model_id in WARM_MODEL_PAGES:
+        try:
+            await _open_warm_page(backend, model_id, logger)
+        except Exception as e:
+            logger.error(f"常驻模型页面: 为 {backend.name} 打开模型 {model_id} 的页面失败: {e}", exc_info=True)
+    logger.info(f"常驻模型页面: {backend.name} 已就绪 {list(backend.warm_pages.keys())}")
+
+
+async def _add_warm_page_in_background(backend, model_id: str, logger: logging.Logger) -> None:
+    import server
+    from .queue_worker import queue_worker
+
+    try:
+        slot = await _open_warm_page(backend, model_id, logger)
+        slot.worker_task = asyncio.create_task(queue_worker(slot))
+        server.worker_tasks.append(slot.worker_task)
+    except Exception as e:
+        logger.error(f"常驻模型页面: 为模型 {model_id} 新开页面失败: {e}", exc_info=True)
+    finally:
+        backend.warm_pages_opening.discard(model_id)
+
+
+def route_to_warm_page(backend, model_id: Optional[str], logger: logging.Logger):
+    """
+    返回应处理该模型请求的常驻页面，没有时返回 None（由通用页面处理）。
+    未命中时：未达 WARM_PAGE_MAX 则在后台为该模型新开页面；
+    已达上限则把最久未用的空闲常驻页面改派给该模型，由其 Worker 在处理请求时完成切换。
+    """
+    if not WARM_MODEL_PAGES or backend is None or model_id is None:
+        return None
+
+    slot = backend.warm_pages.get(model_id)
+    if slot is not None:
+        if not slot.is_available:
+            return None
+        backend.warm_pages.move_to_end(model_id)
+        return slot
+
+    if len(backend.warm_pages) + len(backend.warm_pages_opening) < WARM_PAGE_MAX:
+        if model_id not in backend.warm_pages_opening:
+            backend.warm_pages_opening.add(model_id)
+            asyncio.create_task(_add_warm_page_in_background(backend, model_id, logger))
+        return None
+
+    for evicted_model_id, candidate in backend.warm_pages.items():
+        if candidate.is_available and not candidate.is_busy and candidate.own_queue.empty():
+            del backend.warm_pages[evicted_model_id]
+            candidate.pinned_model_id = model_id
+            backend.warm_pages[model_id] = candidate
+            logger.info(f"常驻模型页面: {candidate.name} 由模型 {evicted_model_id} 改派给 {model_id} (LRU)")
+            return candidate
+    return None
@@ -8,7 +8,9 @@ from .operations import (
     get_response_via_edit_button,
     get_response_via_copy_button,
     _wait_for_response_completion,
+    _get_final_response,
     _get_final_response_content,
+    extract_response_from_page,
     get_raw_text_content
 )
 from .model_management import (
@@ -22,6 +24,17 @@ from .model_management import (
     _verify_and_apply_ui_state
 )
 from .script_manager import ScriptManager, script_manager
+from .stream_tagging import (
+    set_page_request_id,
+    get_page_request_id,
+    clear_page_request_id,
+    set_page_generation_config,
+    set_page_prompt_placeholder,
+    get_verified_rewrite_fields,
+    record_generation_config_ack,
+    get_generate_content_template
+)
+from .response_streaming import LiveResponseStream
 
 __all__ = [
     # 初始化相关
@@ -37,7 +50,9 @@ __all__ = [
     'get_response_via_edit_button',
     'get_response_via_copy_button',
     '_wait_for_response_completion',
+    '_get_final_response',
     '_get_final_response_content',
+    'extract_response_from_page',
     'get_raw_text_content',
     
     # 模型管理相关
@@ -52,5 +67,18 @@ __all__ = [
 
     # 脚本管理相关
     'ScriptManager',
-    'script_manager'
+    'script_manager',
+
+    # 辅助流请求关联
+    'set_page_request_id',
+    'get_page_request_id',
+    'clear_page_request_id',
+    'set_page_generation_config',
+    'set_page_prompt_placeholder',
+    'get_verified_rewrite_fields',
+    'record_generation_config_ack',
+    'get_generate_content_template',
+
+    # 页面实时输出
+    'LiveResponseStream'
 ]
\ No newline at end of file
@@ -0,0 +1,280 @@
+# --- browser_utils/batch_parameters.py ---
+# 批量参数调整脚本：一次 page.evaluate 读取所有参数控件的当前值，
+# 再用一次 page.evaluate 写入不一致的控件并回读校验
+
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from config import (
+    TEMPERATURE_INPUT_SELECTOR, MAX_OUTPUT_TOKENS_SELECTOR, TOP_P_INPUT_SELECTOR,
+    USE_URL_CONTEXT_SELECTOR, SET_THINKING_BUDGET_TOGGLE_SELECTOR, THINKING_BUDGET_INPUT_SELECTOR,
+    GROUNDING_WITH_GOOGLE_SEARCH_TOGGLE_SELECTOR
+)
+from config import (
+    DEFAULT_TEMPERATURE, DEFAULT_MAX_OUTPUT_TOKENS, DEFAULT_STOP_SEQUENCES, DEFAULT_TOP_P,
+    ENABLE_URL_CONTEXT, ENABLE_THINKING_BUDGET, DEFAULT_THINKING_BUDGET, ENABLE_GOOGLE_SEARCH
+)
+
+TOOLS_PANEL_BUTTON_SELECTOR = 'button[aria-label="Expand or collapse tools"]'
+
+# 控件定义：key -> (选择器, 类型, 是否位于工具面板内)
+PARAMETER_CONTROLS: Dict[str, Dict[str, Any]] = {
+    "temperature": {"selector": TEMPERATURE_INPUT_SELECTOR, "kind": "number", "in_tools_panel": False},
+    "max_output_tokens": {"selector": MAX_OUTPUT_TOKENS_SELECTOR, "kind": "number", "in_tools_panel": False},
+    "top_p": {"selector": TOP_P_INPUT_SELECTOR, "kind": "number", "in_tools_panel": False},
+    "url_context": {"selector": USE_URL_CONTEXT_SELECTOR, "kind": "toggle", "in_tools_panel": True},
+    "thinking_budget_enabled": {"selector": SET_THINKING_BUDGET_TOGGLE_SELECTOR, "kind": "toggle", "in_tools_panel": True},
+    "thinking_budget": {"selector": THINKING_BUDGET_INPUT_SELECTOR, "kind": "number", "in_tools_panel": True},
+    "google_search": {"selector": GROUNDING_WITH_GOOGLE_SEARCH_TOGGLE_SELECTOR, "kind": "toggle", "in_tools_panel": True},
+}
+
+# 数值比较容差（与逐项调整时的校验一致）
+NUMBER_TOLERANCE = 0.001
+
+_DOM_HELPERS = """
+    const find = (selector) => selector.startsWith('//')
+        ? document.evaluate(selector, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue
+        : document.querySelector(selector);
+    const visible = (el) => !!(el && (el.offsetWidth || el.offsetHeight || el.getClientRects().length));
+"""
+
+READ_PARAMETERS_SCRIPT = """
+(controls) => {
+""" + _DOM_HELPERS + """
+    const state = {};
+    for (const control of controls) {
+        const el = find(control.selector);
+        if (!visible(el)) {
+            state[control.key] = null;
+        } else if (control.kind === 'toggle') {
+            state[control.key] = el.getAttribute('aria-checked') === 'true';
+        } else {
+            const value = parseFloat(el.value);
+            state[control.key] = Number.isNaN(value) ? null : value;
+        }
+    }
+    return state;
+}
+"""
+
+APPLY_PARAMETERS_SCRIPT = """
+async ({ controls, panelSelector, tolerance }) => {
+""" + _DOM_HELPERS + """
+    const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+    const results = {};
+
+    if (controls.some(control => control.in_tools_panel)) {
+        const panelButton = find(panelSelector);
+        const panel = panelButton && panelButton.parentElement && panelButton.parentElement.parentElement;
+        if (panel && !panel.classList.contains('expanded')) {
+            panelButton.click();
+            await sleep(400);
+        }
+    }
+
+    // 先处理开关（思考预算输入框在切换为手动后才出现），再写入数值
+    const toggles = controls.filter(control => control.kind === 'toggle');
+    for (const control of toggles) {
+        const el = find(control.selector);
+        if (!visible(el)) {
+            results[control.key] = { ok: false, reason: 'not_visible' };
+        } else if ((el.getAttribute('aria-checked') === 'true') !== control.value) {
+            el.click();
+        }
+    }
+    if (toggles.length) await sleep(300);
+
+    const valueSetter = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+    for (const control of controls.filter(control => control.kind === 'number')) {
+        const el = find(control.selector);
+        if (!visible(el)) {
+            results[control.key] = { ok: false, reason: 'not_visible' };
+            continue;
+        }
+        el.focus();
+        valueSetter.call(el, String(control.value));
+        el.dispatchEvent(new Event('input', { bubbles: true }));
+        el.dispatchEvent(new Event('change', { bubbles: true }));
+        el.blur();
+    }
+    await sleep(100);
+
+    for (const control of controls) {
+        if (results[control.key]) continue;
+        const el = find(control.selector);
+        if (!el) {
+            results[control.key] = { ok: false, reason: 'not_found' };
+        } else if (control.kind === 'toggle') {
+            const value = el.getAttribute('aria-checked') === 'true';
+            results[control.key] = { ok: value === control.value, value: value };
+        } else {
+            const value = parseFloat(el.value);
+            results[control.key] = { ok: Math.abs(value - control.value) < tolerance, value: Number.isNaN(value) ? null : value };
+        }
+    }
+    return results;
+}
+"""
+
+
+def build_read_payload(keys: List[str]) -> List[Dict[str, Any]]:
+    return [{"key": key, **PARAMETER_CONTROLS[key]} for key in keys]
+
+
+def build_apply_payload(desired: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "controls": [{"key": key, "value": value, **PARAMETER_CONTROLS[key]} for key, value in desired.items()],
+        "panelSelector": TOOLS_PANEL_BUTTON_SELECTOR,
+        "tolerance": NUMBER_TOLERANCE,
+    }
+
+
+def values_match(key: str, current: Any, desired: Any) -> bool:
+    if current is None:
+        return False
+    if PARAMETER_CONTROLS[key]["kind"] == "toggle":
+        return bool(current) == bool(desired)
+    return abs(float(current) - float(desired)) < NUMBER_TOLERANCE
+
+
+# --- 请求参数 -> 控件期望值（页面调整和直连引擎共用） ---
+
+# 可由流式代理 / 直连引擎直接写入 GenerateContent 请求体的生成参数
+GENERATION_CONFIG_FIELDS = ("temperature", "max_output_tokens", "top_p", "thinking_budget")
+
+
+def desired_parameter_state(request_params: Dict[str, Any], model_id_to_use: str, parsed_model_list: List[Dict[str, Any]],
+                            logger: logging.Logger, req_id: str) -> Dict[str, Any]:
+    """计算各参数控件的期望值（键与 PARAMETER_CONTROLS 对应），未列出的控件保持不变。"""
+    temperature = request_params.get('temperature', DEFAULT_TEMPERATURE)
+    clamped_temp = max(0.0, min(2.0, temperature))
+    if clamped_temp != temperature:
+        logger.warning(f"[{req_id}] 请求的温度 {temperature} 超出范围 [0, 2]，已调整为 {clamped_temp}")
+
+    max_tokens = request_params.get('max_output_tokens', DEFAULT_MAX_OUTPUT_TOKENS)
+    clamped_max_tokens = clamp_max_tokens(max_tokens, model_id_to_use, parsed_model_list, logger, req_id)
+
+    top_p = request_params.get('top_p', DEFAULT_TOP_P)
+    clamped_top_p = max(0.0, min(1.0, top_p))
+    if abs(clamped_top_p - top_p) > 1e-9:
+        logger.warning(f"[{req_id}] 请求的 Top P {top_p} 超出范围 [0, 1]，已调整为 {clamped_top_p}")
+
+    desired: Dict[str, Any] = {
+        "temperature": clamped_temp,
+        "max_output_tokens": clamped_max_tokens,
+        "top_p": clamped_top_p,
+    }
+    if ENABLE_URL_CONTEXT:
+        desired["url_context"] = True
+
+    reasoning_effort = request_params.get('reasoning_effort')
+    if isinstance(reasoning_effort, str) and reasoning_effort.lower() == 'none':
+        desired["thinking_budget_enabled"] = False
+    elif reasoning_effort is not None or ENABLE_THINKING_BUDGET:
+        desired["thinking_budget_enabled"] = True
+        token_budget = parse_thinking_budget(reasoning_effort, logger, req_id)
+        if token_budget is not None:
+            desired["thinking_budget"] = token_budget
+    else:
+        desired["thinking_budget_enabled"] = False
+
+    desired["google_search"] = should_enable_google_search(request_params, logger, req_id)
+    return desired
+
+
+def build_generation_config(desired: Dict[str, Any], request_params: Dict[str, Any]) -> Dict[str, Any]:
+    """写入 GenerateContent 请求体的生成参数（停止序列排序后写入，便于比较）"""
+    generation_config = {key: desired[key] for key in GENERATION_CONFIG_FIELDS if key in desired}
+    generation_config["stop_sequences"] = sorted(normalize_stop_sequences(request_params.get('stop', DEFAULT_STOP_SEQUENCES)))
+    return generation_config
+
+
+def clamp_max_tokens(max_tokens: int, model_id_to_use: str, parsed_model_list: list, logger: logging.Logger, req_id: str) -> int:
+    """将最大输出Token限制在模型支持的范围内。"""
+    min_val_for_tokens = 1
+    max_val_for_tokens_from_model = 65536
+
+    if model_id_to_use and parsed_model_list:
+        current_model_data = next((m for m in parsed_model_list if m.get("id") == model_id_to_use), None)
+        if current_model_data and current_model_data.get("supported_max_output_tokens") is not None:
+            try:
+                supported_tokens = int(current_model_data["supported_max_output_tokens"])
+                if supported_tokens > 0:
+                    max_val_for_tokens_from_model = supported_tokens
+                else:
+                    logger.warning(f"[{req_id}] 模型 {model_id_to_use} supported_max_output_tokens 无效: {supported_tokens}")
+            except (ValueError, TypeError):
+                logger.warning(f"[{req_id}] 模型 {model_id_to_use} supported_max_output_tokens 解析失败")
+
+    clamped_max_tokens = max(min_val_for_tokens, min(max_val_for_tokens_from_model, max_tokens))
+    if clamped_max_tokens != max_tokens:
+        logger.warning(f"[{req_id}] 请求的最大输出 Tokens {max_tokens} 超出模型范围，已调整为 {clamped_max_tokens}")
+    return clamped_max_tokens
+
+
+def parse_thinking_budget(reasoning_effort: Optional[Any], logger: logging.Logger, req_id: str) -> Optional[int]:
+    """从 reasoning_effort 解析出 token_budget。"""
+    token_budget = None
+    if reasoning_effort is None:
+        token_budget = DEFAULT_THINKING_BUDGET
+        logger.info(f"[{req_id}] 'reasoning_effort' 为空，使用默认思考预算: {token_budget}")
+    elif isinstance(reasoning_effort, int):
+        token_budget = reasoning_effort
+    elif isinstance(reasoning_effort, str):
+        if reasoning_effort.lower() == 'none':
+            token_budget = DEFAULT_THINKING_BUDGET
+            logger.info(f"[{req_id}] 'reasoning_effort' 为 'none' 字符串，使用默认思考预算: {token_budget}")
+        else:
+            effort_map = {
+                "low": 1000,
+                "medium": 8000,
+                "high": 24000
+            }
+            token_budget = effort_map.get(reasoning_effort.lower())
+            if token_budget is None:
+                try:
+                    token_budget = int(reasoning_effort)
+                except (ValueError, TypeError):
+                    pass # token_budget remains None
+
+    if token_budget is None:
+        logger.warning(f"[{req_id}] 无法从 '{reasoning_effort}' (类型: {type(reasoning_effort)}) 解析出有效的 token_budget。")
+
+    return token_budget
+
+
+def should_enable_google_search(request_params: Dict[str, Any], logger: logging.Logger, req_id: str) -> bool:
+    """根据请求参数或默认配置决定是否应启用 Google Search。"""
+    if 'tools' in request_params and request_params.get('tools') is not None:
+        tools = request_params.get('tools')
+        has_google_search_tool = False
+        if isinstance(tools, list):
+            for tool in tools:
+                if isinstance(tool, dict):
+                    if tool.get('google_search_retrieval') is not None:
+                        has_google_search_tool = True
+                        break
+                    if tool.get('function', {}).get('name') == 'googleSearch':
+                        has_google_search_tool = True
+                        break
+        logger.info(f"[{req_id}] 请求中包含 'tools' 参数。检测到 Google Search 工具: {has_google_search_tool}。")
+        return has_google_search_tool
+    else:
+        logger.info(f"[{req_id}] 请求中不包含 'tools' 参数。使用默认配置 ENABLE_GOOGLE_SEARCH: {ENABLE_GOOGLE_SEARCH}。")
+        return ENABLE_GOOGLE_SEARCH
+
+
+def normalize_stop_sequences(stop_sequences) -> Set[str]:
+    """处理不同类型的stop_sequences输入，返回去除空白后的停止序列集合。"""
+    normalized_requested_stops = set()
+    if stop_sequences is not None:
+        if isinstance(stop_sequences, str):
+            # 单个字符串
+            if stop_sequences.strip():
+                normalized_requested_stops.add(stop_sequences.strip())
+        elif isinstance(stop_sequences, list):
+            # 字符串列表
+            for s in stop_sequences:
+                if isinstance(s, str) and s.strip():
+                    normalized_requested_stops.add(s.strip())
+    return normalized_requested_stops
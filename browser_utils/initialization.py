@@ -13,6 +13,7 @@ from playwright.async_api import Page as AsyncPage, Browser as AsyncBrowser, Bro
 # 导入配置和模型
 from config import *
 from models import ClientDisconnectedError
+from logging_utils.metrics import PAGE_LOAD_SECONDS, ROUTE_HANDLER_SECONDS
 
 logger = logging.getLogger("AIStudioProxyServer")
 
@@ -36,37 +37,38 @@ async def _setup_network_interception_and_scripts(context: AsyncBrowserContext):
         logger.error(f"设置网络拦截和脚本注入时发生错误: {e}")
 
 
+def _is_model_list_url(url: str) -> bool:
+    """模型列表请求；路由只匹配它，页面的其它请求（脚本、字体、遥测、GenerateContent）不再经过 Python"""
+    return 'alkalimakersuite' in url and 'ListModels' in url
+
+
 async def _setup_model_list_interception(context: AsyncBrowserContext):
     """设置模型列表网络拦截"""
     try:
         async def handle_model_list_route(route):
             """处理模型列表请求的路由"""
             request = route.request
+            started_at = time.perf_counter()
+            logger.info(f"🔍 拦截到模型列表请求: {request.url}")
 
-            # 检查是否是模型列表请求
-            if 'alkalimakersuite' in request.url and 'ListModels' in request.url:
-                logger.info(f"🔍 拦截到模型列表请求: {request.url}")
+            # 继续原始请求
+            response = await route.fetch()
 
-                # 继续原始请求
-                response = await route.fetch()
+            # 获取原始响应
+            original_body = await response.body()
 
-                # 获取原始响应
-                original_body = await response.body()
+            # 修改响应
+            modified_body = await _modify_model_list_response(original_body, request.url)
 
-                # 修改响应
-                modified_body = await _modify_model_list_response(original_body, request.url)
-
-                # 返回修改后的响应
-                await route.fulfill(
-                    response=response,
-                    body=modified_body
-                )
-            else:
-                # 对于其他请求，直接继续
-                await route.continue_()
+            # 返回修改后的响应
+            await route.fulfill(
+                response=response,
+                body=modified_body
+            )
+            ROUTE_HANDLER_SECONDS.observe(time.perf_counter() - started_at, route="list_models")
 
-        # 注册路由拦截器
-        await context.route("**/*", handle_model_list_route)
+        # 注册路由拦截器（按 URL 谓词只拦截模型列表请求）
+        await context.route(_is_model_list_url, handle_model_list_route)
         logger.info("✅ 已设置模型列表网络拦截")
 
     except Exception as e:
@@ -257,8 +259,14 @@ def _clean_userscript_headers(script_content: str) -> str:
     return '\n'.join(cleaned_lines)
 
 
-async def _initialize_page_logic(browser: AsyncBrowser):
-    """初始化页面逻辑，连接到现有浏览器"""
+async def _initialize_page_logic(browser: AsyncBrowser, storage_state_path: Optional[str] = None,
+                                 proxy_settings: Optional[Dict[str, Any]] = None):
+    """
+    初始化页面逻辑，连接到现有浏览器
+
+    storage_state_path 和 proxy_settings 供额外后端实例使用，未提供时分别
+    回退到 ACTIVE_AUTH_JSON_PATH 环境变量和 server.PLAYWRIGHT_PROXY_SETTINGS
+    """
     logger.info("--- 初始化页面逻辑 (连接到现有浏览器) ---")
     temp_context: Optional[AsyncBrowserContext] = None
     storage_state_path_to_use: Optional[str] = None
@@ -266,7 +274,13 @@ async def _initialize_page_logic(browser: AsyncBrowser):
     logger.info(f"   检测到启动模式: {launch_mode}")
     loop = asyncio.get_running_loop()
     
-    if launch_mode == 'headless' or launch_mode == 'virtual_headless':
+    if storage_state_path:
+        if not os.path.exists(storage_state_path):
+            logger.error(f"指定的认证文件不存在: '{storage_state_path}'")
+            raise RuntimeError(f"认证文件无效: '{storage_state_path}'")
+        storage_state_path_to_use = storage_state_path
+        logger.info(f"   使用指定的认证文件: {storage_state_path_to_use}")
+    elif launch_mode == 'headless' or launch_mode == 'virtual_headless':
         auth_filename = os.environ.get('ACTIVE_AUTH_JSON_PATH')
         if auth_filename:
             constructed_path = auth_filename
@@ -305,9 +319,11 @@ async def _initialize_page_logic(browser: AsyncBrowser):
         
         # 代理设置需要从server模块中获取
         import server
-        if server.PLAYWRIGHT_PROXY_SETTINGS:
-            context_options['proxy'] = server.PLAYWRIGHT_PROXY_SETTINGS
-            logger.info(f"   (浏览器上下文将使用代理: {server.PLAYWRIGHT_PROXY_SETTINGS['server']})")
+        if proxy_settings is None:
+            proxy_settings = server.PLAYWRIGHT_PROXY_SETTINGS
+        if proxy_settings:
+            context_options['proxy'] = proxy_settings
+            logger.info(f"   (浏览器上下文将使用代理: {proxy_settings['server']})")
         else:
             logger.info("   (浏览器上下文不使用显式代理配置)")
         
@@ -319,6 +335,11 @@ async def _initialize_page_logic(browser: AsyncBrowser):
         # 设置网络拦截和脚本注入
         await _setup_network_interception_and_scripts(temp_context)
 
+        # 启用辅助流时，为 GenerateContent 请求附加请求关联头；直连引擎也依赖该路由记录请求模板
+        if os.environ.get('STREAM_PORT') != '0' or ENABLE_DIRECT_ENGINE:
+            from .stream_tagging import _setup_stream_request_tagging
+            await _setup_stream_request_tagging(temp_context)
+
         found_page: Optional[AsyncPage] = None
         pages = temp_context.pages
         target_url_base = f"https://{AI_STUDIO_URL_PATTERN}"
@@ -354,9 +375,12 @@ async def _initialize_page_logic(browser: AsyncBrowser):
                 logger.info(f"   为新创建的页面添加模型列表响应监听器 (导航前)。")
                 found_page.on("response", _handle_model_list_response)
             try:
+                nav_started_at = time.perf_counter()
                 await found_page.goto(target_full_url, wait_until="domcontentloaded", timeout=90000)
+                nav_seconds = time.perf_counter() - nav_started_at
+                PAGE_LOAD_SECONDS.observe(nav_seconds)
                 current_url = found_page.url
-                logger.info(f"-> 新页面导航尝试完成。当前 URL: {current_url}")
+                logger.info(f"-> 新页面导航尝试完成 ({nav_seconds:.2f}s)。当前 URL: {current_url}")
             except Exception as new_page_nav_err:
                 # 导入save_error_snapshot函数
                 from .operations import save_error_snapshot
@@ -213,7 +213,14 @@ async def switch_ai_studio_model(page: AsyncPage, model_id: str, req_id: str) ->
         
         if current_prefs_for_modification.get("promptModel") == full_model_path:
             logger.info(f"[{req_id}] 模型已经设置为 {model_id} (localStorage 中已是目标值)，无需切换")
-            if page.url != new_chat_url:
+            # localStorage 在同一上下文的所有页面间共享，可能是其它页面写入的，需确认本页面显示的模型
+            displayed_model_id = await _get_displayed_model_id(page)
+            if displayed_model_id and displayed_model_id != model_id:
+                logger.info(f"[{req_id}] 本页面仍显示模型 {displayed_model_id}，重新导航到 {new_chat_url} 以应用 {model_id}")
+                await page.goto(new_chat_url, wait_until="domcontentloaded", timeout=30000)
+                await expect_async(page.locator(INPUT_SELECTOR)).to_be_visible(timeout=30000)
+                await _verify_and_apply_ui_state(page, req_id)
+            elif page.url != new_chat_url:
                  logger.info(f"[{req_id}] 当前 URL 不是 new_chat ({page.url})，导航到 {new_chat_url}")
                  await page.goto(new_chat_url, wait_until="domcontentloaded", timeout=30000)
                  await expect_async(page.locator(INPUT_SELECTOR)).to_be_visible(timeout=30000)
@@ -534,6 +541,15 @@ async def _handle_initial_model_state_and_storage(page: AsyncPage):
         except Exception as fallback_err:
             logger.error(f"   回退设置模型ID也失败: {fallback_err}")
 
+async def _get_displayed_model_id(page: AsyncPage) -> Optional[str]:
+    """读取页面当前显示的模型ID（不修改全局状态）"""
+    try:
+        displayed = await page.locator('[data-test-id="model-name"]').first.inner_text(timeout=7000)
+        return displayed.strip() or None
+    except Exception as e:
+        logger.warning(f"   读取页面显示的模型ID失败: {e}")
+        return None
+
 async def _set_model_from_page_display(page: AsyncPage, set_storage: bool = False):
     """从页面显示设置模型"""
     import server
@@ -14,6 +14,7 @@ from playwright.async_api import Page as AsyncPage, Locator, Error as Playwright
 # 导入配置和模型
 from config import *
 from models import ClientDisconnectedError
+from logging_utils.metrics import SNAPSHOT_SAVE_SECONDS, COMPLETION_DETECTIONS_TOTAL, RESPONSE_EXTRACTIONS_TOTAL
 
 logger = logging.getLogger("AIStudioProxyServer")
 
@@ -437,6 +438,7 @@ async def save_error_snapshot(error_name: str = 'error'):
         return
     
     logger.info(f"{log_prefix} 尝试保存错误快照 ({base_error_name})...")
+    snapshot_started_at = time.perf_counter()
     timestamp = int(time.time() * 1000)
     error_dir = os.path.join(os.path.dirname(__file__), '..', 'errors_py')
     
@@ -473,6 +475,7 @@ async def save_error_snapshot(error_name: str = 'error'):
             logger.error(f"{log_prefix}   获取页面内容失败 ({base_error_name}): {html_err}")
     except Exception as dir_err:
         logger.error(f"{log_prefix}   创建错误目录或保存快照时发生其他错误 ({base_error_name}): {dir_err}")
+    SNAPSHOT_SAVE_SECONDS.observe(time.perf_counter() - snapshot_started_at)
 
 async def get_response_via_edit_button(
     page: AsyncPage,
@@ -668,6 +671,66 @@ async def get_response_via_copy_button(
         await save_error_snapshot(f"copy_response_unexpected_error_{req_id}")
         return None
 
+# 页面内完成检测：MutationObserver 监听运行按钮、加载动画和编辑按钮的变化，
+# 条件满足时立即 resolve（输入框的 value 属性变化不产生 DOM 变更，另以页面内定时器兜底检查）。
+# 观察到生成开始（加载动画出现或运行按钮变为可用的停止按钮）之前，
+# 空闲状态只在 initialWaitMs 之后才算数，以免把提交后、生成开始前的瞬间误判为完成
+_COMPLETION_WATCH_SCRIPT = """
+([textareaSelector, submitSelector, spinnerSelector, editSelector, initialWaitMs, heuristicMs, timeoutMs]) => new Promise(resolve => {
+    const isVisible = el => !!el && el.getClientRects().length > 0;
+    const startedAt = Date.now();
+    let generationSeen = false;
+    let settled = false;
+    let heuristicTimer = null;
+    let observer = null;
+    let ticker = null;
+    let deadline = null;
+    const finish = result => {
+        if (settled) return;
+        settled = true;
+        if (observer) observer.disconnect();
+        clearInterval(ticker);
+        clearTimeout(heuristicTimer);
+        clearTimeout(deadline);
+        resolve(result);
+    };
+    const check = () => {
+        const textarea = document.querySelector(textareaSelector);
+        const submit = document.querySelector(submitSelector);
+        const spinning = !!document.querySelector(spinnerSelector);
+        const inputEmpty = !!textarea && textarea.value === '';
+        // 输入框已清空而运行按钮仍可用，说明按钮处于生成中的“停止”状态
+        if (spinning || (inputEmpty && submit && !submit.disabled)) {
+            generationSeen = true;
+        }
+        const idle = inputEmpty && !!submit && submit.disabled && !spinning
+            && (generationSeen || Date.now() - startedAt >= initialWaitMs);
+        if (!idle) {
+            clearTimeout(heuristicTimer);
+            heuristicTimer = null;
+            return;
+        }
+        if (isVisible(document.querySelector(editSelector))) {
+            finish('observer');
+        } else if (heuristicTimer === null) {
+            // 与轮询相同的启发式：空闲状态持续一段时间而编辑按钮仍未出现，也视为完成
+            heuristicTimer = setTimeout(() => finish('observer_heuristic'), heuristicMs);
+        }
+    };
+    observer = new MutationObserver(check);
+    observer.observe(document.body, {
+        subtree: true, childList: true, attributes: true, attributeFilter: ['disabled', 'class', 'style', 'hidden']
+    });
+    ticker = setInterval(check, 250);
+    deadline = setTimeout(() => finish('timeout'), timeoutMs);
+    check();
+})
+"""
+
+# 启发式完成：空闲状态持续该时长而编辑按钮仍未出现时视为完成（与轮询的 3 次检查相当）
+_COMPLETION_HEURISTIC_MS = 1500
+
+
 async def _wait_for_response_completion(
     page: AsyncPage,
     prompt_textarea_locator: Locator,
@@ -679,7 +742,60 @@ async def _wait_for_response_completion(
     timeout_ms=RESPONSE_COMPLETION_TIMEOUT,
     initial_wait_ms=INITIAL_WAIT_MS_BEFORE_POLLING
 ) -> bool:
-    """等待响应完成"""
+    """等待响应完成：优先使用页面内完成检测，脚本执行失败时回退到轮询"""
+    logger.info(f"[{req_id}] (WaitV4) 开始等待响应完成 (页面内检测)... (超时: {timeout_ms}ms)")
+    start_time = time.time()
+    watch_task = asyncio.create_task(page.evaluate(
+        _COMPLETION_WATCH_SCRIPT,
+        [PROMPT_TEXTAREA_SELECTOR, SUBMIT_BUTTON_SELECTOR, LOADING_SPINNER_SELECTOR,
+         EDIT_MESSAGE_BUTTON_SELECTOR, initial_wait_ms, _COMPLETION_HEURISTIC_MS, timeout_ms]
+    ))
+    try:
+        # 页面内的 Promise 一经 resolve 立即返回；等待期间每秒检查一次客户端连接（不产生页面往返）
+        while not watch_task.done():
+            await asyncio.wait({watch_task}, timeout=1.0)
+            try:
+                check_client_disconnected_func("等待响应完成 - 页面内检测")
+            except ClientDisconnectedError:
+                logger.info(f"[{req_id}] (WaitV4) 客户端断开连接，中止等待。")
+                return False
+        result = watch_task.result()
+    except Exception as e:
+        elapsed_ms = (time.time() - start_time) * 1000
+        logger.warning(f"[{req_id}] (WaitV4) 页面内完成检测失败，回退到轮询: {e}")
+        return await _poll_for_response_completion(
+            page, prompt_textarea_locator, submit_button_locator, edit_button_locator, req_id,
+            check_client_disconnected_func, current_chat_id,
+            timeout_ms=max(0, timeout_ms - elapsed_ms), initial_wait_ms=0
+        )
+    finally:
+        if not watch_task.done():
+            watch_task.cancel()
+
+    COMPLETION_DETECTIONS_TOTAL.inc(method=result)
+    if result == 'observer':
+        logger.info(f"[{req_id}] (WaitV4) ✅ 响应完成: 输入框空，提交按钮禁用，编辑按钮可见 ({time.time() - start_time:.2f}s)。")
+        return True
+    if result == 'observer_heuristic':
+        logger.warning(f"[{req_id}] (WaitV4) 响应可能已完成 (启发式): 输入框空，提交按钮禁用，但编辑按钮仍未出现。假定完成。后续若内容获取失败，可能与此有关。")
+        return True
+    logger.error(f"[{req_id}] (WaitV4) 等待响应完成超时 ({timeout_ms}ms)。")
+    await save_error_snapshot(f"wait_completion_v4_overall_timeout_{req_id}")
+    return False
+
+
+async def _poll_for_response_completion(
+    page: AsyncPage,
+    prompt_textarea_locator: Locator,
+    submit_button_locator: Locator,
+    edit_button_locator: Locator,
+    req_id: str,
+    check_client_disconnected_func: Callable,
+    current_chat_id: Optional[str],
+    timeout_ms=RESPONSE_COMPLETION_TIMEOUT,
+    initial_wait_ms=INITIAL_WAIT_MS_BEFORE_POLLING
+) -> bool:
+    """轮询等待响应完成（页面内完成检测不可用时的回退）"""
     from playwright.async_api import TimeoutError
     
     logger.info(f"[{req_id}] (WaitV3) 开始等待响应完成... (超时: {timeout_ms}ms)")
@@ -700,6 +816,7 @@ async def _wait_for_response_completion(
         current_time_elapsed_ms = (time.time() - start_time) * 1000
         if current_time_elapsed_ms > timeout_ms:
             logger.error(f"[{req_id}] (WaitV3) 等待响应完成超时 ({timeout_ms}ms)。")
+            COMPLETION_DETECTIONS_TOTAL.inc(method="timeout")
             await save_error_snapshot(f"wait_completion_v3_overall_timeout_{req_id}")
             return False
 
@@ -730,6 +847,7 @@ async def _wait_for_response_completion(
             try:
                 if await edit_button_locator.is_visible(timeout=wait_timeout_ms_short):
                     logger.info(f"[{req_id}] (WaitV3) ✅ 响应完成: 输入框空，提交按钮禁用，编辑按钮可见。")
+                    COMPLETION_DETECTIONS_TOTAL.inc(method="poll")
                     return True # 明确完成
             except TimeoutError:
                 if DEBUG_LOGS_ENABLED:
@@ -743,6 +861,7 @@ async def _wait_for_response_completion(
             # 启发式完成: 如果主要条件持续满足，但编辑按钮仍未出现
             if consecutive_empty_input_submit_disabled_count >= 3: # 例如，大约 1.5秒 (3 * 0.5秒轮询)
                 logger.warning(f"[{req_id}] (WaitV3) 响应可能已完成 (启发式): 输入框空，提交按钮禁用，但在 {consecutive_empty_input_submit_disabled_count} 次检查后编辑按钮仍未出现。假定完成。后续若内容获取失败，可能与此有关。")
+                COMPLETION_DETECTIONS_TOTAL.inc(method="poll_heuristic")
                 return True # 启发式完成
         else: # 主要条件 (输入框空 & 提交按钮禁用) 未满足
             consecutive_empty_input_submit_disabled_count = 0 # 重置计数器
@@ -756,28 +875,137 @@ async def _wait_for_response_completion(
 
         await asyncio.sleep(0.5) # 轮询间隔
 
+# 一次 page.evaluate 读取最后一个模型回复：正文优先取组件状态中的 Markdown 原文
+# （仅开发模式下的 window.ng 可用），否则在正文没有任何 Markdown 格式元素时直接使用渲染文本；
+# 含格式的正文无法从渲染结果无损还原，text 返回 null，由编辑按钮/复制按钮方法读取原文
+_RESPONSE_EXTRACT_SCRIPT = r"""
+([containerSelector, textChunkSelector, thoughtChunkSelector, functionCallSelector]) => {
+    const containers = document.querySelectorAll(containerSelector);
+    const container = containers[containers.length - 1];
+    if (!container) return null;
+    const outside = (el, selector) => !el.parentElement || !el.parentElement.closest(selector);
+    const textChunks = Array.from(container.querySelectorAll(textChunkSelector))
+        .filter(el => outside(el, thoughtChunkSelector));
+
+    const componentText = el => {
+        const ng = window.ng;
+        if (!ng || typeof ng.getComponent !== 'function') return null;
+        const component = ng.getComponent(el);
+        for (const candidate of [component, component && component.chunk, component && component.turn]) {
+            if (!candidate) continue;
+            for (const key of ['text', 'markdown', 'content']) {
+                if (typeof candidate[key] === 'string') return candidate[key];
+            }
+        }
+        return null;
+    };
+    const FORMATTING = 'pre, code, table, ul, ol, h1, h2, h3, h4, h5, h6, strong, em, b, i, a, blockquote, hr, img, math, .katex';
+    // 渲染后的文字含这些字符时无法确定原文（可能是转义 \*、实体或字面量），不走 DOM 读取
+    const MARKDOWN_SIGNIFICANT = /[\\`*_~<>#\[\]|$&]|^\s*(\d+[.)]|[-+=])(\s|$)/m;
+    const plainText = el => !el.querySelector(FORMATTING) && !MARKDOWN_SIGNIFICANT.test(el.innerText);
+
+    let text = null;
+    let source = null;
+    if (textChunks.length) {
+        const fromState = textChunks.map(componentText);
+        if (fromState.every(value => value !== null)) {
+            text = fromState.join('\n');
+            source = 'angular';
+        } else if (textChunks.every(plainText)) {
+            text = textChunks.map(el => el.innerText).join('\n');
+            source = 'dom';
+        }
+    }
+
+    const reasoning = Array.from(container.querySelectorAll(thoughtChunkSelector))
+        .map(el => el.innerText.trim()).filter(Boolean).join('\n');
+
+    const toolCalls = [];
+    const invalidToolCalls = [];
+    for (const chunk of container.querySelectorAll(functionCallSelector)) {
+        const nameEl = chunk.querySelector('[class*="name"]');
+        const argsEl = chunk.querySelector('pre, code');
+        const name = nameEl ? nameEl.innerText.trim() : '';
+        try {
+            toolCalls.push({ name, params: argsEl ? JSON.parse(argsEl.innerText) : {} });
+        } catch (e) {
+            invalidToolCalls.push({ name, error: String(e) });
+        }
+    }
+    return { text, reasoning, tool_calls: toolCalls, invalid_tool_calls: invalidToolCalls, source };
+}
+"""
+
+
+async def extract_response_from_page(page: AsyncPage, req_id: str) -> Optional[Dict[str, Any]]:
+    """
+    一次 page.evaluate 读取最后一个模型回复的正文、思考内容和工具调用：
+    {"text", "reasoning", "tool_calls", "invalid_tool_calls", "source"}；正文无法无损读取时 text 为 None，
+    参数无法解析的工具调用不计入 tool_calls，而是列在 invalid_tool_calls 中
+    """
+    try:
+        result = await page.evaluate(
+            _RESPONSE_EXTRACT_SCRIPT,
+            [RESPONSE_CONTAINER_SELECTOR, TEXT_CHUNK_SELECTOR, THOUGHT_CHUNK_SELECTOR, FUNCTION_CALL_CHUNK_SELECTOR]
+        )
+    except Exception as e:
+        logger.warning(f"[{req_id}] (Helper Extract) 页面内读取回复失败: {e}")
+        return None
+    if not result:
+        logger.info(f"[{req_id}] (Helper Extract) 页面上没有模型回复。")
+    return result
+
+
+async def _get_final_response(
+    page: AsyncPage,
+    req_id: str,
+    check_client_disconnected: Callable
+) -> Optional[Dict[str, Any]]:
+    """获取最终响应：{"text", "reasoning", "tool_calls", "source"}；先一次性读取页面，正文读取不到时回退到编辑按钮和复制按钮"""
+    logger.info(f"[{req_id}] (Helper GetContent) 开始获取最终响应内容...")
+    extracted = await extract_response_from_page(page, req_id) or {}
+    details = {
+        "text": None,
+        "reasoning": extracted.get("reasoning") or "",
+        "tool_calls": extracted.get("tool_calls") or [],
+        "source": None,
+    }
+    for invalid_call in extracted.get("invalid_tool_calls") or []:
+        logger.warning(f"[{req_id}] (Helper GetContent) 跳过参数无法解析的工具调用 '{invalid_call.get('name')}': {invalid_call.get('error')}")
+    text = extracted.get("text")
+    if text is not None and text.strip():
+        details["text"], details["source"] = text.strip(), extracted.get("source")
+        logger.info(f"[{req_id}] (Helper GetContent) ✅ 页面内一次读取回复成功 ({details['source']})。")
+    else:
+        logger.info(f"[{req_id}] (Helper GetContent) 页面内无法无损读取正文，使用编辑按钮方法...")
+        response_content = await get_response_via_edit_button(
+            page, req_id, check_client_disconnected
+        )
+        if response_content is not None:
+            logger.info(f"[{req_id}] (Helper GetContent) ✅ 成功通过编辑按钮获取内容。")
+            details["text"], details["source"] = response_content, "edit_button"
+        else:
+            logger.warning(f"[{req_id}] (Helper GetContent) 编辑按钮方法失败或返回空，回退到复制按钮方法...")
+            response_content = await get_response_via_copy_button(
+                page, req_id, check_client_disconnected
+            )
+            if response_content is not None:
+                logger.info(f"[{req_id}] (Helper GetContent) ✅ 成功通过复制按钮获取内容。")
+                details["text"], details["source"] = response_content, "copy_button"
+
+    RESPONSE_EXTRACTIONS_TOTAL.inc(path=details["source"] or "failed")
+    if details["text"] is None:
+        logger.error(f"[{req_id}] (Helper GetContent) 所有获取响应内容的方法均失败。")
+        await save_error_snapshot(f"get_content_all_methods_failed_{req_id}")
+        return None
+    return details
+
+
 async def _get_final_response_content(
     page: AsyncPage,
     req_id: str,
     check_client_disconnected: Callable
 ) -> Optional[str]:
     """获取最终响应内容"""
-    logger.info(f"[{req_id}] (Helper GetContent) 开始获取最终响应内容...")
-    response_content = await get_response_via_edit_button(
-        page, req_id, check_client_disconnected
-    )
-    if response_content is not None:
-        logger.info(f"[{req_id}] (Helper GetContent) ✅ 成功通过编辑按钮获取内容。")
-        return response_content
-    
-    logger.warning(f"[{req_id}] (Helper GetContent) 编辑按钮方法失败或返回空，回退到复制按钮方法...")
-    response_content = await get_response_via_copy_button(
-        page, req_id, check_client_disconnected
-    )
-    if response_content is not None:
-        logger.info(f"[{req_id}] (Helper GetContent) ✅ 成功通过复制按钮获取内容。")
-        return response_content
-    
-    logger.error(f"[{req_id}] (Helper GetContent) 所有获取响应内容的方法均失败。")
-    await save_error_snapshot(f"get_content_all_methods_failed_{req_id}")
-    return None 
\ No newline at end of file
+    details = await _get_final_response(page, req_id, check_client_disconnected)
+    return details["text"] if details is not None else None
@@ -3,7 +3,8 @@ PageController模块
 封装了所有与Playwright页面直接交互的复杂逻辑。
 """
 import asyncio
-from typing import Callable, List, Dict, Any, Optional
+import re
+from typing import Callable, List, Dict, Any, Optional, Set
 
 from playwright.async_api import Page as AsyncPage, expect as expect_async, TimeoutError
 
@@ -19,11 +20,23 @@ from config import (
 from config import (
     CLICK_TIMEOUT_MS, WAIT_FOR_ELEMENT_TIMEOUT_MS, CLEAR_CHAT_VERIFY_TIMEOUT_MS,
     DEFAULT_TEMPERATURE, DEFAULT_MAX_OUTPUT_TOKENS, DEFAULT_STOP_SEQUENCES, DEFAULT_TOP_P,
-    ENABLE_URL_CONTEXT, ENABLE_THINKING_BUDGET, DEFAULT_THINKING_BUDGET, ENABLE_GOOGLE_SEARCH
+    ENABLE_URL_CONTEXT, ENABLE_THINKING_BUDGET, DEFAULT_THINKING_BUDGET, ENABLE_GOOGLE_SEARCH,
+    ENABLE_BATCH_PARAMETER_ADJUSTMENT
 )
 from models import ClientDisconnectedError
-from .operations import save_error_snapshot, _wait_for_response_completion, _get_final_response_content
+from logging_utils.stage_timing import (
+    stage_timer, record_stage, mark, record_since_mark, STAGE_FILL, STAGE_SUBMIT, STAGE_COMPLETION, MARK_SUBMITTED
+)
+from logging_utils.tracing import traced
+from .batch_parameters import (
+    PARAMETER_CONTROLS, READ_PARAMETERS_SCRIPT, APPLY_PARAMETERS_SCRIPT,
+    build_read_payload, build_apply_payload, values_match,
+    desired_parameter_state, build_generation_config, clamp_max_tokens, parse_thinking_budget,
+    should_enable_google_search, normalize_stop_sequences
+)
+from .operations import save_error_snapshot, _wait_for_response_completion, _get_final_response
 from .initialization import enable_temporary_chat_mode
+from .stream_tagging import set_page_generation_config, get_verified_rewrite_fields
 
 class PageController:
     """封装了与AI Studio页面交互的所有操作。"""
@@ -38,30 +51,125 @@ class PageController:
         if check_client_disconnected(stage):
             raise ClientDisconnectedError(f"[{self.req_id}] Client disconnected at stage: {stage}")
 
-    async def adjust_parameters(self, request_params: Dict[str, Any], page_params_cache: Dict[str, Any], params_cache_lock: asyncio.Lock, model_id_to_use: str, parsed_model_list: List[Dict[str, Any]], check_client_disconnected: Callable):
-        """调整所有请求参数。"""
+    @traced("PageController.adjust_parameters")
+    async def adjust_parameters(self, request_params: Dict[str, Any], page_params_cache: Dict[str, Any], params_cache_lock: asyncio.Lock, model_id_to_use: str, parsed_model_list: List[Dict[str, Any]], check_client_disconnected: Callable, network_rewrite: bool = False):
+        """
+        调整所有请求参数。
+        network_rewrite 为 True 时（请求经过流式代理），生成参数同时交给代理写入 GenerateContent 请求体，
+        代理已确认能改写的参数跳过页面调整。
+        """
         self.logger.info(f"[{self.req_id}] 开始调整所有请求参数...")
         await self._check_disconnect(check_client_disconnected, "Start Parameter Adjustment")
 
+        desired = desired_parameter_state(request_params, model_id_to_use, parsed_model_list, self.logger, self.req_id)
+        skipped_fields: Set[str] = set()
+        if network_rewrite:
+            skipped_fields = self._register_generation_config(desired, request_params)
+
+        if ENABLE_BATCH_PARAMETER_ADJUSTMENT:
+            try:
+                await self._adjust_parameters_batched(desired, skipped_fields, request_params, page_params_cache, params_cache_lock, model_id_to_use, parsed_model_list, check_client_disconnected)
+                return
+            except ClientDisconnectedError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"[{self.req_id}] 批量参数调整失败，回退到逐项调整: {e}")
+
+        await self._adjust_parameters_sequential(skipped_fields, request_params, page_params_cache, params_cache_lock, model_id_to_use, parsed_model_list, check_client_disconnected)
+
+    def _register_generation_config(self, desired: Dict[str, Any], request_params: Dict[str, Any]) -> Set[str]:
+        """登记由流式代理写入请求体的生成参数，返回可跳过页面调整的字段。"""
+        generation_config = build_generation_config(desired, request_params)
+        set_page_generation_config(self.page, generation_config)
+
+        skipped_fields = get_verified_rewrite_fields() & set(generation_config)
+        if skipped_fields:
+            self.logger.info(f"[{self.req_id}] 生成参数 {sorted(skipped_fields)} 将由流式代理写入请求，跳过页面调整。")
+        return skipped_fields
+
+    @traced("PageController._adjust_parameters_batched")
+    async def _adjust_parameters_batched(self, desired: Dict[str, Any], skipped_fields: Set[str], request_params: Dict[str, Any], page_params_cache: Dict[str, Any], params_cache_lock: asyncio.Lock, model_id_to_use: str, parsed_model_list: List[Dict[str, Any]], check_client_disconnected: Callable):
+        """一次页面脚本读取全部控件，再一次脚本写入不一致的控件；写入失败的控件走逐项调整。"""
+        desired = {key: value for key, value in desired.items() if key not in skipped_fields}
+
+        current = await self.page.evaluate(READ_PARAMETERS_SCRIPT, build_read_payload(list(desired.keys())))
+        await self._check_disconnect(check_client_disconnected, "批量参数调整 - 读取后")
+
+        to_apply = {key: value for key, value in desired.items() if not values_match(key, current.get(key), value)}
+        failed: List[str] = []
+        if to_apply:
+            self.logger.info(f"[{self.req_id}] 批量写入与请求不一致的参数: {to_apply}")
+            results = await self.page.evaluate(APPLY_PARAMETERS_SCRIPT, build_apply_payload(to_apply))
+            await self._check_disconnect(check_client_disconnected, "批量参数调整 - 写入后")
+            failed = [key for key in to_apply if not (results.get(key) or {}).get("ok")]
+            if failed:
+                self.logger.warning(f"[{self.req_id}] ⚠️ 批量写入后验证失败的参数: { {key: results.get(key) for key in failed} }")
+
+        async with params_cache_lock:
+            for key in ("temperature", "max_output_tokens"):
+                if key not in desired:
+                    continue
+                if key in failed:
+                    page_params_cache.pop(key, None)
+                else:
+                    page_params_cache[key] = desired[key]
+
+        self.logger.info(f"[{self.req_id}] 批量参数调整: 读取 {len(desired)} 项，写入 {len(to_apply)} 项，回退逐项调整 {len(failed)} 项。")
+
+        # 停止序列需要逐个增删 chip，仍使用基于缓存的逐项调整
+        if "stop_sequences" not in skipped_fields:
+            stop_to_set = request_params.get('stop', DEFAULT_STOP_SEQUENCES)
+            await self._adjust_stop_sequences(stop_to_set, page_params_cache, params_cache_lock, check_client_disconnected)
+            await self._check_disconnect(check_client_disconnected, "After Stop Sequences Adjustment")
+
+        if failed:
+            await self._adjust_failed_parameters(failed, desired, request_params, page_params_cache, params_cache_lock, model_id_to_use, parsed_model_list, check_client_disconnected)
+
+    @traced("PageController._adjust_failed_parameters")
+    async def _adjust_failed_parameters(self, failed: List[str], desired: Dict[str, Any], request_params: Dict[str, Any], page_params_cache: Dict[str, Any], params_cache_lock: asyncio.Lock, model_id_to_use: str, parsed_model_list: List[Dict[str, Any]], check_client_disconnected: Callable):
+        """对批量写入失败的控件执行原有的逐项调整。"""
+        if "temperature" in failed:
+            await self._adjust_temperature(desired["temperature"], page_params_cache, params_cache_lock, check_client_disconnected)
+        if "max_output_tokens" in failed:
+            await self._adjust_max_tokens(desired["max_output_tokens"], page_params_cache, params_cache_lock, model_id_to_use, parsed_model_list, check_client_disconnected)
+        if "top_p" in failed:
+            await self._adjust_top_p(desired["top_p"], check_client_disconnected)
+
+        if any(PARAMETER_CONTROLS[key]["in_tools_panel"] for key in failed):
+            await self._ensure_tools_panel_expanded(check_client_disconnected)
+        if "url_context" in failed:
+            await self._open_url_content(check_client_disconnected)
+        if "thinking_budget_enabled" in failed or "thinking_budget" in failed:
+            await self._handle_thinking_budget(request_params, check_client_disconnected)
+        if "google_search" in failed:
+            await self._adjust_google_search(request_params, check_client_disconnected)
+
+    @traced("PageController._adjust_parameters_sequential")
+    async def _adjust_parameters_sequential(self, skipped_fields: Set[str], request_params: Dict[str, Any], page_params_cache: Dict[str, Any], params_cache_lock: asyncio.Lock, model_id_to_use: str, parsed_model_list: List[Dict[str, Any]], check_client_disconnected: Callable):
+        """逐项调整所有请求参数（批量调整的回退路径）。"""
         # 调整温度
-        temp_to_set = request_params.get('temperature', DEFAULT_TEMPERATURE)
-        await self._adjust_temperature(temp_to_set, page_params_cache, params_cache_lock, check_client_disconnected)
-        await self._check_disconnect(check_client_disconnected, "After Temperature Adjustment")
+        if "temperature" not in skipped_fields:
+            temp_to_set = request_params.get('temperature', DEFAULT_TEMPERATURE)
+            await self._adjust_temperature(temp_to_set, page_params_cache, params_cache_lock, check_client_disconnected)
+            await self._check_disconnect(check_client_disconnected, "After Temperature Adjustment")
 
         # 调整最大Token
-        max_tokens_to_set = request_params.get('max_output_tokens', DEFAULT_MAX_OUTPUT_TOKENS)
-        await self._adjust_max_tokens(max_tokens_to_set, page_params_cache, params_cache_lock, model_id_to_use, parsed_model_list, check_client_disconnected)
-        await self._check_disconnect(check_client_disconnected, "After Max Tokens Adjustment")
+        if "max_output_tokens" not in skipped_fields:
+            max_tokens_to_set = request_params.get('max_output_tokens', DEFAULT_MAX_OUTPUT_TOKENS)
+            await self._adjust_max_tokens(max_tokens_to_set, page_params_cache, params_cache_lock, model_id_to_use, parsed_model_list, check_client_disconnected)
+            await self._check_disconnect(check_client_disconnected, "After Max Tokens Adjustment")
 
         # 调整停止序列
-        stop_to_set = request_params.get('stop', DEFAULT_STOP_SEQUENCES)
-        await self._adjust_stop_sequences(stop_to_set, page_params_cache, params_cache_lock, check_client_disconnected)
-        await self._check_disconnect(check_client_disconnected, "After Stop Sequences Adjustment")
+        if "stop_sequences" not in skipped_fields:
+            stop_to_set = request_params.get('stop', DEFAULT_STOP_SEQUENCES)
+            await self._adjust_stop_sequences(stop_to_set, page_params_cache, params_cache_lock, check_client_disconnected)
+            await self._check_disconnect(check_client_disconnected, "After Stop Sequences Adjustment")
 
         # 调整Top P
-        top_p_to_set = request_params.get('top_p', DEFAULT_TOP_P)
-        await self._adjust_top_p(top_p_to_set, check_client_disconnected)
-        await self._check_disconnect(check_client_disconnected, "End Parameter Adjustment")
+        if "top_p" not in skipped_fields:
+            top_p_to_set = request_params.get('top_p', DEFAULT_TOP_P)
+            await self._adjust_top_p(top_p_to_set, check_client_disconnected)
+            await self._check_disconnect(check_client_disconnected, "End Parameter Adjustment")
 
         # 确保工具面板已展开，以便调整高级设置
         await self._ensure_tools_panel_expanded(check_client_disconnected)
@@ -78,6 +186,7 @@ class PageController:
         # 调整 Google Search 开关
         await self._adjust_google_search(request_params, check_client_disconnected)
 
+    @traced("PageController._handle_thinking_budget")
     async def _handle_thinking_budget(self, request_params: Dict[str, Any], check_client_disconnected: Callable):
         """处理思考预算的调整逻辑。"""
         reasoning_effort = request_params.get('reasoning_effort')
@@ -103,34 +212,9 @@ class PageController:
 
     def _parse_thinking_budget(self, reasoning_effort: Optional[Any]) -> Optional[int]:
         """从 reasoning_effort 解析出 token_budget。"""
-        token_budget = None
-        if reasoning_effort is None:
-            token_budget = DEFAULT_THINKING_BUDGET
-            self.logger.info(f"[{self.req_id}] 'reasoning_effort' 为空，使用默认思考预算: {token_budget}")
-        elif isinstance(reasoning_effort, int):
-            token_budget = reasoning_effort
-        elif isinstance(reasoning_effort, str):
-            if reasoning_effort.lower() == 'none':
-                token_budget = DEFAULT_THINKING_BUDGET
-                self.logger.info(f"[{self.req_id}] 'reasoning_effort' 为 'none' 字符串，使用默认思考预算: {token_budget}")
-            else:
-                effort_map = {
-                    "low": 1000,
-                    "medium": 8000,
-                    "high": 24000
-                }
-                token_budget = effort_map.get(reasoning_effort.lower())
-                if token_budget is None:
-                    try:
-                        token_budget = int(reasoning_effort)
-                    except (ValueError, TypeError):
-                        pass # token_budget remains None
-        
-        if token_budget is None:
-             self.logger.warning(f"[{self.req_id}] 无法从 '{reasoning_effort}' (类型: {type(reasoning_effort)}) 解析出有效的 token_budget。")
-
-        return token_budget
+        return parse_thinking_budget(reasoning_effort, self.logger, self.req_id)
 
+    @traced("PageController._adjust_thinking_budget")
     async def _adjust_thinking_budget(self, reasoning_effort: Optional[Any], check_client_disconnected: Callable):
         """根据 reasoning_effort 调整思考预算。"""
         self.logger.info(f"[{self.req_id}] 检查并调整思考预算，输入值: {reasoning_effort}")
@@ -166,24 +250,9 @@ class PageController:
 
     def _should_enable_google_search(self, request_params: Dict[str, Any]) -> bool:
         """根据请求参数或默认配置决定是否应启用 Google Search。"""
-        if 'tools' in request_params and request_params.get('tools') is not None:
-            tools = request_params.get('tools')
-            has_google_search_tool = False
-            if isinstance(tools, list):
-                for tool in tools:
-                    if isinstance(tool, dict):
-                        if tool.get('google_search_retrieval') is not None:
-                            has_google_search_tool = True
-                            break
-                        if tool.get('function', {}).get('name') == 'googleSearch':
-                            has_google_search_tool = True
-                            break
-            self.logger.info(f"[{self.req_id}] 请求中包含 'tools' 参数。检测到 Google Search 工具: {has_google_search_tool}。")
-            return has_google_search_tool
-        else:
-            self.logger.info(f"[{self.req_id}] 请求中不包含 'tools' 参数。使用默认配置 ENABLE_GOOGLE_SEARCH: {ENABLE_GOOGLE_SEARCH}。")
-            return ENABLE_GOOGLE_SEARCH
+        return should_enable_google_search(request_params, self.logger, self.req_id)
 
+    @traced("PageController._adjust_google_search")
     async def _adjust_google_search(self, request_params: Dict[str, Any], check_client_disconnected: Callable):
         """根据请求参数或默认配置，双向控制 Google Search 开关。"""
         self.logger.info(f"[{self.req_id}] 检查并调整 Google Search 开关...")
@@ -220,6 +289,7 @@ class PageController:
             if isinstance(e, ClientDisconnectedError):
                  raise
 
+    @traced("PageController._ensure_tools_panel_expanded")
     async def _ensure_tools_panel_expanded(self, check_client_disconnected: Callable):
         """确保包含高级工具（URL上下文、思考预算等）的面板是展开的。"""
         self.logger.info(f"[{self.req_id}] 检查并确保工具面板已展开...")
@@ -245,6 +315,7 @@ class PageController:
             if isinstance(e, ClientDisconnectedError):
                 raise
 
+    @traced("PageController._open_url_content")
     async def _open_url_content(self,check_client_disconnected: Callable):
         """仅负责打开 URL Context 开关，前提是面板已展开。"""
         try:
@@ -265,6 +336,7 @@ class PageController:
             if isinstance(e, ClientDisconnectedError):
                 raise
 
+    @traced("PageController._control_thinking_budget_toggle")
     async def _control_thinking_budget_toggle(self, should_be_checked: bool, check_client_disconnected: Callable):
         """
         根据 should_be_checked 的值，控制 "Thinking Budget" 滑块开关的状态。
@@ -302,6 +374,7 @@ class PageController:
             self.logger.error(f"[{self.req_id}] ❌ 操作 'Thinking Budget toggle' 开关时发生错误: {e}")
             if isinstance(e, ClientDisconnectedError):
                 raise
+    @traced("PageController._adjust_temperature")
     async def _adjust_temperature(self, temperature: float, page_params_cache: dict, params_cache_lock: asyncio.Lock, check_client_disconnected: Callable):
         """调整温度参数。"""
         async with params_cache_lock:
@@ -360,28 +433,12 @@ class PageController:
                 if isinstance(pw_err, ClientDisconnectedError):
                     raise
 
+    @traced("PageController._adjust_max_tokens")
     async def _adjust_max_tokens(self, max_tokens: int, page_params_cache: dict, params_cache_lock: asyncio.Lock, model_id_to_use: str, parsed_model_list: list, check_client_disconnected: Callable):
         """调整最大输出Token参数。"""
         async with params_cache_lock:
             self.logger.info(f"[{self.req_id}] 检查并调整最大输出 Token 设置...")
-            min_val_for_tokens = 1
-            max_val_for_tokens_from_model = 65536
-
-            if model_id_to_use and parsed_model_list:
-                current_model_data = next((m for m in parsed_model_list if m.get("id") == model_id_to_use), None)
-                if current_model_data and current_model_data.get("supported_max_output_tokens") is not None:
-                    try:
-                        supported_tokens = int(current_model_data["supported_max_output_tokens"])
-                        if supported_tokens > 0:
-                            max_val_for_tokens_from_model = supported_tokens
-                        else:
-                            self.logger.warning(f"[{self.req_id}] 模型 {model_id_to_use} supported_max_output_tokens 无效: {supported_tokens}")
-                    except (ValueError, TypeError):
-                        self.logger.warning(f"[{self.req_id}] 模型 {model_id_to_use} supported_max_output_tokens 解析失败")
-
-            clamped_max_tokens = max(min_val_for_tokens, min(max_val_for_tokens_from_model, max_tokens))
-            if clamped_max_tokens != max_tokens:
-                self.logger.warning(f"[{self.req_id}] 请求的最大输出 Tokens {max_tokens} 超出模型范围，已调整为 {clamped_max_tokens}")
+            clamped_max_tokens = clamp_max_tokens(max_tokens, model_id_to_use, parsed_model_list, self.logger, self.req_id)
 
             cached_max_tokens = page_params_cache.get("max_output_tokens")
             if cached_max_tokens is not None and cached_max_tokens == clamped_max_tokens:
@@ -428,23 +485,13 @@ class PageController:
                 if isinstance(e, ClientDisconnectedError):
                     raise
     
+    @traced("PageController._adjust_stop_sequences")
     async def _adjust_stop_sequences(self, stop_sequences, page_params_cache: dict, params_cache_lock: asyncio.Lock, check_client_disconnected: Callable):
         """调整停止序列参数。"""
         async with params_cache_lock:
             self.logger.info(f"[{self.req_id}] 检查并设置停止序列...")
 
-            # 处理不同类型的stop_sequences输入
-            normalized_requested_stops = set()
-            if stop_sequences is not None:
-                if isinstance(stop_sequences, str):
-                    # 单个字符串
-                    if stop_sequences.strip():
-                        normalized_requested_stops.add(stop_sequences.strip())
-                elif isinstance(stop_sequences, list):
-                    # 字符串列表
-                    for s in stop_sequences:
-                        if isinstance(s, str) and s.strip():
-                            normalized_requested_stops.add(s.strip())
+            normalized_requested_stops = normalize_stop_sequences(stop_sequences)
 
             cached_stops_set = page_params_cache.get("stop_sequences")
 
@@ -488,6 +535,7 @@ class PageController:
                 if isinstance(e, ClientDisconnectedError):
                     raise
 
+    @traced("PageController._adjust_top_p")
     async def _adjust_top_p(self, top_p: float, check_client_disconnected: Callable):
         """调整Top P参数。"""
         self.logger.info(f"[{self.req_id}] 检查并调整 Top P 设置...")
@@ -531,6 +579,7 @@ class PageController:
             if isinstance(e, ClientDisconnectedError):
                 raise
 
+    @traced("PageController.clear_chat_history")
     async def clear_chat_history(self, check_client_disconnected: Callable):
         """清空聊天记录。"""
         self.logger.info(f"[{self.req_id}] 开始清空聊天记录...")
@@ -582,6 +631,7 @@ class PageController:
                 await save_error_snapshot(f"clear_chat_error_{self.req_id}")
             raise
 
+    @traced("PageController._execute_chat_clear")
     async def _execute_chat_clear(self, clear_chat_button_locator, confirm_button_locator, overlay_locator, check_client_disconnected: Callable):
         """执行清空聊天操作"""
         overlay_initially_visible = False
@@ -655,6 +705,7 @@ class PageController:
 
             await self._check_disconnect(check_client_disconnected, f"清空聊天 - 消失检查尝试 {attempt_disappear + 1} 后")
 
+    @traced("PageController._verify_chat_cleared")
     async def _verify_chat_cleared(self, check_client_disconnected: Callable):
         """验证聊天已清空"""
         last_response_container = self.page.locator(RESPONSE_CONTAINER_SELECTOR).last
@@ -666,6 +717,7 @@ class PageController:
         except Exception as verify_err:
             self.logger.warning(f"[{self.req_id}] ⚠️ 警告: 清空聊天验证失败 (最后响应容器未隐藏): {verify_err}")
     
+    @traced("PageController.submit_prompt")
     async def submit_prompt(self, prompt: str,image_list: List, check_client_disconnected: Callable):
         """提交提示到页面。"""
         self.logger.info(f"[{self.req_id}] 填充并提交提示 ({len(prompt)} chars)...")
@@ -678,17 +730,18 @@ class PageController:
             await self._check_disconnect(check_client_disconnected, "After Input Visible")
 
             # 使用 JavaScript 填充文本
-            await prompt_textarea_locator.evaluate(
-                '''
-                (element, text) => {
-                    element.value = text;
-                    element.dispatchEvent(new Event('input', { bubbles: true, cancelable: true }));
-                    element.dispatchEvent(new Event('change', { bubbles: true, cancelable: true }));
-                }
-                ''',
-                prompt
-            )
-            await autosize_wrapper_locator.evaluate('(element, text) => { element.setAttribute("data-value", text); }', prompt)
+            with stage_timer(self.req_id, STAGE_FILL):
+                await prompt_textarea_locator.evaluate(
+                    '''
+                    (element, text) => {
+                        element.value = text;
+                        element.dispatchEvent(new Event('input', { bubbles: true, cancelable: true }));
+                        element.dispatchEvent(new Event('change', { bubbles: true, cancelable: true }));
+                    }
+                    ''',
+                    prompt
+                )
+                await autosize_wrapper_locator.evaluate('(element, text) => { element.setAttribute("data-value", text); }', prompt)
             await self._check_disconnect(check_client_disconnected, "After Input Fill")
 
             # 上传
@@ -723,6 +776,7 @@ class PageController:
                     print(f"在上传文件时发生错误: {e}")
 
             # 等待发送按钮启用
+            submit_started_at = asyncio.get_running_loop().time()
             wait_timeout_ms_submit_enabled = 100000
             try:
                 await self._check_disconnect(check_client_disconnected, "填充提示后等待发送按钮启用 - 前置检查")
@@ -750,6 +804,8 @@ class PageController:
                     await save_error_snapshot(f"submit_button_click_fail_{self.req_id}")
                     raise
 
+            record_stage(self.req_id, STAGE_SUBMIT, asyncio.get_running_loop().time() - submit_started_at)
+            mark(self.req_id, MARK_SUBMITTED)
             await self._check_disconnect(check_client_disconnected, "After Submit")
 
         except Exception as e_input_submit:
@@ -758,6 +814,7 @@ class PageController:
                 await save_error_snapshot(f"input_submit_error_{self.req_id}")
             raise
 
+    @traced("PageController._try_shortcut_submit")
     async def _try_shortcut_submit(self, prompt_textarea_locator, check_client_disconnected: Callable) -> bool:
         """尝试使用快捷键提交"""
         import os
@@ -867,8 +924,14 @@ class PageController:
             self.logger.warning(f"[{self.req_id}] 快捷键提交失败: {shortcut_err}")
             return False
 
+    @traced("PageController.get_response")
     async def get_response(self, check_client_disconnected: Callable) -> str:
         """获取响应内容。"""
+        return (await self.get_response_details(check_client_disconnected))["text"]
+
+    @traced("PageController.get_response_details")
+    async def get_response_details(self, check_client_disconnected: Callable) -> Dict[str, Any]:
+        """获取响应的正文 (text)、思考内容 (reasoning) 和工具调用 (tool_calls)。"""
         self.logger.info(f"[{self.req_id}] 等待并获取响应...")
 
         try:
@@ -894,18 +957,23 @@ class PageController:
                 self.logger.warning(f"[{self.req_id}] 响应完成检测失败，尝试获取当前内容")
             else:
                 self.logger.info(f"[{self.req_id}] ✅ 响应完成检测成功")
+                record_since_mark(self.req_id, MARK_SUBMITTED, STAGE_COMPLETION)
 
             # 获取最终响应内容
-            final_content = await _get_final_response_content(self.page, self.req_id, check_client_disconnected)
+            details = await _get_final_response(self.page, self.req_id, check_client_disconnected)
+            if details is None:
+                details = {"text": None, "reasoning": "", "tool_calls": [], "source": None}
+            final_content = details["text"]
 
             if not final_content or not final_content.strip():
                 self.logger.warning(f"[{self.req_id}] ⚠️ 获取到的响应内容为空")
                 await save_error_snapshot(f"empty_response_{self.req_id}")
                 # 不抛出异常，返回空内容让上层处理
-                return ""
+                details["text"] = ""
+                return details
 
-            self.logger.info(f"[{self.req_id}] ✅ 成功获取响应内容 ({len(final_content)} chars)")
-            return final_content
+            self.logger.info(f"[{self.req_id}] ✅ 成功获取响应内容 ({len(final_content)} chars, {details['source']})")
+            return details
 
         except Exception as e:
             self.logger.error(f"[{self.req_id}] ❌ 获取响应时出错: {e}")
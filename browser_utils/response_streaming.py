@@ -0,0 +1,170 @@
+# --- browser_utils/response_streaming.py ---
+# 页面内实时流式输出：在未启用辅助流 (STREAM_PORT=0) 时，通过 MutationObserver 监听
+# 最后一个模型回复的 DOM 变化，经 expose_binding 把文本增量推送到 Python 侧
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from playwright.async_api import Page as AsyncPage
+
+from config import RESPONSE_CONTAINER_SELECTOR, RESPONSE_TEXT_SELECTOR
+
+logger = logging.getLogger("AIStudioProxyServer")
+
+LIVE_STREAM_BINDING_NAME = "__aiStudioProxyLiveDelta"
+
+# 已注册绑定的浏览器上下文，以及页面 -> 正在接收增量的流
+_bound_contexts: Set[Any] = set()
+_active_streams: Dict[AsyncPage, "LiveResponseStream"] = {}
+
+_OBSERVER_SCRIPT = """
+([bindingName, containerSelector, textSelector, skipResponses]) => {
+    if (window.__aiStudioProxyObserver) {
+        window.__aiStudioProxyObserver.disconnect();
+    }
+    let lastText = '';
+    let scheduled = false;
+    const readText = () => {
+        const containers = document.querySelectorAll(containerSelector);
+        if (containers.length <= skipResponses) return null;
+        const container = containers[containers.length - 1];
+        const nodes = container.querySelectorAll(textSelector);
+        if (!nodes.length) return null;
+        return Array.from(nodes).map(node => node.innerText).join('\\n');
+    };
+    const flush = () => {
+        scheduled = false;
+        const text = readText();
+        if (text === null || text === lastText) return;
+        if (text.startsWith(lastText)) {
+            window[bindingName]({ delta: text.slice(lastText.length) });
+        } else {
+            window[bindingName]({ reset: true, text: text });
+        }
+        lastText = text;
+    };
+    const observer = new MutationObserver(() => {
+        if (!scheduled) {
+            scheduled = true;
+            setTimeout(flush, 30);
+        }
+    });
+    observer.observe(document.body, { subtree: true, childList: true, characterData: true });
+    window.__aiStudioProxyObserver = observer;
+    flush();
+    return true;
+}
+"""
+
+_DISCONNECT_SCRIPT = """
+() => {
+    if (window.__aiStudioProxyObserver) {
+        window.__aiStudioProxyObserver.disconnect();
+        window.__aiStudioProxyObserver = null;
+    }
+}
+"""
+
+
+def _on_live_delta(source: Dict[str, Any], payload: Dict[str, Any]) -> None:
+    stream = _active_streams.get(source.get("page"))
+    if stream is not None:
+        stream._updates.put_nowait(payload)
+
+
+async def _ensure_binding(page: AsyncPage) -> None:
+    context = page.context
+    if context in _bound_contexts:
+        return
+    await context.expose_binding(LIVE_STREAM_BINDING_NAME, _on_live_delta)
+    _bound_contexts.add(context)
+
+
+class LiveResponseStream:
+    """
+    单个请求的页面实时输出流
+
+    页面侧推送的是渲染后的文本；只在其为已发送内容的延续时才向客户端输出增量。
+    生成结束后用 get_response 取得的最终 Markdown 补齐尚未发送的尾部。
+    """
+
+    def __init__(self, page: AsyncPage, req_id: str, skip_responses: int = 0):
+        self.page = page
+        self.req_id = req_id
+        # 页面上已有的回复数（延续对话时忽略之前轮次的回复）
+        self.skip_responses = skip_responses
+        self._updates: asyncio.Queue = asyncio.Queue()
+        self._page_text = ""
+        self.sent_text = ""
+        self.diverged = False
+
+    async def start(self) -> bool:
+        """注册绑定并在页面中安装观察器，失败时返回 False（调用方回退到伪流式）"""
+        try:
+            await _ensure_binding(self.page)
+            _active_streams[self.page] = self
+            await self.page.evaluate(
+                _OBSERVER_SCRIPT,
+                [LIVE_STREAM_BINDING_NAME, RESPONSE_CONTAINER_SELECTOR, RESPONSE_TEXT_SELECTOR, self.skip_responses]
+            )
+            logger.info(f"[{self.req_id}] 已在页面中启动实时输出监听。")
+            return True
+        except Exception as e:
+            logger.warning(f"[{self.req_id}] 启动页面实时输出监听失败，回退到伪流式输出: {e}")
+            await self.stop()
+            return False
+
+    async def stop(self) -> None:
+        if _active_streams.get(self.page) is self:
+            del _active_streams[self.page]
+        try:
+            if not self.page.is_closed():
+                await self.page.evaluate(_DISCONNECT_SCRIPT)
+        except Exception as e:
+            logger.debug(f"[{self.req_id}] 停止页面实时输出监听时出错: {e}")
+
+    def _apply(self, payload: Dict[str, Any]) -> str:
+        """应用页面推送的更新，返回可以发送给客户端的新增文本"""
+        if payload.get("reset"):
+            self._page_text = payload.get("text") or ""
+        else:
+            self._page_text += payload.get("delta") or ""
+
+        if self.diverged:
+            return ""
+        if not self._page_text.startswith(self.sent_text):
+            # 页面重新渲染了已发送的部分（如 Markdown 结构调整），之后只在结束时补齐
+            self.diverged = True
+            logger.info(f"[{self.req_id}] 页面文本与已发送内容不再一致，停止实时增量输出。")
+            return ""
+        delta = self._page_text[len(self.sent_text):]
+        self.sent_text = self._page_text
+        return delta
+
+    async def deltas(self, completion_task: asyncio.Task):
+        """在 completion_task 完成前持续产出文本增量，完成后产出剩余的已推送更新"""
+        while True:
+            if completion_task.done():
+                while not self._updates.empty():
+                    delta = self._apply(self._updates.get_nowait())
+                    if delta:
+                        yield delta
+                return
+            update_task = asyncio.ensure_future(self._updates.get())
+            done, _ = await asyncio.wait({update_task, completion_task}, return_when=asyncio.FIRST_COMPLETED)
+            if update_task in done:
+                delta = self._apply(update_task.result())
+                if delta:
+                    yield delta
+            else:
+                update_task.cancel()
+
+    def remaining_text(self, final_content: str) -> str:
+        """最终内容中尚未发送的部分；渲染文本与 Markdown 不一致时无法补齐则返回空串"""
+        if final_content.startswith(self.sent_text):
+            return final_content[len(self.sent_text):]
+        if self.sent_text:
+            logger.info(f"[{self.req_id}] 最终 Markdown 与实时输出的渲染文本不一致，已发送 {len(self.sent_text)} 字符，不再补发。")
+            return ""
+        return final_content
@@ -0,0 +1,149 @@
+# --- browser_utils/stream_tagging.py ---
+# 辅助流请求关联：为页面发出的 GenerateContent 请求附加请求ID头，
+# 流式代理据此给拦截到的响应打上 req_id，API 侧按请求分发数据帧；
+# 同时附加生成参数头，由流式代理直接改写请求体中的生成配置；
+# 启用追踪时附加 traceparent 头，代理据此把自己的 span 回报到同一条追踪
+
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Set
+
+from playwright.async_api import BrowserContext as AsyncBrowserContext, Page as AsyncPage
+
+from stream.interceptors import CORRELATION_HEADER, GENERATION_CONFIG_HEADER, TRACE_HEADER
+from logging_utils.metrics import ROUTE_HANDLER_SECONDS
+
+logger = logging.getLogger("AIStudioProxyServer")
+
+# 页面 -> 当前正在该页面上生成的请求ID
+_page_request_ids: Dict[AsyncPage, str] = {}
+# 页面 -> 当前请求的追踪上下文（W3C traceparent）
+_page_trace_contexts: Dict[AsyncPage, str] = {}
+# 页面 -> 当前请求需由代理写入的生成参数
+_page_generation_configs: Dict[AsyncPage, Dict[str, Any]] = {}
+# 页面 -> 当前请求提交的占位提示，代理据此把请求体中的对话内容替换为完整内容
+_page_prompt_placeholders: Dict[AsyncPage, str] = {}
+# 代理已确认能够改写的生成参数字段；确认前及改写失败后这些参数仍通过页面 UI 调整
+_verified_rewrite_fields: Set[str] = set()
+# 最近一次页面发出的 GenerateContent 请求（URL、请求头、请求体），供直连引擎作为模板
+_generate_content_template: Optional[Dict[str, Any]] = None
+
+
+def set_page_request_id(page: AsyncPage, req_id: str, trace_context: Optional[str] = None) -> None:
+    """登记页面当前处理的请求ID（提交提示前调用）"""
+    _page_request_ids[page] = req_id
+    if trace_context:
+        _page_trace_contexts[page] = trace_context
+    else:
+        _page_trace_contexts.pop(page, None)
+
+
+def get_page_request_id(page: AsyncPage) -> Optional[str]:
+    return _page_request_ids.get(page)
+
+
+def clear_page_request_id(page: AsyncPage) -> None:
+    _page_request_ids.pop(page, None)
+    _page_trace_contexts.pop(page, None)
+    _page_generation_configs.pop(page, None)
+    _page_prompt_placeholders.pop(page, None)
+
+
+def set_page_generation_config(page: AsyncPage, generation_config: Dict[str, Any]) -> None:
+    """登记页面当前请求的生成参数，随 GenerateContent 请求发送给流式代理改写"""
+    _page_generation_configs[page] = generation_config
+
+
+def set_page_prompt_placeholder(page: AsyncPage, placeholder: Optional[str]) -> None:
+    """登记（或以 None 清除）页面当前请求的占位提示"""
+    if placeholder is None:
+        _page_prompt_placeholders.pop(page, None)
+    else:
+        _page_prompt_placeholders[page] = placeholder
+
+
+def get_generate_content_template() -> Optional[Dict[str, Any]]:
+    return _generate_content_template
+
+
+def _capture_generate_content_template(request) -> None:
+    global _generate_content_template
+    try:
+        payload = json.loads(request.post_data or "")
+    except (json.JSONDecodeError, TypeError):
+        return
+    if not (isinstance(payload, list) and payload and isinstance(payload[0], str) and payload[0].startswith("models/")):
+        return
+    if _generate_content_template is None:
+        logger.info("已记录 GenerateContent 请求模板，直连引擎可用。")
+    _generate_content_template = {"url": request.url, "headers": dict(request.headers), "payload": payload}
+
+
+def get_verified_rewrite_fields() -> Set[str]:
+    return set(_verified_rewrite_fields)
+
+
+def record_generation_config_ack(frame: Dict[str, Any]) -> None:
+    """处理流式代理回报的改写结果，更新已确认可改写的字段"""
+    report = frame.get("config_rewrite") or {}
+    req_id = frame.get("req_id")
+    applied = set(report.get("applied") or [])
+    failed = set(report.get("failed") or [])
+
+    newly_verified = applied - _verified_rewrite_fields
+    if newly_verified:
+        logger.info(f"[{req_id}] 流式代理已确认可改写生成参数: {sorted(newly_verified)}，后续请求将跳过这些参数的页面调整。")
+    lost = failed & _verified_rewrite_fields
+    if lost:
+        logger.warning(f"[{req_id}] 流式代理未能改写生成参数 {sorted(lost)}，后续请求恢复通过页面调整。")
+    _verified_rewrite_fields.update(applied)
+    _verified_rewrite_fields.difference_update(failed)
+
+
+async def _setup_stream_request_tagging(context: AsyncBrowserContext):
+    """为 GenerateContent 请求注册路由，附加请求关联头和生成参数头"""
+    async def handle_generate_content_route(route):
+        started_at = time.perf_counter()
+        try:
+            await _tag_generate_content(route)
+        finally:
+            ROUTE_HANDLER_SECONDS.observe(time.perf_counter() - started_at, route="generate_content")
+
+    async def _tag_generate_content(route):
+        try:
+            _capture_generate_content_template(route.request)
+        except Exception as e:
+            logger.debug(f"记录 GenerateContent 请求模板失败: {e}")
+
+        req_id = None
+        try:
+            req_id = get_page_request_id(route.request.frame.page)
+        except Exception:
+            # Service Worker 等无 frame 的请求
+            pass
+
+        if not req_id:
+            await route.continue_()
+            return
+
+        headers = dict(route.request.headers)
+        headers[CORRELATION_HEADER] = req_id
+        page = route.request.frame.page
+        trace_context = _page_trace_contexts.get(page)
+        if trace_context:
+            headers[TRACE_HEADER] = trace_context
+        generation_config = dict(_page_generation_configs.get(page) or {})
+        placeholder = _page_prompt_placeholders.get(page)
+        if placeholder:
+            generation_config["prompt_placeholder"] = placeholder
+        if generation_config:
+            headers[GENERATION_CONFIG_HEADER] = json.dumps(generation_config)
+        await route.continue_(headers=headers)
+
+    try:
+        # Playwright 优先调用最后注册的匹配路由；模型列表路由只匹配 ListModels，与此不重叠
+        await context.route("**/*GenerateContent*", handle_generate_content_route)
+        logger.info("✅ 已设置 GenerateContent 请求关联标记")
+    except Exception as e:
+        logger.error(f"设置 GenerateContent 请求关联标记时发生错误: {e}")
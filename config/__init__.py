@@ -25,6 +25,7 @@ __all__ = [
     'USER_INPUT_END_MARKER_SERVER',
     'EXCLUDED_MODELS_FILENAME',
     'STREAM_TIMEOUT_LOG_STATE',
+    'ENABLE_GENERATION_CONFIG_REWRITE',
     
     # 超时配置
     'RESPONSE_COMPLETION_TIMEOUT',
@@ -67,10 +68,14 @@ __all__ = [
     'TEMPERATURE_INPUT_SELECTOR',
     'USE_URL_CONTEXT_SELECTOR',
     'UPLOAD_BUTTON_SELECTOR',
+    'TEXT_CHUNK_SELECTOR',
+    'THOUGHT_CHUNK_SELECTOR',
+    'FUNCTION_CALL_CHUNK_SELECTOR',
     
     # 设置配置
     'DEBUG_LOGS_ENABLED',
     'TRACE_LOGS_ENABLED',
+    'TRACE_EXPORT_PATH',
     'AUTO_SAVE_AUTH',
     'AUTH_SAVE_TIMEOUT',
     'AUTO_CONFIRM_LOGIN',
@@ -80,8 +85,26 @@ __all__ = [
     'LOG_DIR',
     'APP_LOG_FILE_PATH',
     'NO_PROXY_ENV',
+    'PLAYWRIGHT_LIVE_STREAMING',
+    'PROMPT_INJECTION_MIN_CHARS',
+    'STREAM_RECORD_DIR',
     'ENABLE_SCRIPT_INJECTION',
     'USERSCRIPT_PATH',
+    'PAGE_POOL_SIZE',
+    'ENABLE_STANDBY_PAGE',
+    'MODEL_AFFINITY_MAX_WAIT_S',
+    'WARM_MODEL_PAGES',
+    'WARM_PAGE_MAX',
+    'EXTRA_CAMOUFOX_WS_ENDPOINTS',
+    'EXTRA_AUTH_JSON_PATHS',
+    'BACKEND_MAX_CONSECUTIVE_FAILURES',
+    'ADMISSION_MAX_WAIT_S',
+    'ADMISSION_MAX_QUEUE_LENGTH',
+    'ENABLE_CONVERSATION_AFFINITY',
+    'CONVERSATION_AFFINITY_CACHE_SIZE',
+    'ENABLE_DIRECT_ENGINE',
+    'DIRECT_ENGINE_ENDPOINT',
+    'DIRECT_ENGINE_MAX_CONNECTIONS',
 
     # 工具函数
     'get_environment_variable',
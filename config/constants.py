@@ -24,6 +24,10 @@ ENABLE_URL_CONTEXT = os.environ.get('ENABLE_URL_CONTEXT', 'false').lower() in ('
 ENABLE_THINKING_BUDGET = os.environ.get('ENABLE_THINKING_BUDGET', 'false').lower() in ('true', '1', 'yes')
 DEFAULT_THINKING_BUDGET = int(os.environ.get('DEFAULT_THINKING_BUDGET', '8192'))
 ENABLE_GOOGLE_SEARCH = os.environ.get('ENABLE_GOOGLE_SEARCH', 'false').lower() in ('true', '1', 'yes')
+# 参数调整时先用一次页面脚本批量读取/写入所有控件，失败的控件再逐项调整
+ENABLE_BATCH_PARAMETER_ADJUSTMENT = os.environ.get('ENABLE_BATCH_PARAMETER_ADJUSTMENT', 'true').lower() in ('true', '1', 'yes')
+# 启用辅助流时由流式代理直接改写 GenerateContent 请求中的生成参数，确认生效后跳过对应的页面调整
+ENABLE_GENERATION_CONFIG_REWRITE = os.environ.get('ENABLE_GENERATION_CONFIG_REWRITE', 'true').lower() in ('true', '1', 'yes')
 
 # 默认停止序列 - 支持 JSON 格式配置
 try:
@@ -17,6 +17,10 @@ UPLOAD_BUTTON_SELECTOR = 'button[aria-label^="Insert assets"]'
 # --- 响应相关选择器 ---
 RESPONSE_CONTAINER_SELECTOR = 'ms-chat-turn .chat-turn-container.model'
 RESPONSE_TEXT_SELECTOR = 'ms-cmark-node.cmark-node'
+# 模型回复中的正文、思考过程和函数调用块
+TEXT_CHUNK_SELECTOR = 'ms-text-chunk'
+THOUGHT_CHUNK_SELECTOR = 'ms-thought-chunk'
+FUNCTION_CALL_CHUNK_SELECTOR = 'ms-function-call-chunk'
 
 # --- 加载和状态选择器 ---
 LOADING_SPINNER_SELECTOR = 'button[aria-label="Run"].run-button svg .stoppable-spinner'
@@ -12,6 +12,8 @@ load_dotenv()
 # --- 全局日志控制配置 ---
 DEBUG_LOGS_ENABLED = os.environ.get('DEBUG_LOGS_ENABLED', 'false').lower() in ('true', '1', 'yes')
 TRACE_LOGS_ENABLED = os.environ.get('TRACE_LOGS_ENABLED', 'false').lower() in ('true', '1', 'yes')
+# 请求追踪 span 的 JSONL 导出文件，留空则不记录
+TRACE_EXPORT_PATH = os.environ.get('TRACE_EXPORT_PATH', '').strip()
 
 # --- 认证相关配置 ---
 AUTO_SAVE_AUTH = os.environ.get('AUTO_SAVE_AUTH', '').lower() in ('1', 'true', 'yes')
@@ -48,7 +50,61 @@ def get_int_env(key: str, default: int = 0) -> int:
 # 注意：代理配置现在在 api_utils/app.py 中动态设置，根据 STREAM_PORT 环境变量决定
 NO_PROXY_ENV = os.environ.get('NO_PROXY')
 
+# 辅助流录制模式：不为空时流式代理把每次 GenerateContent 的请求/响应字节流（含时间戳）写入该目录的
+# gzip 压缩 JSONL 文件，可用 stream/replay_server.py 离线回放
+STREAM_RECORD_DIR = os.environ.get('STREAM_RECORD_DIR', '').strip()
+
+# 未启用辅助流 (STREAM_PORT=0) 时，通过页面内 MutationObserver 实时输出回复；关闭则在生成完成后一次性输出
+PLAYWRIGHT_LIVE_STREAMING = get_boolean_env('PLAYWRIGHT_LIVE_STREAMING', True)
+
+# 大提示注入：提示长度达到该字符数（且无图片）时，页面只提交占位提示，由辅助流代理把请求体中的
+# 对话内容替换为按 user/model 轮次构建的完整内容，避免在输入框中渲染超长文本（0 表示禁用，需启用辅助流）
+PROMPT_INJECTION_MIN_CHARS = max(0, get_int_env('PROMPT_INJECTION_MIN_CHARS', 0))
+
 # --- 脚本注入配置 ---
 ENABLE_SCRIPT_INJECTION = get_boolean_env('ENABLE_SCRIPT_INJECTION', True)
 USERSCRIPT_PATH = get_environment_variable('USERSCRIPT_PATH', 'browser_utils/more_modles.js')
-# 注意：MODEL_CONFIG_PATH 已废弃，现在直接从油猴脚本解析模型数据
\ No newline at end of file
+# 注意：MODEL_CONFIG_PATH 已废弃，现在直接从油猴脚本解析模型数据
+
+# --- 并发与调度配置 ---
+# 同一浏览器上下文中并发处理请求的 AI Studio 页面数量
+PAGE_POOL_SIZE = max(1, get_int_env('PAGE_POOL_SIZE', 1))
+# 备用页面：每个通用页面另开一个已清空的页面，请求结束后直接换用，原页面在后台清空并验证，
+# 清空不再占用下一个请求的时间（每个页面多占用一个浏览器标签页）
+ENABLE_STANDBY_PAGE = get_boolean_env('ENABLE_STANDBY_PAGE', False)
+
+# 模型亲和调度：优先处理与页面当前模型相同的排队请求，减少模型切换；
+# 被跳过的请求等待超过该秒数后恢复先进先出（0 表示禁用）
+MODEL_AFFINITY_MAX_WAIT_S = max(0, get_int_env('MODEL_AFFINITY_MAX_WAIT_S', 20))
+
+# 常驻模型页面：为列表中的每个模型预先打开一个已切换到该模型的页面，请求直接路由到对应页面（逗号分隔的模型 ID）
+WARM_MODEL_PAGES = [m.strip() for m in os.environ.get('WARM_MODEL_PAGES', '').split(',') if m.strip()]
+# 每个后端实例最多保留的常驻模型页面数，超出时按最近最少使用 (LRU) 原则将页面改派给新模型
+WARM_PAGE_MAX = max(len(WARM_MODEL_PAGES), get_int_env('WARM_PAGE_MAX', len(WARM_MODEL_PAGES)))
+
+# 额外后端实例：每个实例对应一个独立的 Camoufox 浏览器 WebSocket 端点和认证文件（逗号分隔）
+EXTRA_CAMOUFOX_WS_ENDPOINTS = [e.strip() for e in os.environ.get('EXTRA_CAMOUFOX_WS_ENDPOINTS', '').split(',') if e.strip()]
+EXTRA_AUTH_JSON_PATHS = [p.strip() for p in os.environ.get('EXTRA_AUTH_JSON_PATHS', '').split(',') if p.strip()]
+# 后端实例连续失败多少次后暂停分配请求（冷却期过后重新尝试，成功一次即恢复）
+BACKEND_MAX_CONSECUTIVE_FAILURES = max(1, get_int_env('BACKEND_MAX_CONSECUTIVE_FAILURES', 3))
+
+# 准入控制：按各模型（区分流式/非流式）的平均处理耗时估算新请求的排队等待时间，
+# 超过该秒数时直接以 429 拒绝并返回 Retry-After（0 表示不限制，默认关闭）
+ADMISSION_MAX_WAIT_S = max(0, get_int_env('ADMISSION_MAX_WAIT_S', 0))
+# 单个请求队列的最大排队请求数，达到后以 429 拒绝（0 表示不限制）
+ADMISSION_MAX_QUEUE_LENGTH = max(0, get_int_env('ADMISSION_MAX_QUEUE_LENGTH', 0))
+
+# 对话亲和：请求结束后保留页面上的对话，下一个请求延续该对话（消息为页面对话加一条新的用户消息）时
+# 跳过清空、只提交新的用户消息；其它请求在开始处理前再清空对话
+ENABLE_CONVERSATION_AFFINITY = get_boolean_env('ENABLE_CONVERSATION_AFFINITY', False)
+# 记录保留对话的页面数上限（LRU），超出的页面在下次使用时清空
+CONVERSATION_AFFINITY_CACHE_SIZE = max(1, get_int_env('CONVERSATION_AFFINITY_CACHE_SIZE', 8))
+
+# --- 直连引擎配置 ---
+# 直连 GenerateContent：复用浏览器会话的 Cookie 和页面最近一次请求的请求头/请求体模板，
+# 不经过页面直接调用接口；认证失败或响应格式无法解析时回退到页面流程（不支持图片和工具调用）
+ENABLE_DIRECT_ENGINE = get_boolean_env('ENABLE_DIRECT_ENGINE', False)
+# 覆盖直连请求的目标地址（如本地模拟服务），留空时使用页面请求模板中的地址
+DIRECT_ENGINE_ENDPOINT = os.environ.get('DIRECT_ENGINE_ENDPOINT', '').strip()
+# 直连连接池的最大并发连接数
+DIRECT_ENGINE_MAX_CONNECTIONS = max(1, get_int_env('DIRECT_ENGINE_MAX_CONNECTIONS', 8))
@@ -0,0 +1,189 @@
+"""
+指标收集
+提供计数器、仪表和直方图，并按 Prometheus 文本格式 (0.0.4) 输出，供 /metrics 端点抓取。
+各指标可在事件循环和后台线程（辅助流通道读取线程）中同时更新
+"""
+
+import math
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# 覆盖从页面操作（几十毫秒）到长生成（数分钟）的范围
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_registry: List["_Metric"] = []
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    items = [f'{name}="{_escape_label(value)}"' for name, value in pairs]
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """可任意设置的瞬时值"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [各桶计数..., 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0] * len(self.buckets) + [0.0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """按 Prometheus 文本格式输出所有已注册指标"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# --- 指标定义 ---
+STAGE_DURATION_SECONDS = Histogram(
+    "aistudio_stage_duration_seconds",
+    "Per-request stage duration (queue_wait, model_switch, param_adjust, fill, submit, first_token, completion, clear).",
+    ["stage"],
+)
+SNAPSHOT_SAVE_SECONDS = Histogram(
+    "aistudio_snapshot_save_seconds",
+    "Time spent saving error snapshots (screenshot and HTML).",
+)
+REQUEST_OUTCOMES_TOTAL = Counter(
+    "aistudio_request_outcomes_total",
+    "Chat completion requests by HTTP status (499 client closed, 502 upstream/page failure, 504 timeout).",
+    ["status"],
+)
+TOKENS_TOTAL = Counter(
+    "aistudio_tokens_total",
+    "Tokens estimated by calculate_usage_stats.",
+    ["type"],
+)
+QUEUE_DEPTH = Gauge(
+    "aistudio_queue_depth",
+    "Requests waiting in the request queues, sampled at scrape time.",
+)
+COMPLETION_DETECTIONS_TOTAL = Counter(
+    "aistudio_completion_detections_total",
+    "How response completion was detected (observer, observer_heuristic, poll, poll_heuristic, timeout).",
+    ["method"],
+)
+RESPONSE_EXTRACTIONS_TOTAL = Counter(
+    "aistudio_response_extractions_total",
+    "Which path served the final Playwright response (angular, dom, edit_button, copy_button, failed).",
+    ["path"],
+)
+PAGE_LOAD_SECONDS = Histogram(
+    "aistudio_page_load_seconds",
+    "Time for an AI Studio page navigation to reach domcontentloaded.",
+)
+ROUTE_HANDLER_SECONDS = Histogram(
+    "aistudio_route_handler_seconds",
+    "Time page requests spend in Python route handlers before continuing (list_models, generate_content).",
+    ["route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+STREAM_PROXY_BYTES_TOTAL = Counter(
+    "aistudio_stream_proxy_bytes_total",
+    "Bytes of frames received from the stream proxy process.",
+)
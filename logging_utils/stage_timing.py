@@ -0,0 +1,94 @@
+"""
+请求阶段耗时记录
+按请求ID记录各处理阶段（排队、模型切换、参数调整、填充、提交、首个 token、完成、清空）的耗时，
+请求结束后归档到最近记录中，供 /api/stage-timings 和基准测试脚本读取，并计入 /metrics 的阶段直方图
+"""
+
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+from .metrics import STAGE_DURATION_SECONDS
+
+# 阶段名称（按处理顺序）
+STAGE_QUEUE_WAIT = "queue_wait"
+STAGE_MODEL_SWITCH = "model_switch"
+STAGE_PARAM_ADJUST = "param_adjust"
+STAGE_FILL = "fill"
+STAGE_SUBMIT = "submit"
+STAGE_FIRST_TOKEN = "first_token"
+STAGE_COMPLETION = "completion"
+STAGE_CLEAR = "clear"
+STAGES = (STAGE_QUEUE_WAIT, STAGE_MODEL_SWITCH, STAGE_PARAM_ADJUST, STAGE_FILL, STAGE_SUBMIT,
+          STAGE_FIRST_TOKEN, STAGE_COMPLETION, STAGE_CLEAR)
+
+# 提交完成的时间点，首个 token 和完成耗时均从此刻算起
+MARK_SUBMITTED = "submitted"
+
+MAX_ACTIVE_REQUESTS = 512
+MAX_RECENT_REQUESTS = 256
+
+_active: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_recent: Deque[Dict[str, Any]] = deque(maxlen=MAX_RECENT_REQUESTS)
+
+
+def _entry(req_id: str) -> Dict[str, Any]:
+    entry = _active.get(req_id)
+    if entry is None:
+        entry = {"req_id": req_id, "started_at": time.time(), "stages": {}, "marks": {}}
+        _active[req_id] = entry
+        while len(_active) > MAX_ACTIVE_REQUESTS:
+            _active.popitem(last=False)
+    return entry
+
+
+def record_stage(req_id: str, stage: str, seconds: float) -> None:
+    """记录阶段耗时（同一阶段多次记录时累加，如回退后的重新提交）"""
+    stages = _entry(req_id)["stages"]
+    stages[stage] = stages.get(stage, 0.0) + max(0.0, seconds)
+
+
+@contextmanager
+def stage_timer(req_id: str, stage: str):
+    """记录 with 代码块的耗时（异常时同样记录）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(req_id, stage, time.perf_counter() - start)
+
+
+def mark(req_id: str, name: str) -> None:
+    _entry(req_id)["marks"][name] = time.perf_counter()
+
+
+def record_since_mark(req_id: str, mark_name: str, stage: str, once: bool = True) -> None:
+    """记录从某个时间点到现在的耗时；once 为 True 时阶段已有记录则忽略"""
+    entry = _active.get(req_id)
+    if entry is None or mark_name not in entry["marks"]:
+        return
+    if once and stage in entry["stages"]:
+        return
+    entry["stages"][stage] = time.perf_counter() - entry["marks"][mark_name]
+
+
+def finish_request(req_id: str) -> Optional[Dict[str, Any]]:
+    """请求全部阶段结束后归档，返回该请求的耗时记录（秒）"""
+    entry = _active.pop(req_id, None)
+    if entry is None:
+        return None
+    record = {
+        "req_id": req_id,
+        "started_at": entry["started_at"],
+        "stages": {stage: round(seconds, 6) for stage, seconds in entry["stages"].items()},
+    }
+    _recent.append(record)
+    for stage, seconds in entry["stages"].items():
+        STAGE_DURATION_SECONDS.observe(seconds, stage=stage)
+    return record
+
+
+def get_recent_timings(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    records = list(_recent)
+    return records[-limit:] if limit else records
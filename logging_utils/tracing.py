@@ -0,0 +1,252 @@
+"""
+请求追踪
+以 OpenTelemetry 风格的 span（trace_id / span_id / parent_span_id、起止时间、属性、状态）记录
+请求经过的各个环节，由进程内导出器逐行追加写入 JSONL 文件，无需外部采集服务。
+未调用 configure_tracing() 配置导出文件时，所有 span 操作均为空操作。
+
+同一任务内通过 contextvars 自动建立父子关系；跨任务（路由 -> 队列 Worker -> 流式响应生成器）
+用 get_trace_context() 取得 W3C traceparent 字符串显式传递；跨进程（流式代理）通过请求头传递，
+代理回报的 span 由 export_remote_spans() 写入同一文件
+"""
+
+import functools
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+
+_TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_exporter: Optional["JsonlSpanExporter"] = None
+
+
+class JsonlSpanExporter:
+    """把结束的 span 以 JSON 行追加写入文件（线程安全）"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def export(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + '\n')
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Span:
+    """一个计时区间；end() 后导出"""
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = "error"
+        self.attributes["error"] = f"{type(error).__name__}: {error}"
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.end_time is not None:
+            return
+        if error is not None:
+            self.record_error(error)
+        self.end_time = time.time()
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # 在其它上下文中结束（如异步生成器被回收时），无需恢复
+                pass
+            self._token = None
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export({
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_span_id": self.parent_span_id,
+                "name": self.name,
+                "start_time": self.start_time,
+                "end_time": self.end_time,
+                "duration_ms": round((self.end_time - self.start_time) * 1000, 3),
+                "status": self.status,
+                "attributes": self.attributes,
+            })
+
+
+class _NoopSpan:
+    """追踪未启用时返回的占位 span"""
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def record_error(self, error: BaseException) -> None:
+        pass
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def configure_tracing(path: str) -> bool:
+    """设置 JSONL 导出文件并启用追踪；path 为空时禁用"""
+    global _exporter
+    shutdown_tracing()
+    if path:
+        _exporter = JsonlSpanExporter(path)
+    return _exporter is not None
+
+
+def shutdown_tracing() -> None:
+    global _exporter
+    exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.close()
+
+
+def is_tracing_enabled() -> bool:
+    return _exporter is not None
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """解析 W3C traceparent，返回 (trace_id, parent_span_id)"""
+    if not value:
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    return (match.group(1), match.group(2)) if match else None
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def get_trace_context() -> Optional[str]:
+    """当前 span 的 traceparent，供跨任务/跨进程传递"""
+    span = _current_span.get()
+    return span.traceparent if span is not None else None
+
+
+def begin_span(name: str, parent: Optional[str] = None, activate: bool = True, **attributes):
+    """
+    开始一个 span。parent 为 traceparent 字符串，未提供时使用当前上下文中的 span 作为父级；
+    activate 为 True 时在 end() 前作为当前 span（须在同一任务中 end）
+    """
+    if _exporter is None:
+        return NOOP_SPAN
+    parsed = parse_traceparent(parent)
+    if parsed is None:
+        active = _current_span.get()
+        parsed = (active.trace_id, active.span_id) if active is not None else (secrets.token_hex(16), None)
+    span = Span(name, parsed[0], parsed[1], attributes)
+    if activate:
+        span._token = _current_span.set(span)
+    return span
+
+
+@contextmanager
+def start_span(name: str, parent: Optional[str] = None, **attributes):
+    span = begin_span(name, parent, **attributes)
+    try:
+        yield span
+    except BaseException as e:
+        span.end(error=e)
+        raise
+    finally:
+        span.end()
+
+
+def traced(name: str):
+    """为协程函数包裹一个 span"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _exporter is None:
+                return await func(*args, **kwargs)
+            with start_span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def trace_async_iterable(source: AsyncIterator[Any], name: str, parent: Optional[str] = None,
+                               **attributes) -> AsyncIterator[Any]:
+    """
+    包装异步数据源：从第一次读取到数据源结束（或被关闭）记为一个 span，
+    并记录条目数和首个条目到达的时间
+    """
+    if _exporter is None:
+        async for item in source:
+            yield item
+        return
+    span = begin_span(name, parent, activate=False, **attributes)
+    count = 0
+    try:
+        async for item in source:
+            if count == 0:
+                span.set_attribute("first_item_ms", round((time.time() - span.start_time) * 1000, 3))
+            count += 1
+            yield item
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        span.set_attribute("items", count)
+        span.end()
+
+
+def export_remote_spans(report: Dict[str, Any]) -> None:
+    """
+    导出其它进程（流式代理）回报的 span：
+    {"traceparent": "...", "spans": [{"name", "start_time", "end_time", "attributes"}, ...]}
+    """
+    exporter = _exporter
+    parsed = parse_traceparent(report.get("traceparent"))
+    if exporter is None or parsed is None:
+        return
+    trace_id, parent_span_id = parsed
+    spans: Iterable[Dict[str, Any]] = report.get("spans") or []
+    for remote in spans:
+        start_time = float(remote.get("start_time") or 0.0)
+        end_time = float(remote.get("end_time") or start_time)
+        exporter.export({
+            "trace_id": trace_id,
+            "span_id": secrets.token_hex(8),
+            "parent_span_id": parent_span_id,
+            "name": remote.get("name", "remote"),
+            "start_time": start_time,
+            "end_time": end_time,
+            "duration_ms": round((end_time - start_time) * 1000, 3),
+            "status": remote.get("status", "ok"),
+            "attributes": remote.get("attributes") or {},
+        })
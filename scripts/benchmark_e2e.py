@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+端到端延迟基准测试（本地 AI Studio 替身页面）
+
+启动 scripts/fake_aistudio_server.py 中的替身页面，用真实的 FastAPI 服务（server.py 子进程，
+通过 Playwright 驱动浏览器）向其发送请求，最后从 /api/stage-timings 读取各阶段耗时：
+排队、参数调整、填充、提交、首个 token、完成、清空，输出 p50/p95。
+不依赖 Google 账号和网络，适合在改动前后各运行一次进行对比。
+
+浏览器：默认用 `python -m playwright run-server` 启动 Playwright 浏览器服务
+（需已执行 `playwright install firefox`），也可用 --ws-endpoint 指定已运行的 Camoufox 实例。
+服务以 STREAM_PORT=0 启动，响应完全来自页面。
+
+示例：
+  python scripts/benchmark_e2e.py --runs 20
+  python scripts/benchmark_e2e.py --runs 50 --concurrency 4 --tokens 200 --token-interval-ms 5
+  python scripts/benchmark_e2e.py --ws-endpoint ws://127.0.0.1:9222/xxxx --no-stream
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_aistudio_server import FakeAIStudio, add_generation_args  # noqa: E402
+from logging_utils.stage_timing import STAGES  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _report(name: str, values):
+    if not values:
+        print(f"{name:<14} n=0")
+        return
+    values_ms = sorted(v * 1000 for v in values)
+    p95 = values_ms[max(0, int(len(values_ms) * 0.95) - 1)]
+    print(f"{name:<14} n={len(values_ms):<4} mean={statistics.mean(values_ms):8.1f}ms "
+          f"p50={statistics.median(values_ms):8.1f}ms p95={p95:8.1f}ms max={values_ms[-1]:8.1f}ms")
+
+
+def _start_browser_server(port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "playwright", "run-server", "--port", str(port), "--host", "127.0.0.1"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def _start_app(args, ws_endpoint: str, url_pattern: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "CAMOUFOX_WS_ENDPOINT": ws_endpoint,
+        "LAUNCH_MODE": "debug",
+        "ACTIVE_AUTH_JSON_PATH": "",
+        "AI_STUDIO_URL_PATTERN": url_pattern,
+        "STREAM_PORT": "0",
+        "ENABLE_DIRECT_ENGINE": "false",
+        "PORT": str(args.app_port),
+    })
+    log_file = open(args.app_log, "w", encoding="utf-8") if args.app_log else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, "server.py"], cwd=ROOT_DIR, env=env,
+                            stdout=log_file, stderr=subprocess.STDOUT)
+
+
+async def _wait_until_ready(session, base_url: str, proc: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务进程已退出 (code={proc.returncode})，可用 --app-log 查看日志")
+        try:
+            async with session.get(f"{base_url}/health") as resp:
+                if resp.status == 200:
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(1.0)
+    raise RuntimeError(f"服务在 {timeout:.0f}s 内未就绪")
+
+
+async def _send_request(session, base_url: str, args, index: int):
+    payload = {
+        "model": args.model,
+        "stream": args.stream,
+        "messages": [{"role": "user", "content": f"{args.prompt} #{index}"}],
+    }
+    start = time.perf_counter()
+    ttft = None
+    async with session.post(f"{base_url}/v1/chat/completions", json=payload) as resp:
+        if resp.status != 200:
+            print(f"  request {index + 1}: HTTP {resp.status} {(await resp.text())[:200]}")
+            return None
+        if args.stream:
+            async for raw_line in resp.content:
+                line = raw_line.decode("utf-8", "ignore").strip()
+                if ttft is None and line.startswith("data: ") and line != "data: [DONE]":
+                    try:
+                        delta = (json.loads(line[6:]).get("choices") or [{}])[0].get("delta") or {}
+                    except json.JSONDecodeError:
+                        continue
+                    if delta.get("content"):
+                        ttft = time.perf_counter() - start
+        else:
+            await resp.read()
+    return ttft, time.perf_counter() - start
+
+
+async def _run_requests(session, base_url: str, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def one(index: int):
+        async with semaphore:
+            result = await _send_request(session, base_url, args, index)
+            if result is not None:
+                results.append(result)
+
+    await asyncio.gather(*(one(i) for i in range(args.runs)))
+    return results
+
+
+async def _benchmark(args):
+    import aiohttp
+
+    fake = FakeAIStudio(
+        port=args.fake_port, first_token_ms=args.first_token_ms,
+        token_interval_ms=args.token_interval_ms, tokens=args.tokens, error_rate=args.error_rate,
+    )
+    fake.start()
+    print(f"替身页面: https://{fake.url_pattern}prompts/new_chat")
+
+    browser_proc = None
+    ws_endpoint = args.ws_endpoint
+    if not ws_endpoint:
+        browser_port = _free_port()
+        browser_proc = _start_browser_server(browser_port)
+        ws_endpoint = f"ws://127.0.0.1:{browser_port}/"
+        await asyncio.sleep(2.0)
+
+    app_proc = _start_app(args, ws_endpoint, fake.url_pattern)
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    try:
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=300)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await _wait_until_ready(session, base_url, app_proc, args.startup_timeout)
+            print(f"服务已就绪: {base_url}")
+
+            for i in range(args.warmup):
+                await _send_request(session, base_url, args, -1 - i)
+            if args.warmup:
+                # 丢弃预热请求的阶段记录
+                async with session.get(f"{base_url}/api/stage-timings", params={"limit": 1000}) as resp:
+                    warmup_ids = {r["req_id"] for r in (await resp.json()).get("requests", [])}
+            else:
+                warmup_ids = set()
+
+            started = time.perf_counter()
+            results = await _run_requests(session, base_url, args)
+            elapsed = time.perf_counter() - started
+
+            # 清空在响应返回后进行，稍等最后一个请求的清空阶段落盘
+            await asyncio.sleep(args.settle)
+            async with session.get(f"{base_url}/api/stage-timings", params={"limit": 1000}) as resp:
+                records = [r for r in (await resp.json()).get("requests", []) if r["req_id"] not in warmup_ids]
+    finally:
+        app_proc.terminate()
+        try:
+            app_proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            app_proc.kill()
+        if browser_proc:
+            browser_proc.terminate()
+        fake.close()
+
+    print(f"\n完成 {len(results)}/{args.runs} 个请求，用时 {elapsed:.2f}s "
+          f"(并发 {args.concurrency}, 吞吐 {len(results) / elapsed if elapsed else 0:.2f} req/s)")
+    print("\n客户端观测：")
+    if args.stream:
+        _report("ttft", [ttft for ttft, _ in results if ttft is not None])
+    _report("total", [total for _, total in results])
+    print("\n服务端阶段耗时 (/api/stage-timings)：")
+    for stage in STAGES:
+        _report(stage, [r["stages"][stage] for r in records if stage in r["stages"]])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "client": results, "stages": records}, f, ensure_ascii=False, indent=2)
+        print(f"\n原始数据已写入 {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于本地替身页面的端到端延迟基准测试")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1, help="正式计时前的预热请求数")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--no-stream", dest="stream", action="store_false")
+    parser.add_argument("--model", default="gemini-fake-pro")
+    parser.add_argument("--prompt", default="用一句话介绍你自己。")
+    parser.add_argument("--ws-endpoint", default=None, help="已运行的浏览器 WebSocket 端点")
+    parser.add_argument("--fake-port", type=int, default=0, help="替身页面端口（0 为随机）")
+    parser.add_argument("--app-port", type=int, default=_free_port())
+    parser.add_argument("--app-log", default=None, help="服务子进程日志文件")
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--settle", type=float, default=3.0, help="最后一个请求返回后等待清空阶段完成的秒数")
+    parser.add_argument("--output", default=None, help="将原始数据写入 JSON 文件")
+    add_generation_args(parser)
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+页面网络路由开销基准测试（本地 AI Studio 替身页面）
+
+比较三种路由注册方式下替身页面的加载时间和页面内请求的往返时间：
+  catch_all  原先的 context.route("**/*")：每个请求都进入 Python 处理器，非模型列表请求再 continue_()
+  narrow     按 URL 谓词只拦截 ListModels（当前实现）
+  none       不注册路由（下限）
+页面内请求用 fetch 重复请求替身服务的 /fake/config，以 performance.now() 计时，
+反映生成期间页面每个请求（脚本、遥测、GenerateContent 等）额外承担的开销。
+
+浏览器：默认用 `python -m playwright run-server` 启动 Playwright 浏览器服务
+（需已执行 `playwright install firefox`），也可用 --ws-endpoint 指定已运行的 Camoufox 实例。
+
+示例：
+  python scripts/benchmark_route_overhead.py --loads 10 --fetches 200
+  python scripts/benchmark_route_overhead.py --ws-endpoint ws://127.0.0.1:9222/xxxx --modes catch_all narrow
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_e2e import _free_port, _report, _start_browser_server  # noqa: E402
+from fake_aistudio_server import FakeAIStudio  # noqa: E402
+
+MODES = ("catch_all", "narrow", "none")
+
+_FETCH_LOOP_SCRIPT = """
+async (count) => {
+    const durations = [];
+    for (let i = 0; i < count; i++) {
+        const started = performance.now();
+        const response = await fetch('/fake/config', { cache: 'no-store' });
+        await response.text();
+        durations.push(performance.now() - started);
+    }
+    return durations;
+}
+"""
+
+
+async def _handle_model_list(route):
+    response = await route.fetch()
+    await route.fulfill(response=response, body=await response.body())
+
+
+async def _install_routes(context, mode: str, routed: list):
+    if mode == "catch_all":
+        async def handle_all(route):
+            routed.append(route.request.url)
+            if 'ListModels' in route.request.url:
+                await _handle_model_list(route)
+            else:
+                await route.continue_()
+        await context.route("**/*", handle_all)
+    elif mode == "narrow":
+        async def handle_model_list(route):
+            routed.append(route.request.url)
+            await _handle_model_list(route)
+        await context.route(lambda url: 'ListModels' in url, handle_model_list)
+
+
+async def _run_mode(browser, mode: str, url: str, args):
+    context = await browser.new_context(ignore_https_errors=True)
+    routed = []
+    await _install_routes(context, mode, routed)
+    loads, fetches = [], []
+    try:
+        for _ in range(args.loads):
+            page = await context.new_page()
+            started = time.perf_counter()
+            await page.goto(url, wait_until="load", timeout=60000)
+            loads.append(time.perf_counter() - started)
+            fetches.extend(ms / 1000 for ms in await page.evaluate(_FETCH_LOOP_SCRIPT, args.fetches))
+            await page.close()
+    finally:
+        await context.close()
+    return {"page_load": loads, "fetch": fetches, "routed_requests": len(routed)}
+
+
+async def _benchmark(args):
+    from playwright.async_api import async_playwright
+
+    fake = FakeAIStudio(port=args.fake_port)
+    fake.start()
+    url = f"https://{fake.url_pattern}prompts/new_chat"
+    print(f"替身页面: {url}")
+
+    browser_proc = None
+    ws_endpoint = args.ws_endpoint
+    if not ws_endpoint:
+        browser_port = _free_port()
+        browser_proc = _start_browser_server(browser_port)
+        ws_endpoint = f"ws://127.0.0.1:{browser_port}/"
+        await asyncio.sleep(2.0)
+
+    results = {}
+    try:
+        async with async_playwright() as playwright:
+            browser = await playwright.firefox.connect(ws_endpoint)
+            try:
+                # 预热：首次加载包含证书和连接建立的开销
+                await _run_mode(browser, "none", url, argparse.Namespace(loads=1, fetches=5))
+                for mode in args.modes:
+                    results[mode] = await _run_mode(browser, mode, url, args)
+            finally:
+                await browser.close()
+    finally:
+        if browser_proc:
+            browser_proc.terminate()
+        fake.close()
+
+    for mode, data in results.items():
+        print(f"\n[{mode}] 经过 Python 路由处理器的请求数: {data['routed_requests']}")
+        _report("page_load", data["page_load"])
+        _report("fetch", data["fetch"])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n原始数据已写入 {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较页面网络路由注册方式的加载时间和请求开销")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--loads", type=int, default=10, help="每种方式加载页面的次数")
+    parser.add_argument("--fetches", type=int, default=100, help="每次加载后页面内顺序发出的请求数")
+    parser.add_argument("--ws-endpoint", default=None, help="已运行的浏览器 WebSocket 端点")
+    parser.add_argument("--fake-port", type=int, default=0, help="替身页面端口（0 为随机）")
+    parser.add_argument("--output", default=None, help="将原始数据写入 JSON 文件")
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
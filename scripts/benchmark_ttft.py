@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+首 token 延迟 (TTFT) 基准测试
+
+两种模式：
+  simulate  在本地用子进程模拟辅助流，比较旧的 get_nowait + sleep(0.1) 轮询
+            与 StreamChannel 事件驱动两种消费方式的首帧投递延迟（默认）
+  server    向正在运行的代理服务发送流式请求，统计客户端观测到的 TTFT，
+            可在改动前后各运行一次进行对比
+
+示例：
+  python scripts/benchmark_ttft.py simulate --runs 50
+  python scripts/benchmark_ttft.py server --url http://127.0.0.1:2048 --runs 10 --api-key sk-xxx
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _producer(q, runs: int, frames: int):
+    """模拟辅助流进程：每轮随机延迟后推送若干帧，帧内带发送时间戳"""
+    for run in range(runs):
+        time.sleep(random.uniform(0.05, 0.25))
+        for seq in range(frames):
+            q.put(json.dumps({"run": run, "seq": seq, "sent_at": time.time(), "done": seq == frames - 1}))
+            time.sleep(0.005)
+
+
+async def _consume_polling(q, runs: int, frames: int):
+    """旧实现：get_nowait，队列为空时 sleep 0.1 秒"""
+    latencies = []
+    for _ in range(runs):
+        first = True
+        while True:
+            try:
+                data = json.loads(q.get_nowait())
+            except queue.Empty:
+                await asyncio.sleep(0.1)
+                continue
+            if first:
+                latencies.append(time.time() - data["sent_at"])
+                first = False
+            if data["done"]:
+                break
+    return latencies
+
+
+async def _consume_channel(q, runs: int, frames: int):
+    """新实现：StreamChannel 到达即投递"""
+    import logging
+    from api_utils.stream_channel import StreamChannel
+
+    channel = StreamChannel(q, logging.getLogger("benchmark_ttft"))
+    channel.start()
+    latencies = []
+    try:
+        for _ in range(runs):
+            first = True
+            while True:
+                data = await channel.get("benchmark")
+                if first:
+                    latencies.append(time.time() - data["sent_at"])
+                    first = False
+                if data["done"]:
+                    break
+    finally:
+        channel.stop()
+    return latencies
+
+
+def _report(name: str, latencies):
+    latencies_ms = sorted(v * 1000 for v in latencies)
+    p95 = latencies_ms[max(0, int(len(latencies_ms) * 0.95) - 1)]
+    print(f"{name:<10} n={len(latencies_ms):<4} mean={statistics.mean(latencies_ms):7.2f}ms "
+          f"p50={statistics.median(latencies_ms):7.2f}ms p95={p95:7.2f}ms max={latencies_ms[-1]:7.2f}ms")
+
+
+def run_simulate(args):
+    for name, consumer in (("polling", _consume_polling), ("channel", _consume_channel)):
+        q = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_producer, args=(q, args.runs, args.frames), daemon=True)
+        proc.start()
+        latencies = asyncio.run(consumer(q, args.runs, args.frames))
+        proc.join()
+        _report(name, latencies)
+
+
+async def _measure_server(args):
+    import aiohttp
+
+    headers = {"Content-Type": "application/json"}
+    if args.api_key:
+        headers["Authorization"] = f"Bearer {args.api_key}"
+    payload = {
+        "model": args.model,
+        "stream": True,
+        "messages": [{"role": "user", "content": args.prompt}],
+    }
+    latencies = []
+    async with aiohttp.ClientSession() as session:
+        for i in range(args.runs):
+            start = time.perf_counter()
+            ttft = None
+            async with session.post(f"{args.url.rstrip('/')}/v1/chat/completions", json=payload, headers=headers) as resp:
+                async for raw_line in resp.content:
+                    line = raw_line.decode("utf-8", "ignore").strip()
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+                    try:
+                        chunk = json.loads(line[6:])
+                    except json.JSONDecodeError:
+                        continue
+                    delta = (chunk.get("choices") or [{}])[0].get("delta") or {}
+                    if ttft is None and (delta.get("content") or delta.get("reasoning_content")):
+                        ttft = time.perf_counter() - start
+            if ttft is not None:
+                latencies.append(ttft)
+                print(f"  run {i + 1}: ttft={ttft * 1000:.1f}ms")
+            else:
+                print(f"  run {i + 1}: 未收到内容")
+    if latencies:
+        _report("server", latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="首 token 延迟基准测试")
+    sub = parser.add_subparsers(dest="mode")
+
+    sim = sub.add_parser("simulate", help="本地模拟辅助流，比较轮询与事件驱动的投递延迟")
+    sim.add_argument("--runs", type=int, default=50)
+    sim.add_argument("--frames", type=int, default=5)
+
+    srv = sub.add_parser("server", help="对运行中的服务测量客户端 TTFT")
+    srv.add_argument("--url", default="http://127.0.0.1:2048")
+    srv.add_argument("--runs", type=int, default=10)
+    srv.add_argument("--model", default="gemini-2.5-flash")
+    srv.add_argument("--prompt", default="用一句话介绍你自己。")
+    srv.add_argument("--api-key", default=os.environ.get("API_KEY"))
+
+    args = parser.parse_args()
+    if args.mode == "server":
+        asyncio.run(_measure_server(args))
+    else:
+        if args.mode is None:
+            args = sim.parse_args([])
+        run_simulate(args)
+
+
+if __name__ == "__main__":
+    main()
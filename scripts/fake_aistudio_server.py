@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+本地 AI Studio 替身服务
+
+通过 HTTPS 提供 scripts/fake_aistudio/index.html（实现 config/selectors.py 中的元素），
+并响应 ListModels 请求。生成内容为合成数据，首 token 延迟、token 间隔、token 数量
+和错误率可通过命令行参数设置，也可在运行中 POST /fake/config 修改（对之后加载的页面生效）。
+
+启动后让代理服务指向它：
+  AI_STUDIO_URL_PATTERN=localhost:8443/
+
+证书使用 stream.cert_manager 生成的 localhost 证书（浏览器上下文已忽略 HTTPS 错误）。
+
+示例：
+  python scripts/fake_aistudio_server.py --port 8443 --first-token-ms 300 --token-interval-ms 20 --tokens 50
+"""
+
+import argparse
+import json
+import os
+import ssl
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_aistudio', 'index.html')
+CONFIG_PLACEHOLDER = '/*__FAKE_CONFIG__*/{}'
+CERT_DOMAIN = 'localhost'
+
+DEFAULT_MODELS = [
+    {"id": "gemini-fake-pro", "display_name": "Gemini Fake Pro", "max_output_tokens": 65536},
+    {"id": "gemini-fake-flash", "display_name": "Gemini Fake Flash", "max_output_tokens": 8192},
+]
+
+
+def build_model_list(models):
+    """ListModels 响应，结构与 browser_utils.operations._handle_model_list_response 解析的三层列表一致"""
+    return [[
+        [f"models/{m['id']}", None, None, m["display_name"], f"{m['display_name']} (fake)",
+         None, m["max_output_tokens"], None, None, 0.95]
+        for m in models
+    ]]
+
+
+class FakeAIStudio:
+    """保存生成配置并创建 HTTPS 服务"""
+
+    def __init__(self, host='127.0.0.1', port=8443, first_token_ms=300, token_interval_ms=20,
+                 tokens=50, error_rate=0.0, models=None, cert_dir='certs'):
+        self.host = host
+        self.port = port
+        self.cert_dir = cert_dir
+        self.lock = threading.Lock()
+        self.config = {
+            "models": models or DEFAULT_MODELS,
+            "first_token_ms": first_token_ms,
+            "token_interval_ms": token_interval_ms,
+            "tokens": tokens,
+            "error_rate": error_rate,
+        }
+        with open(PAGE_PATH, encoding='utf-8') as f:
+            self.page_template = f.read()
+        self._server = None
+
+    @property
+    def url_pattern(self):
+        """供 AI_STUDIO_URL_PATTERN 使用的值"""
+        return f"{CERT_DOMAIN}:{self.port}/"
+
+    def render_page(self):
+        with self.lock:
+            config_json = json.dumps(self.config)
+        return self.page_template.replace(CONFIG_PLACEHOLDER, config_json)
+
+    def update_config(self, changes):
+        with self.lock:
+            for key, value in changes.items():
+                if key in self.config:
+                    self.config[key] = value
+            return dict(self.config)
+
+    def _ssl_context(self):
+        from stream.cert_manager import CertificateManager
+        CertificateManager(self.cert_dir).get_domain_cert(CERT_DOMAIN)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(
+            os.path.join(self.cert_dir, f"{CERT_DOMAIN}.crt"),
+            os.path.join(self.cert_dir, f"{CERT_DOMAIN}.key"),
+        )
+        return context
+
+    def start(self):
+        """在后台线程中启动服务，返回实际端口"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type):
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def do_GET(self):
+                if self.path.startswith('/prompts/'):
+                    self._send(200, fake.render_page(), 'text/html; charset=utf-8')
+                elif self.path == '/fake/config':
+                    with fake.lock:
+                        self._send(200, json.dumps(fake.config), 'application/json')
+                else:
+                    self._send(404, 'not found', 'text/plain')
+
+            def do_POST(self):
+                body = self._read_body()
+                if 'ListModels' in self.path:
+                    with fake.lock:
+                        models = fake.config["models"]
+                    self._send(200, json.dumps(build_model_list(models)), 'application/json+protobuf')
+                elif self.path == '/fake/config':
+                    try:
+                        changes = json.loads(body or b'{}')
+                    except json.JSONDecodeError:
+                        self._send(400, 'invalid json', 'text/plain')
+                        return
+                    self._send(200, json.dumps(fake.update_config(changes)), 'application/json')
+                else:
+                    self._send(404, 'not found', 'text/plain')
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._server.socket = self._ssl_context().wrap_socket(self._server.socket, server_side=True)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.port
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def add_generation_args(parser):
+    parser.add_argument('--first-token-ms', type=int, default=300, help='提交后到首个 token 的延迟')
+    parser.add_argument('--token-interval-ms', type=int, default=20, help='token 之间的间隔')
+    parser.add_argument('--tokens', type=int, default=50, help='每次生成的 token 数量')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='以错误提示代替生成的概率 (0-1)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 AI Studio 替身服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--cert-dir', default='certs')
+    add_generation_args(parser)
+    args = parser.parse_args()
+
+    fake = FakeAIStudio(
+        host=args.host, port=args.port, first_token_ms=args.first_token_ms,
+        token_interval_ms=args.token_interval_ms, tokens=args.tokens,
+        error_rate=args.error_rate, cert_dir=args.cert_dir,
+    )
+    port = fake.start()
+    print(f"替身页面已启动: https://{CERT_DOMAIN}:{port}/prompts/new_chat")
+    print(f"AI_STUDIO_URL_PATTERN={fake.url_pattern}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -83,12 +83,18 @@ from api_utils import (
     validate_chat_request,
     _process_request_refactored,
     create_app,
-    queue_worker
+    queue_worker,
+    RequestScheduler
 )
 
 # --- stream queue ---
 STREAM_QUEUE:Optional[multiprocessing.Queue] = None
+STREAM_CONTROL_QUEUE:Optional[multiprocessing.Queue] = None
 STREAM_PROCESS = None
+STREAM_CHANNEL = None
+
+# --- direct engine ---
+direct_engine = None
 
 # --- Global State ---
 playwright_manager: Optional[AsyncPlaywright] = None
@@ -108,12 +114,18 @@ model_list_fetch_event = asyncio.Event()
 
 current_ai_studio_model_id: Optional[str] = None
 model_switching_lock: Optional[Lock] = None
+# 按目标模型统计的模型切换次数，以及因模型亲和调度而提前处理的请求数
+model_switch_counts: Dict[str, int] = {}
+affinity_promoted_requests = 0
 
 excluded_model_ids: Set[str] = set()
 
-request_queue: Optional[Queue] = None
+request_queue: Optional[RequestScheduler] = None
 processing_lock: Optional[Lock] = None
 worker_task: Optional[Task] = None
+page_pool: List[Any] = []
+backend_pool: List[Any] = []
+worker_tasks: List[Task] = []
 
 page_params_cache: Dict[str, Any] = {}
 params_cache_lock: Optional[Lock] = None
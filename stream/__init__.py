@@ -8,20 +8,27 @@ def start(*args, **kwargs):
     启动流式代理服务器，兼容位置参数和关键字参数
 
     位置参数模式（与参考文件兼容）：
-        start(queue, port, proxy)
+        start(queue, port, proxy[, control_queue[, record_dir]])
 
     关键字参数模式：
-        start(queue=queue, port=port, proxy=proxy)
+        start(queue=queue, port=port, proxy=proxy, control_queue=control_queue, record_dir=record_dir)
+
+    control_queue 为 API 侧发往代理的控制队列（大提示注入的对话内容）
+    record_dir 不为空时启用录制模式，GenerateContent 的请求/响应字节流写入该目录
     """
     if args:
         # 位置参数模式（与参考文件兼容）
         queue = args[0] if len(args) > 0 else None
         port = args[1] if len(args) > 1 else None
         proxy = args[2] if len(args) > 2 else None
+        control_queue = args[3] if len(args) > 3 else None
+        record_dir = args[4] if len(args) > 4 else None
     else:
         # 关键字参数模式
         queue = kwargs.get('queue', None)
         port = kwargs.get('port', None)
         proxy = kwargs.get('proxy', None)
+        control_queue = kwargs.get('control_queue', None)
+        record_dir = kwargs.get('record_dir', None)
 
-    asyncio.run(main.builtin(queue=queue, port=port, proxy=proxy))
\ No newline at end of file
+    asyncio.run(main.builtin(queue=queue, port=port, proxy=proxy, control_queue=control_queue, record_dir=record_dir))
\ No newline at end of file
@@ -0,0 +1,125 @@
+import base64
+import gzip
+import json
+import logging
+import re
+import time
+from pathlib import Path
+
+# Request headers whose values are replaced before they are written to disk
+REDACTED_HEADERS = (b'cookie', b'authorization', b'x-goog-authuser')
+REDACTED_VALUE = b'<redacted>'
+CAPTURE_SUFFIX = '.jsonl.gz'
+
+
+def _encode(data):
+    return base64.b64encode(bytes(data)).decode('ascii')
+
+
+def _redact_headers(headers_data):
+    lines = bytes(headers_data).split(b'\r\n')
+    for i, line in enumerate(lines[1:], start=1):
+        name, sep, _ = line.partition(b':')
+        if sep and name.strip().lower() in REDACTED_HEADERS:
+            lines[i] = name + b': ' + REDACTED_VALUE
+    return b'\r\n'.join(lines)
+
+
+class CaptureRecorder:
+    """
+    Records one GenerateContent exchange to a gzip-compressed JSONL file.
+
+    Line types, each with ``t`` = seconds since the request was sent:
+        {"type": "request", "host", "path", "headers", "body"}
+        {"type": "response", "data"}   one line per upstream read
+        {"type": "end"}
+    Byte fields are base64 encoded, so the file keeps the exact wire bytes
+    (HTTP framing, chunked encoding, compression) the proxy saw.
+    """
+
+    def __init__(self, record_dir, stream_id):
+        self.logger = logging.getLogger('capture')
+        record_dir = Path(record_dir)
+        record_dir.mkdir(parents=True, exist_ok=True)
+        safe_id = re.sub(r'[^A-Za-z0-9_.-]', '_', str(stream_id))
+        self.path = record_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_id}{CAPTURE_SUFFIX}"
+        # Level 1: recording runs on the proxy event loop, favour speed over ratio
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8', compresslevel=1)
+        self._start = time.monotonic()
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def _write(self, record):
+        if self._file is None:
+            return
+        record["t"] = round(time.monotonic() - self._start, 6)
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def record_request(self, host, path, headers_data, body):
+        self._write({
+            "type": "request",
+            "host": host,
+            "path": path,
+            "headers": _encode(_redact_headers(headers_data)),
+            "body": _encode(body),
+        })
+
+    def record_response(self, data):
+        if data:
+            self._write({"type": "response", "data": _encode(data)})
+
+    def close(self):
+        if self._file is None:
+            return
+        self._write({"type": "end"})
+        try:
+            self._file.close()
+        except OSError as e:
+            self.logger.error(f"Failed to finish capture {self.path}: {e}")
+        self._file = None
+        self.logger.info(f"Capture written: {self.path}")
+
+
+def load_capture(path):
+    """
+    Read a capture file. Returns
+        {"path", "host", "path_info", "request_headers", "request_body",
+         "chunks": [(t, bytes), ...], "complete": bool}
+    where chunk times are relative to the first response chunk.
+    """
+    capture = {
+        "path": str(path),
+        "host": None,
+        "path_info": None,
+        "request_headers": b"",
+        "request_body": b"",
+        "chunks": [],
+        "complete": False,
+    }
+    first_t = None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            kind = record.get("type")
+            if kind == "request":
+                capture["host"] = record.get("host")
+                capture["path_info"] = record.get("path")
+                capture["request_headers"] = base64.b64decode(record.get("headers") or "")
+                capture["request_body"] = base64.b64decode(record.get("body") or "")
+            elif kind == "response":
+                t = float(record.get("t") or 0.0)
+                if first_t is None:
+                    first_t = t
+                capture["chunks"].append((t - first_t, base64.b64decode(record["data"])))
+            elif kind == "end":
+                capture["complete"] = True
+    return capture
+
+
+def list_captures(capture_dir):
+    return sorted(Path(capture_dir).glob(f"*{CAPTURE_SUFFIX}"))
@@ -3,6 +3,35 @@ import logging
 import re
 import zlib
 
+RESPONSE_PAYLOAD_PATTERN = re.compile(rb'\[\[\[null,.*?]],"model"]')
+# Request header added by the browser side to correlate a GenerateContent call
+# with an API request id; stripped before the request is forwarded upstream
+CORRELATION_HEADER = 'x-aistudio-proxy-req-id'
+# Request header carrying the generation config of the API request (JSON);
+# stripped before forwarding and patched into the GenerateContent payload
+GENERATION_CONFIG_HEADER = 'x-aistudio-proxy-generation-config'
+# Request header carrying the W3C traceparent of the API request span; stripped
+# before forwarding, the proxy reports its own spans under that parent
+TRACE_HEADER = 'x-aistudio-proxy-traceparent'
+_UNDECIDED = object()
+
+# GenerateContent request payload layout (JSPB arrays):
+#   [model, contents, safety_settings, generation_config, ...]
+# generation_config follows the GenerationConfig field numbers (index = field - 1)
+GENERATION_CONFIG_INDEX = 3
+GENERATION_CONFIG_FIELDS = {
+    "stop_sequences": 1,
+    "max_output_tokens": 3,
+    "temperature": 4,
+    "top_p": 5,
+}
+# thinking_config is [include_thoughts, thinking_budget]; only present when the
+# thinking budget toggle is enabled on the page
+THINKING_CONFIG_INDEX = 21
+# contents is a list of turns: [[[null, text], ...], role]
+PROMPT_CONTENTS_INDEX = 1
+
+
 class HttpInterceptor:
     """
     Class to intercept and process HTTP requests and responses
@@ -35,70 +64,236 @@ class HttpInterceptor:
         # Add more conditions as needed
         return False
     
-    async def process_request(self, request_data, host, path):
+    async def process_request(self, request_data, host, path, generation_config=None, prompt_contents=None):
         """
-        Process the request data before sending to the server
+        Process the request data before sending to the server.
+        prompt_contents is (placeholder, contents): the placeholder prompt the page
+        submitted is replaced with the full conversation contents.
+        Returns (request_data, report); report is None unless a generation config or
+        prompt contents were supplied, otherwise {"applied": [...], "failed": [...]}
+        plus "prompt_injected" when prompt contents were supplied
         """
         if not self.should_intercept(host, path):
-            return request_data
+            return request_data, None
         
         # Log the request
         self.logger.info(f"Intercepted request to {host}{path}")
-        
+
+        if not generation_config and prompt_contents is None:
+            return request_data, None
+
+        report = {"applied": [], "failed": sorted(generation_config or {})}
+        if prompt_contents is not None:
+            report["prompt_injected"] = False
+
         try:
-            return request_data
+            payload = json.loads(bytes(request_data).decode('utf-8'))
         except (json.JSONDecodeError, UnicodeDecodeError):
             # Not JSON or not UTF-8, just pass through
-            return request_data
+            return request_data, report
+
+        changed = False
+        if generation_config:
+            report["applied"], report["failed"] = self.rewrite_generation_config(payload, generation_config)
+            changed = bool(report["applied"])
+            self.logger.info(f"Rewrote generation config fields {report['applied']} (unrecognised: {report['failed']})")
+        if prompt_contents is not None:
+            placeholder, contents = prompt_contents
+            report["prompt_injected"] = self.replace_prompt_contents(payload, placeholder, contents)
+            changed = changed or report["prompt_injected"]
+            self.logger.info(f"Prompt contents injection: {'replaced' if report['prompt_injected'] else 'placeholder not found'}")
+
+        if not changed:
+            return request_data, report
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return body, report
+
+    @staticmethod
+    def replace_prompt_contents(payload, placeholder, contents):
+        """
+        Replace the conversation contents of a parsed GenerateContent payload when
+        its last turn carries the placeholder prompt. Returns True if replaced
+        """
+        if not (isinstance(payload, list) and len(payload) > PROMPT_CONTENTS_INDEX
+                and isinstance(payload[PROMPT_CONTENTS_INDEX], list) and payload[PROMPT_CONTENTS_INDEX]):
+            return False
+        last_turn = payload[PROMPT_CONTENTS_INDEX][-1]
+        if placeholder not in json.dumps(last_turn, ensure_ascii=False):
+            return False
+        payload[PROMPT_CONTENTS_INDEX] = contents
+        return True
+
+    @staticmethod
+    def rewrite_generation_config(payload, generation_config):
+        """
+        Patch generation config values into a parsed GenerateContent payload in place.
+        Fields whose slot does not have the expected shape are left untouched.
+        Returns (applied, failed) lists of field names
+        """
+        applied, failed = [], []
+        config = None
+        if (isinstance(payload, list) and len(payload) > GENERATION_CONFIG_INDEX
+                and isinstance(payload[0], str) and payload[0].startswith('models/')
+                and isinstance(payload[GENERATION_CONFIG_INDEX], list)):
+            config = payload[GENERATION_CONFIG_INDEX]
+
+        for field, value in generation_config.items():
+            if config is None:
+                failed.append(field)
+                continue
+
+            if field == "thinking_budget":
+                thinking = config[THINKING_CONFIG_INDEX] if len(config) > THINKING_CONFIG_INDEX else None
+                if (isinstance(thinking, list) and len(thinking) >= 2
+                        and (thinking[1] is None or isinstance(thinking[1], int))):
+                    thinking[1] = int(value)
+                    applied.append(field)
+                else:
+                    failed.append(field)
+                continue
+
+            index = GENERATION_CONFIG_FIELDS.get(field)
+            if index is None or len(config) <= index:
+                failed.append(field)
+                continue
+            current = config[index]
+            if field == "stop_sequences":
+                if current is None or isinstance(current, list):
+                    config[index] = list(value) or None
+                    applied.append(field)
+                else:
+                    failed.append(field)
+            elif current is None or (isinstance(current, (int, float)) and not isinstance(current, bool)):
+                config[index] = int(value) if field == "max_output_tokens" else float(value)
+                applied.append(field)
+            else:
+                failed.append(field)
+        return sorted(applied), sorted(failed)
     
+    def create_response_decoder(self, headers, req_id=None, stream_id=None):
+        """
+        Create a stateful decoder for a single intercepted response
+        """
+        return ResponseStreamDecoder(self, headers, req_id=req_id, stream_id=stream_id)
+
+    @staticmethod
+    def _pop_header(headers_data, name):
+        """
+        Remove a header from raw request headers.
+        Returns (headers_data, value or None)
+        """
+        marker = name.encode() + b':'
+        value = None
+        lines = headers_data.split(b'\r\n')
+        kept = [lines[0]]
+        for line in lines[1:]:
+            if line.lower().startswith(marker):
+                value = line.split(b':', 1)[1].strip().decode('utf-8', 'ignore') or None
+                continue
+            kept.append(line)
+        if value is None:
+            return headers_data, None
+        return b'\r\n'.join(kept), value
+
+    @classmethod
+    def extract_correlation_id(cls, headers_data):
+        """
+        Remove the correlation header from raw request headers.
+        Returns (headers_data, req_id or None)
+        """
+        return cls._pop_header(headers_data, CORRELATION_HEADER)
+
+    @classmethod
+    def extract_trace_parent(cls, headers_data):
+        """
+        Remove the trace header from raw request headers.
+        Returns (headers_data, traceparent or None)
+        """
+        return cls._pop_header(headers_data, TRACE_HEADER)
+
+    @classmethod
+    def extract_generation_config(cls, headers_data):
+        """
+        Remove the generation config header from raw request headers.
+        Returns (headers_data, dict or None)
+        """
+        headers_data, value = cls._pop_header(headers_data, GENERATION_CONFIG_HEADER)
+        if value is None:
+            return headers_data, None
+        try:
+            config = json.loads(value)
+        except json.JSONDecodeError:
+            return headers_data, None
+        return headers_data, config if isinstance(config, dict) else None
+
+    @staticmethod
+    def get_content_length(headers_data):
+        for line in headers_data.split(b'\r\n')[1:]:
+            if line.lower().startswith(b'content-length:'):
+                try:
+                    return int(line.split(b':', 1)[1].strip())
+                except ValueError:
+                    return None
+        return None
+
+    @staticmethod
+    def set_content_length(headers_data, length):
+        lines = headers_data.split(b'\r\n')
+        for i, line in enumerate(lines):
+            if i and line.lower().startswith(b'content-length:'):
+                lines[i] = b'Content-Length: ' + str(length).encode()
+        return b'\r\n'.join(lines)
+
     async def process_response(self, response_data, host, path, headers):
         """
         Process the response data before sending to the client
         """
         try:
-            # Handle chunked encoding
-            decoded_data, is_done = self._decode_chunked(bytes(response_data))
-            # Handle gzip encoding
-            decoded_data = self._decompress_zlib_stream(decoded_data)
-            result  = self.parse_response(decoded_data)
-            result["done"] = is_done
-            return result
+            decoder = self.create_response_decoder(headers)
+            decoder.feed(bytes(response_data))
+            return decoder.take_delta()
         except Exception as e:
             raise e
 
     def parse_response(self, response_data):
-        pattern = rb'\[\[\[null,.*?]],"model"]'
-        matches = []
-        for match_obj in re.finditer(pattern, response_data):
-            matches.append(match_obj.group(0))
-
-
         resp = {
             "reason": "",
             "body": "",
             "function": [],
         }
-
-        # Print each full match
-        for match in matches:
-            json_data = json.loads(match)
-
-            try:
-                payload = json_data[0][0]
-            except Exception as e:
+        for match_obj in RESPONSE_PAYLOAD_PATTERN.finditer(response_data):
+            parsed = self.parse_payload(match_obj.group(0))
+            if parsed is None:
                 continue
+            kind, value = parsed
+            if kind == "function":
+                resp["function"].append(value)
+            else:
+                resp[kind] = resp[kind] + value
+        return resp
 
-            if len(payload)==2: # body
-                resp["body"] = resp["body"] + payload[1]
-            elif len(payload) == 11 and payload[1] is None and type(payload[10]) == list:  # function
-                array_tool_calls = payload[10]
-                func_name = array_tool_calls[0]
-                params = self.parse_toolcall_params(array_tool_calls[1])
-                resp["function"].append({"name":func_name, "params":params})
-            elif len(payload) > 2: # reason
-                resp["reason"] = resp["reason"] + payload[1]
+    def parse_payload(self, match):
+        """
+        Classify one matched ``[[[null,...]],"model"]`` fragment.
+        Returns ("body" | "reason" | "function", value) or None
+        """
+        json_data = json.loads(match)
 
-        return resp
+        try:
+            payload = json_data[0][0]
+        except Exception as e:
+            return None
+
+        if len(payload)==2: # body
+            return "body", payload[1]
+        elif len(payload) == 11 and payload[1] is None and type(payload[10]) == list:  # function
+            array_tool_calls = payload[10]
+            func_name = array_tool_calls[0]
+            params = self.parse_toolcall_params(array_tool_calls[1])
+            return "function", {"name":func_name, "params":params}
+        elif len(payload) > 2: # reason
+            return "reason", payload[1]
+        return None
 
     def parse_toolcall_params(self, args):
         try:
@@ -123,40 +318,201 @@ class HttpInterceptor:
         except Exception as e:
             raise e
 
-    @staticmethod
-    def _decompress_zlib_stream(compressed_stream):
-        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)  # zlib header
-        decompressed = decompressor.decompress(compressed_stream)
-        return decompressed
 
-    @staticmethod
-    def _decode_chunked(response_body: bytes) -> tuple[bytes, bool]:
-        chunked_data = bytearray()
-        while True:
-            # print(' '.join(format(x, '02x') for x in response_body))
-
-            length_crlf_idx = response_body.find(b"\r\n")
-            if length_crlf_idx == -1:
-                break
-
-            hex_length = response_body[:length_crlf_idx]
-            try:
-                length = int(hex_length, 16)
-            except ValueError as e:
-                logging.error(f"Parsing chunked length failed: {e}")
-                break
-
-            if length == 0:
-                length_crlf_idx = response_body.find(b"0\r\n\r\n")
-                if length_crlf_idx != -1:
-                    return chunked_data, True
-
-            if length + 2 > len(response_body):
-                break
-
-            chunked_data.extend(response_body[length_crlf_idx + 2:length_crlf_idx + 2 + length])
-            if length_crlf_idx + 2 + length + 2 > len(response_body):
-                break
-
-            response_body = response_body[length_crlf_idx + 2 + length + 2:]
-        return chunked_data, False
+class ResponseStreamDecoder:
+    """
+    Incremental decoder for one intercepted response.
+
+    Keeps the chunked-framing state, a single live zlib decompressor and the
+    unparsed tail of the decompressed stream, so every byte read from the
+    server is de-chunked, inflated and regex-scanned exactly once.
+
+    Parsed fragments are buffered until ``take_delta()`` hands them out, so
+    consumers receive only what is new since the previous frame. Every frame
+    carries the request correlation id (if the browser sent one) and a
+    proxy-assigned stream id so the API side can route it.
+    """
+    _STATE_SIZE = 0
+    _STATE_DATA = 1
+    _STATE_DATA_CRLF = 2
+    _STATE_TRAILER = 3
+
+    def __init__(self, interceptor, headers=None, req_id=None, stream_id=None):
+        self.interceptor = interceptor
+        self.req_id = req_id
+        self.stream_id = stream_id
+        self.logger = interceptor.logger
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+
+        self.chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        try:
+            self._length_remaining = None if self.chunked else int(headers['content-length'])
+        except (KeyError, ValueError):
+            self._length_remaining = None
+
+        encoding = headers.get('content-encoding', '').lower()
+        self._decodable = True
+        if encoding in ('gzip', 'deflate'):
+            self._decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)
+        elif encoding:
+            # Unsupported encoding (e.g. br): the body cannot be decoded, so nothing is parsed from it
+            self.logger.warning(f"Unsupported content-encoding '{encoding}' for stream {stream_id}, payloads will not be parsed")
+            self._decodable = False
+            self._decompressor = None
+        else:
+            # No Content-Encoding header: decide from the first body bytes (gzip magic)
+            self._decompressor = _UNDECIDED
+
+        self._undecided_head = b""
+        self._raw = bytearray()
+        self._state = self._STATE_SIZE
+        self._chunk_remaining = 0
+        self._text = bytearray()
+
+        self._pending = {
+            "reason": [],
+            "body": [],
+            "function": [],
+        }
+        self.seq = 0
+        self.done = False
+        # Bytes received after the end of this response (next response on the connection)
+        self.unconsumed = b""
+
+    def feed(self, data):
+        """
+        Feed newly received body bytes, returns True if new payloads were parsed
+        """
+        if self.done:
+            self.unconsumed += bytes(data)
+            return False
+
+        body = self._dechunk(data) if self.chunked else self._take_identity(data)
+        if not self._decodable:
+            # Framing is still tracked so done / unconsumed stay correct
+            return False
+
+        if self._decompressor is _UNDECIDED:
+            # The gzip magic is two bytes and a read may end after the first one
+            body = self._undecided_head + body
+            if len(body) < 2 and not self.done:
+                self._undecided_head = body
+                return False
+            self._undecided_head = b""
+            self._decompressor = (
+                zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)
+                if body[:2] == b'\x1f\x8b' else None
+            )
+        if self._decompressor is not None and self._decompressor is not _UNDECIDED:
+            body = self._decompressor.decompress(body) if body else b""
+            # The terminating chunk may arrive alone in a later read: flush the buffered tail then
+            if self.done:
+                body += self._decompressor.flush()
+        return self._parse(body)
+
+    def finish(self):
+        """
+        Mark the response complete when the body ended without framing
+        (connection closed, or a client that already de-chunked the body).
+        Returns True if flushing parsed new payloads
+        """
+        if self.done:
+            return False
+        self.done = True
+        if self._decompressor is not None and self._decompressor is not _UNDECIDED:
+            return self._parse(self._decompressor.flush())
+        return False
+
+    def take_delta(self):
+        """
+        Fragments parsed since the previous call, numbered by ``seq``
+        """
+        delta = {
+            "req_id": self.req_id,
+            "stream_id": self.stream_id,
+            "seq": self.seq,
+            "reason": "".join(self._pending["reason"]),
+            "body": "".join(self._pending["body"]),
+            "function": self._pending["function"],
+            "done": self.done,
+        }
+        self.seq += 1
+        self._pending = {
+            "reason": [],
+            "body": [],
+            "function": [],
+        }
+        return delta
+
+    def _parse(self, body):
+        if not body:
+            return False
+        self._text.extend(body)
+        consumed = 0
+        parsed = False
+        for match_obj in RESPONSE_PAYLOAD_PATTERN.finditer(self._text):
+            consumed = match_obj.end()
+            result = self.interceptor.parse_payload(match_obj.group(0))
+            if result is None:
+                continue
+            kind, value = result
+            self._pending[kind].append(value)
+            parsed = True
+        if consumed:
+            del self._text[:consumed]
+        return parsed
+
+    def _take_identity(self, data):
+        if self._length_remaining is None:
+            return bytes(data)
+        body = bytes(data[:self._length_remaining])
+        self._length_remaining -= len(body)
+        if self._length_remaining <= 0:
+            self.done = True
+            self.unconsumed = bytes(data[len(body):])
+        return body
+
+    def _dechunk(self, data):
+        self._raw.extend(data)
+        out = bytearray()
+        while self._raw:
+            if self._state == self._STATE_SIZE:
+                crlf_idx = self._raw.find(b"\r\n")
+                if crlf_idx == -1:
+                    break
+                size_line = bytes(self._raw[:crlf_idx]).split(b";", 1)[0].strip()
+                del self._raw[:crlf_idx + 2]
+                try:
+                    length = int(size_line, 16)
+                except ValueError as e:
+                    self.logger.error(f"Parsing chunked length failed: {e}")
+                    self._raw.clear()
+                    break
+                if length == 0:
+                    self._state = self._STATE_TRAILER
+                else:
+                    self._chunk_remaining = length
+                    self._state = self._STATE_DATA
+            elif self._state == self._STATE_DATA:
+                take = min(self._chunk_remaining, len(self._raw))
+                out.extend(self._raw[:take])
+                del self._raw[:take]
+                self._chunk_remaining -= take
+                if self._chunk_remaining == 0:
+                    self._state = self._STATE_DATA_CRLF
+            elif self._state == self._STATE_DATA_CRLF:
+                if len(self._raw) < 2:
+                    break
+                del self._raw[:2]
+                self._state = self._STATE_SIZE
+            else:  # trailer section, terminated by an empty line
+                crlf_idx = self._raw.find(b"\r\n")
+                if crlf_idx == -1:
+                    break
+                del self._raw[:crlf_idx + 2]
+                if crlf_idx == 0:
+                    self.done = True
+                    self.unconsumed = bytes(self._raw)
+                    self._raw.clear()
+                    break
+        return bytes(out)
@@ -1,26 +1,46 @@
 import asyncio
+import itertools
+from collections import OrderedDict
 from typing import Optional
 import json
 import logging
+import queue as queue_module
 import ssl
 import multiprocessing
+import threading
+import time
 from pathlib import Path
 from urllib.parse import urlparse
 
 from stream.cert_manager import CertificateManager
 from stream.proxy_connector import ProxyConnector
 from stream.interceptors import HttpInterceptor
+from stream.capture import CaptureRecorder
+
+# How long a GenerateContent request waits for its prompt contents on the control queue
+PROMPT_CONTENTS_WAIT_SECONDS = 5.0
+# Prompt contents kept for requests that have not arrived yet
+MAX_PENDING_PROMPT_CONTENTS = 16
 
 class ProxyServer:
     """
     Asynchronous HTTPS proxy server with SSL inspection capabilities
     """
-    def __init__(self, host='0.0.0.0', port=3120, intercept_domains=None, upstream_proxy=None, queue: Optional[multiprocessing.Queue]=None):
+    def __init__(self, host='0.0.0.0', port=3120, intercept_domains=None, upstream_proxy=None, queue: Optional[multiprocessing.Queue]=None,
+                 control_queue: Optional[multiprocessing.Queue]=None, record_dir: Optional[str]=None):
         self.host = host
         self.port = port
         self.intercept_domains = intercept_domains or []
         self.upstream_proxy = upstream_proxy
         self.queue = queue
+        # API -> proxy messages: {"req_id", "placeholder", "contents"} for prompt injection
+        self.control_queue = control_queue
+        self._prompt_contents = OrderedDict()
+        # req_id -> future resolved when that request's prompt contents arrive on the control queue
+        self._prompt_contents_waiters = {}
+        self._loop = None
+        # Record mode: every GenerateContent exchange is written to a capture file in this directory
+        self.record_dir = record_dir
         
         # Initialize components
         self.cert_manager = CertificateManager()
@@ -30,10 +50,81 @@ class ProxyServer:
         log_dir = Path('logs')
         log_dir.mkdir(exist_ok=True)
         self.interceptor = HttpInterceptor(str(log_dir))
+        # Proxy-assigned id for every sniffed response, used when no correlation header is present.
+        # Prefixed with the port so ids stay unique when several proxies share one queue.
+        self._stream_ids = itertools.count(1)
         
         # Set up logging
         self.logger = logging.getLogger('proxy_server')
     
+    def _start_control_reader(self):
+        """
+        Read the control queue on a daemon thread and hand each message to the event
+        loop with call_soon_threadsafe, so waiting requests are woken as soon as it arrives
+        """
+        if self.control_queue is None:
+            return
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(target=self._read_control_queue, name="ProxyControlReader", daemon=True).start()
+
+    def _read_control_queue(self):
+        while not self._loop.is_closed():
+            try:
+                item = self.control_queue.get(timeout=0.5)
+            except queue_module.Empty:
+                continue
+            except (EOFError, OSError, ValueError):
+                # Queue closed: the API side is shutting down
+                item = None
+            try:
+                if item is None:
+                    self._loop.call_soon_threadsafe(self._close_control_queue)
+                    return
+                self._loop.call_soon_threadsafe(self._store_prompt_contents, item)
+            except RuntimeError:
+                # Event loop closed
+                return
+
+    def _close_control_queue(self):
+        self.control_queue = None
+        for waiter in self._prompt_contents_waiters.values():
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _store_prompt_contents(self, item):
+        try:
+            message = json.loads(item)
+            req_id = message["req_id"]
+            self._prompt_contents[req_id] = (message["placeholder"], message["contents"])
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            self.logger.error(f"Invalid control message: {e}")
+            return
+        while len(self._prompt_contents) > MAX_PENDING_PROMPT_CONTENTS:
+            self._prompt_contents.popitem(last=False)
+        waiter = self._prompt_contents_waiters.get(req_id)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def _take_prompt_contents(self, req_id):
+        """
+        Fetch the (placeholder, contents) the API side queued for this request.
+        The control queue is shared by all connections of this proxy, so entries
+        for other requests are kept until their own GenerateContent call arrives
+        """
+        if self.control_queue is None or not req_id:
+            return None
+        if req_id not in self._prompt_contents:
+            waiter = asyncio.get_running_loop().create_future()
+            self._prompt_contents_waiters[req_id] = waiter
+            try:
+                await asyncio.wait_for(waiter, timeout=PROMPT_CONTENTS_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if self._prompt_contents_waiters.get(req_id) is waiter:
+                    del self._prompt_contents_waiters[req_id]
+        return self._prompt_contents.pop(req_id, None)
+
     def should_intercept(self, host):
         """
         Determine if the connection to the host should be intercepted
@@ -217,10 +308,29 @@ class ProxyServer:
         client_buffer = bytearray()
         server_buffer = bytearray()
         should_sniff = False
+        # Set when a sniffed response failed to decode: the rest of that response is
+        # forwarded untouched instead of being parsed as the headers of a new one
+        response_passthrough = False
+        sniff_req_id = None
+        sniff_stream_id = None
+        # Capture of the GenerateContent request sent last, picked up by the response side
+        pending_capture = None
+        # Trace of the GenerateContent request sent last (when it carried a traceparent),
+        # completed with the response parse timings and reported back as a control frame
+        pending_trace = None
+
+        def _emit_control_frame(kind, report):
+            # Tells the API side whether a request rewrite ("config_rewrite" / "prompt_injection") took effect
+            if self.queue is not None and sniff_req_id:
+                self.queue.put(json.dumps({
+                    "req_id": sniff_req_id,
+                    "stream_id": sniff_stream_id,
+                    kind: report,
+                }))
 
         # Parse HTTP headers from client
         async def _process_client_data():
-            nonlocal client_buffer, should_sniff
+            nonlocal client_buffer, should_sniff, response_passthrough, sniff_req_id, sniff_stream_id, pending_capture, pending_trace
             
             try:
                 while True:
@@ -248,18 +358,93 @@ class ProxyServer:
                             await server_writer.drain()
                             client_buffer.clear()
                             continue
+
+                        # The browser only sends the next request once the previous response has ended
+                        response_passthrough = False
                         
                         # Check if we should intercept this request
                         if 'GenerateContent' in path:
+                            headers_data, sniff_req_id = self.interceptor.extract_correlation_id(headers_data)
+                            headers_data, generation_config = self.interceptor.extract_generation_config(headers_data)
+                            headers_data, traceparent = self.interceptor.extract_trace_parent(headers_data)
+                            request_started_at = time.time()
+                            sniff_stream_id = f"{self.port}-{next(self._stream_ids)}"
                             should_sniff = True
+
+                            prompt_contents = None
+                            placeholder = (generation_config or {}).pop("prompt_placeholder", None)
+                            if placeholder:
+                                prompt_contents = await self._take_prompt_contents(sniff_req_id)
+                                if prompt_contents is None or prompt_contents[0] != placeholder:
+                                    prompt_contents = None
+                                    _emit_control_frame("prompt_injection", {"ok": False, "reason": "contents_not_found"})
+
+                            # The body may span several reads; buffer all of it before rewriting
+                            trailing_data = b""
+                            content_length = self.interceptor.get_content_length(headers_data)
+                            if (generation_config or prompt_contents) and content_length is not None:
+                                while len(body_data) < content_length:
+                                    more = await client_reader.read(8192)
+                                    if not more:
+                                        break
+                                    body_data.extend(more)
+                                trailing_data = bytes(body_data[content_length:])
+                                body_data = body_data[:content_length]
+                            elif generation_config or prompt_contents:
+                                # Chunked or unknown length: forward untouched
+                                if generation_config:
+                                    _emit_control_frame("config_rewrite", {"applied": [], "failed": ["unknown_content_length"]})
+                                if prompt_contents:
+                                    _emit_control_frame("prompt_injection", {"ok": False, "reason": "unknown_content_length"})
+                                generation_config = prompt_contents = None
+
                             # Process the request body
-                            processed_body = await self.interceptor.process_request(
-                                body_data, host, path
+                            processed_body, rewrite_report = await self.interceptor.process_request(
+                                body_data, host, path, generation_config, prompt_contents
                             )
-                            
+                            if rewrite_report is not None:
+                                if "prompt_injected" in rewrite_report:
+                                    injected = rewrite_report.pop("prompt_injected")
+                                    _emit_control_frame("prompt_injection", {"ok": injected, "reason": "" if injected else "placeholder_not_found"})
+                                if generation_config:
+                                    _emit_control_frame("config_rewrite", rewrite_report)
+                            if len(processed_body) != len(body_data):
+                                headers_data = self.interceptor.set_content_length(headers_data, len(processed_body))
+
                             # Send the processed request
                             server_writer.write(headers_data)
                             server_writer.write(processed_body)
+                            if trailing_data:
+                                server_writer.write(trailing_data)
+
+                            pending_trace = None
+                            if traceparent:
+                                pending_trace = {
+                                    "req_id": sniff_req_id,
+                                    "stream_id": sniff_stream_id,
+                                    "traceparent": traceparent,
+                                    "spans": [{
+                                        "name": "proxy.request",
+                                        "start_time": request_started_at,
+                                        "end_time": time.time(),
+                                        "attributes": {
+                                            "stream_id": sniff_stream_id,
+                                            "body_bytes": len(processed_body),
+                                            "config_rewrite": bool(generation_config),
+                                            "prompt_injection": bool(prompt_contents),
+                                        },
+                                    }],
+                                }
+
+                            if self.record_dir:
+                                try:
+                                    if pending_capture is not None:
+                                        pending_capture.close()
+                                    pending_capture = CaptureRecorder(self.record_dir, sniff_stream_id)
+                                    pending_capture.record_request(host, path, headers_data, processed_body)
+                                except OSError as e:
+                                    self.logger.error(f"Failed to start capture: {e}")
+                                    pending_capture = None
                         else:
                             should_sniff = False
                             # Forward the request as is
@@ -280,58 +465,134 @@ class ProxyServer:
         
         # Parse HTTP headers from server
         async def _process_server_data():
-            nonlocal server_buffer, should_sniff
-            
+            nonlocal server_buffer, should_sniff, response_passthrough, pending_capture, pending_trace
+            # Decoder of the GenerateContent response currently being received;
+            # each read is handed to it once instead of re-decoding server_buffer
+            decoder = None
+            capture = None
+            trace = None
+
+            def _emit(resp):
+                if self.queue is not None:
+                    self.queue.put(json.dumps(resp))
+
+            def _finish_trace(error=None):
+                # Report the response span: first byte to last frame, with the time spent decoding
+                nonlocal trace
+                if trace is None:
+                    return
+                span = trace["response_span"]
+                span["end_time"] = time.time()
+                span["attributes"]["parse_ms"] = round(trace["parse_seconds"] * 1000, 3)
+                span["attributes"]["reads"] = trace["reads"]
+                if error is not None:
+                    span["status"] = "error"
+                    span["attributes"]["error"] = str(error)
+                trace["spans"].append(span)
+                _emit({
+                    "req_id": trace["req_id"],
+                    "stream_id": trace["stream_id"],
+                    "trace_spans": {"traceparent": trace["traceparent"], "spans": trace["spans"]},
+                })
+                trace = None
+
             try:
                 while True:
                     data = await server_reader.read(8192)
                     if not data:
                         break
 
-                    server_buffer.extend(data)
-                    if b'\r\n\r\n' in server_buffer:
-                        # Split headers and body
-                        headers_end = server_buffer.find(b'\r\n\r\n') + 4
-                        headers_data = server_buffer[:headers_end]
-                        body_data = server_buffer[headers_end:]
-
-                        # Parse status line and headers
-                        lines = headers_data.split(b'\r\n')
-
-                        # Parse headers
-                        headers = {}
-                        for i in range(1, len(lines)):
-                            if not lines[i]:
-                                continue
-                            try:
-                                key, value = lines[i].decode('utf-8').split(':', 1)
-                                headers[key.strip()] = value.strip()
-                            except ValueError:
-                                continue
-
-                        # Check if this is a response to a GenerateContent request
-                        if should_sniff:
-                            try:
-                                resp = await self.interceptor.process_response(
-                                    body_data, host, "", headers
-                                )
-
-                                if self.queue is not None:
-                                    self.queue.put(json.dumps(resp))
-                            except Exception as e:
-                                pass
-
-                    # Not enough data to parse headers, forward as is
                     client_writer.write(data)
                     # await client_writer.drain()
-                    if b"0\r\n\r\n" in server_buffer:
-                        server_buffer.clear()
+
+                    pending = data
+                    while pending:
+                        if decoder is None:
+                            if not should_sniff or response_passthrough:
+                                server_buffer.clear()
+                                break
+                            server_buffer.extend(pending)
+                            pending = b""
+                            if b'\r\n\r\n' not in server_buffer:
+                                break
+
+                            # Split headers and body
+                            headers_end = server_buffer.find(b'\r\n\r\n') + 4
+                            headers_data = server_buffer[:headers_end]
+                            pending = bytes(server_buffer[headers_end:])
+                            server_buffer.clear()
+
+                            # Parse status line and headers
+                            lines = headers_data.split(b'\r\n')
+
+                            # Parse headers
+                            headers = {}
+                            for i in range(1, len(lines)):
+                                if not lines[i]:
+                                    continue
+                                try:
+                                    key, value = lines[i].decode('utf-8').split(':', 1)
+                                    headers[key.strip()] = value.strip()
+                                except ValueError:
+                                    continue
+
+                            decoder = self.interceptor.create_response_decoder(
+                                headers, req_id=sniff_req_id, stream_id=sniff_stream_id
+                            )
+                            capture, pending_capture = pending_capture, None
+                            if capture is not None:
+                                capture.record_response(headers_data)
+                            trace, pending_trace = pending_trace, None
+                            if trace is not None:
+                                trace["parse_seconds"] = 0.0
+                                trace["reads"] = 0
+                                trace["response_span"] = {
+                                    "name": "proxy.response",
+                                    "start_time": time.time(),
+                                    "attributes": {"stream_id": trace["stream_id"]},
+                                }
+                            if not pending:
+                                break
+
+                        # Response to a GenerateContent request
+                        try:
+                            parse_started_at = time.perf_counter()
+                            parsed = decoder.feed(pending)
+                            if trace is not None:
+                                trace["parse_seconds"] += time.perf_counter() - parse_started_at
+                                trace["reads"] += 1
+                            if capture is not None:
+                                capture.record_response(pending[:len(pending) - len(decoder.unconsumed)])
+                            pending = decoder.unconsumed
+                            if parsed or decoder.done:
+                                _emit(decoder.take_delta())
+                        except Exception as e:
+                            self.logger.error(f"Error decoding intercepted response, forwarding the rest of it untouched: {e}")
+                            pending = b""
+                            decoder = None
+                            response_passthrough = True
+                            if capture is not None:
+                                capture.close()
+                                capture = None
+                            _finish_trace(error=e)
+                            continue
+
+                        if decoder.done:
+                            decoder = None
+                            if capture is not None:
+                                capture.close()
+                                capture = None
+                            _finish_trace()
             except Exception as e:
                 self.logger.error(f"Error processing server data: {e}")
             finally:
+                for unfinished in (capture, pending_capture):
+                    if unfinished is not None:
+                        unfinished.close()
+                _finish_trace(error="connection closed before the response finished")
                 client_writer.close()
                 # await client_writer.wait_closed()
-        
+
         # Create tasks for both directions
         client_to_server = asyncio.create_task(_process_client_data())
         server_to_client = asyncio.create_task(_process_server_data())
@@ -346,6 +607,7 @@ class ProxyServer:
         """
         Start the proxy server
         """
+        self._start_control_reader()
         server = await asyncio.start_server(
             self.handle_client, self.host, self.port
         )
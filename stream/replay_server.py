@@ -0,0 +1,159 @@
+"""
+Replay server for GenerateContent captures written by the proxy's record mode.
+
+Serves the recorded upstream response bytes (HTTP framing, chunking and
+compression as originally received) to any POST whose path contains
+GenerateContent, cycling through the capture files. Chunks are sent with
+the original inter-chunk timing scaled by ``speed``; speed 0 sends them as
+fast as possible.
+
+    python -m stream.replay_server --captures captures/ --port 9000 --speed 0
+
+Point the direct engine at it with
+DIRECT_ENGINE_ENDPOINT=http://127.0.0.1:9000/GenerateContent, or feed
+``iter_chunks()`` into a ResponseStreamDecoder for in-process benchmarks.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+from stream.capture import list_captures, load_capture
+
+MAX_HEADER_BYTES = 64 * 1024
+
+
+async def iter_chunks(capture, speed=1.0):
+    """
+    Yield the recorded response chunks of a capture, sleeping between them
+    so the stream keeps its recorded pacing (divided by ``speed``)
+    """
+    start = time.monotonic()
+    for t, data in capture["chunks"]:
+        if speed > 0:
+            delay = t / speed - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield data
+
+
+class ReplayServer:
+    """
+    Minimal HTTP/1.1 server answering GenerateContent requests from captures
+    """
+
+    def __init__(self, captures, host='127.0.0.1', port=9000, speed=1.0):
+        if not captures:
+            raise ValueError("No captures to replay")
+        self.captures = captures
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self._next_capture = itertools.cycle(captures)
+        self._server = None
+        self.served = 0
+        self.logger = logging.getLogger('replay_server')
+
+    @classmethod
+    def from_directory(cls, capture_dir, **kwargs):
+        captures = [load_capture(path) for path in list_captures(capture_dir)]
+        return cls([capture for capture in captures if capture["chunks"]], **kwargs)
+
+    async def _read_request(self, reader):
+        """
+        Read one request, returns (method, path, keep_alive) or None on EOF
+        """
+        try:
+            headers_data = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            return None
+        lines = headers_data.decode('latin-1').split('\r\n')
+        try:
+            method, path, version = lines[0].split(' ')
+        except ValueError:
+            return None
+
+        headers = {}
+        for line in lines[1:]:
+            key, sep, value = line.partition(':')
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length:
+            await reader.readexactly(length)
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+        return method, path, keep_alive
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, keep_alive = request
+
+                if method != 'POST' or 'GenerateContent' not in path:
+                    writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                    await writer.drain()
+                    if not keep_alive:
+                        break
+                    continue
+
+                capture = next(self._next_capture)
+                async for data in iter_chunks(capture, self.speed):
+                    writer.write(data)
+                    await writer.drain()
+                self.served += 1
+
+                # A truncated capture has no valid end of message: close to delimit it
+                if not keep_alive or not capture["complete"]:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            self.logger.debug(f"Client connection ended: {e}")
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.logger.info(f"Replaying {len(self.captures)} capture(s) on http://{self.host}:{self.port} (speed: {self.speed or 'max'})")
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay recorded GenerateContent exchanges')
+    parser.add_argument('--captures', required=True, help='Directory with *.jsonl.gz capture files')
+    parser.add_argument('--host', default='127.0.0.1', help='Host to bind the replay server')
+    parser.add_argument('--port', type=int, default=9000, help='Port to bind the replay server')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Timing multiplier for the recorded pacing (0 = as fast as possible)')
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    server = ReplayServer.from_directory(args.captures, host=args.host, port=args.port, speed=max(0.0, args.speed))
+    await server.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
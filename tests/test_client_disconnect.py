@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+uvicorn = pytest.importorskip("uvicorn")
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from api_utils.client_disconnect import ResponseCompletionMiddleware, watch_client_disconnect
+
+
+class PassThroughMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        return await call_next(request)
+
+
+def _build_app(with_base_middleware: bool) -> FastAPI:
+    app = FastAPI()
+    app.state.watchers = []
+
+    @app.get("/json")
+    async def json_route(request: Request):
+        app.state.watchers.append(watch_client_disconnect("json", request))
+        return JSONResponse({"ok": True})
+
+    @app.get("/stream")
+    async def stream_route(request: Request):
+        app.state.watchers.append(watch_client_disconnect("stream", request))
+
+        async def chunks():
+            for i in range(3):
+                yield f"data: {i}\n\n"
+                await asyncio.sleep(0.01)
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.get("/endless")
+    async def endless_route(request: Request):
+        app.state.watchers.append(watch_client_disconnect("endless", request))
+
+        async def chunks():
+            while True:
+                yield "data: tick\n\n"
+                await asyncio.sleep(0.05)
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    if with_base_middleware:
+        app.add_middleware(PassThroughMiddleware)
+    app.add_middleware(ResponseCompletionMiddleware)
+    return app
+
+
+async def _start_server(app):
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="off",
+                            timeout_graceful_shutdown=1)
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, port
+
+
+async def _send_request(port: int, path: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: test\r\nConnection: keep-alive\r\n\r\n".encode())
+    await writer.drain()
+    return reader, writer
+
+
+def _run(with_base_middleware: bool, scenario):
+    async def main():
+        app = _build_app(with_base_middleware)
+        server, task, port = await _start_server(app)
+        try:
+            await asyncio.wait_for(scenario(app, port), timeout=15)
+        finally:
+            server.should_exit = True
+            await asyncio.wait_for(task, timeout=5)
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("with_base_middleware", [False, True])
+@pytest.mark.parametrize("path,terminator", [("/json", b'{"ok":true}'), ("/stream", b"\r\n0\r\n\r\n")])
+def test_completed_response_is_not_a_disconnect(with_base_middleware, path, terminator):
+    async def scenario(app, port):
+        reader, writer = await _send_request(port, path)
+        received = b""
+        while not received.endswith(terminator):
+            received += await asyncio.wait_for(reader.read(4096), timeout=5)
+        # 连接保持打开，给监视器处理 receive 的时间
+        await asyncio.sleep(0.2)
+        watcher = app.state.watchers[0]
+        assert not watcher.disconnected
+        writer.close()
+
+    _run(with_base_middleware, scenario)
+
+
+@pytest.mark.parametrize("with_base_middleware", [False, True])
+def test_client_disconnect_during_stream_is_detected(with_base_middleware):
+    async def scenario(app, port):
+        reader, writer = await _send_request(port, "/endless")
+        assert b"data: tick" in await asyncio.wait_for(reader.read(4096), timeout=5)
+        writer.close()
+        await asyncio.wait_for(app.state.watchers[0].wait(), timeout=5)
+        assert app.state.watchers[0].disconnected
+
+    _run(with_base_middleware, scenario)
@@ -0,0 +1,50 @@
+import ast
+from pathlib import Path
+
+import config
+from config import constants, selectors, settings, timeouts
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SKIPPED_DIRS = {"tests", "deprecated_javascript_version", ".venv", "venv"}
+
+
+def _config_names():
+    names = set()
+    for module in (constants, timeouts, selectors, settings):
+        names.update(name for name in vars(module) if name.isupper())
+    return names
+
+
+def _star_importers():
+    for path in REPO_ROOT.rglob("*.py"):
+        if SKIPPED_DIRS & set(path.relative_to(REPO_ROOT).parts):
+            continue
+        tree = ast.parse(path.read_text(encoding="utf-8"))
+        if any(isinstance(node, ast.ImportFrom) and node.module == "config" and node.level == 0
+               and any(alias.name == "*" for alias in node.names) for node in ast.walk(tree)):
+            yield path, tree
+
+
+def _explicitly_bound(tree):
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom):
+            bound.update(alias.asname or alias.name for alias in node.names)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            bound.add(node.id)
+    return bound
+
+
+def test_config_names_used_via_star_import_are_exported():
+    unexported = _config_names() - set(config.__all__)
+    missing = {}
+    for path, tree in _star_importers():
+        used = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+        names = sorted((used & unexported) - _explicitly_bound(tree))
+        if names:
+            missing[str(path.relative_to(REPO_ROOT))] = names
+    assert not missing, f"config 名称经 `from config import *` 使用但不在 config.__all__ 中: {missing}"
+
+
+def test_all_entries_exist():
+    assert [name for name in config.__all__ if not hasattr(config, name)] == []
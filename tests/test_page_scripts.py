@@ -0,0 +1,30 @@
+import importlib
+import shutil
+import subprocess
+
+import pytest
+
+# 传给 page.evaluate 的页面脚本（函数表达式），须能被浏览器解析
+PAGE_SCRIPT_MODULES = [
+    "browser_utils.operations",
+    "browser_utils.batch_parameters",
+    "browser_utils.response_streaming",
+]
+
+NODE = shutil.which("node")
+
+
+def _page_scripts():
+    for module_name in PAGE_SCRIPT_MODULES:
+        module = importlib.import_module(module_name)
+        for name, value in vars(module).items():
+            if name.isupper() and name.endswith("_SCRIPT") and isinstance(value, str):
+                yield pytest.param(value, id=f"{module_name}.{name}")
+
+
+@pytest.mark.skipif(NODE is None, reason="需要 node 检查页面脚本语法")
+@pytest.mark.parametrize("script", list(_page_scripts()))
+def test_page_script_parses(script):
+    checker = "new Function('return (' + require('fs').readFileSync(0, 'utf8') + ')')"
+    result = subprocess.run([NODE, "-e", checker], input=script.strip(), capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,106 @@
+import gzip
+import json
+
+import pytest
+
+from stream.interceptors import HttpInterceptor
+
+
+def _body_payload(text):
+    return json.dumps([[[None, text]], "model"], separators=(",", ":"))
+
+
+def _response_body(*texts):
+    return ("[" + ",".join("[" + _body_payload(text) + "]" for text in texts) + "]").encode()
+
+
+def _chunked(data, chunk_size):
+    out = bytearray()
+    for i in range(0, len(data), chunk_size):
+        piece = data[i:i + chunk_size]
+        out += f"{len(piece):x}\r\n".encode() + piece + b"\r\n"
+    return bytes(out)
+
+
+def _split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _decode(decoder, reads):
+    body = []
+    for read in reads:
+        decoder.feed(read)
+        body.append(decoder.take_delta()["body"])
+    return "".join(body)
+
+
+@pytest.fixture
+def interceptor():
+    return HttpInterceptor()
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 64, 4096])
+def test_chunked_gzip_split_reads(interceptor, read_size):
+    texts = ["Hello", ", ", "world", "!" * 300]
+    wire = _chunked(gzip.compress(_response_body(*texts)), 50) + b"0\r\n\r\n"
+    decoder = interceptor.create_response_decoder(
+        {"Transfer-Encoding": "chunked", "Content-Encoding": "gzip"}, req_id="r1", stream_id="s1"
+    )
+
+    assert _decode(decoder, _split(wire, read_size)) == "".join(texts)
+    assert decoder.done
+
+
+def test_terminating_chunk_alone_flushes_gzip_tail(interceptor):
+    # 终止块单独到达时也要结束解压（flush）并发出 done 帧
+    compressed = gzip.compress(_response_body("tail text"))
+    decoder = interceptor.create_response_decoder({"Transfer-Encoding": "chunked", "Content-Encoding": "gzip"})
+    decoder.feed(_chunked(compressed, len(compressed)))
+    first = decoder.take_delta()["body"]
+
+    decoder.feed(b"0\r\n\r\n")
+    delta = decoder.take_delta()
+
+    assert first + delta["body"] == "tail text"
+    assert delta["done"]
+
+
+def test_gzip_detected_without_content_encoding_header(interceptor):
+    wire = _chunked(gzip.compress(_response_body("sniffed")), 16) + b"0\r\n\r\n"
+    decoder = interceptor.create_response_decoder({"Transfer-Encoding": "chunked"})
+
+    assert _decode(decoder, _split(wire, 5)) == "sniffed"
+
+
+def test_content_length_body_and_next_response_bytes(interceptor):
+    body = _response_body("plain")
+    decoder = interceptor.create_response_decoder({"Content-Length": str(len(body))})
+
+    decoder.feed(body[:10])
+    decoder.feed(body[10:] + b"HTTP/1.1 200 OK\r\n")
+
+    assert decoder.take_delta()["body"] == "plain"
+    assert decoder.done
+    assert decoder.unconsumed == b"HTTP/1.1 200 OK\r\n"
+
+
+def test_unsupported_encoding_tracks_framing_without_parsing(interceptor):
+    wire = _chunked(b"\x8b\x00not-brotli", 4) + b"0\r\n\r\nnext"
+    decoder = interceptor.create_response_decoder({"Transfer-Encoding": "chunked", "Content-Encoding": "br"})
+
+    assert not decoder.feed(wire)
+    assert decoder.done
+    assert decoder.unconsumed == b"next"
+
+
+def test_seq_numbers_deltas(interceptor):
+    decoder = interceptor.create_response_decoder({"Transfer-Encoding": "chunked"}, stream_id="s")
+    body = _response_body("a", "b")
+    decoder.feed(_chunked(body, len(body)))
+    first = decoder.take_delta()
+    decoder.feed(b"0\r\n\r\n")
+    last = decoder.take_delta()
+
+    assert (first["seq"], first["body"], first["done"]) == (0, "ab", False)
+    assert (last["seq"], last["body"], last["done"]) == (1, "", True)
+    assert last["stream_id"] == "s"